@@ -0,0 +1,125 @@
+"""
+Output-size benchmark for claude_magic: display traffic and saved notebook size.
+
+Runs N %%claude turns (default 50) in a headless IPython shell against
+bench/fake_claude.py and records every display message the way a frontend
+would: each update replaces the output with the same display_id. Reports
+display updates, bytes sent per update and in total, and the size of the
+resulting .ipynb (nbformat's JSON layout, one cell per turn).
+
+Usage:
+    python bench/bench_notebook.py [--turns 50] [--scenario "scenario:short chars=3000"] [--out nb.ipynb]
+"""
+
+import argparse
+import collections
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_suite import _case_env  # noqa: E402  (fake CLI on PATH, temp config)
+
+
+def run(turns, prompt, out=None):
+    from IPython.core.displaypub import DisplayPublisher
+    from IPython.core.interactiveshell import InteractiveShell
+
+    cells = []
+
+    class _Frontend(DisplayPublisher):
+        """Keeps each cell's outputs up to date and counts message bytes."""
+
+        updates = 0
+        bytes = 0
+
+        def publish(self, data, metadata=None, source=None, *, transient=None,
+                    update=False, **kwargs):
+            type(self).updates += 1
+            type(self).bytes += len(json.dumps({"data": data, "metadata": metadata or {}}))
+            display_id = (transient or {}).get("display_id")
+            output = {"output_type": "display_data", "data": data, "metadata": metadata or {}}
+            if update:
+                for cell in cells:
+                    for i, old in enumerate(cell):
+                        if old.get("_id") == display_id:
+                            cell[i] = dict(output, _id=display_id)
+            elif cells:
+                cells[-1].append(dict(output, _id=display_id))
+
+    shell = InteractiveShell.instance()
+    shell.display_pub = _Frontend(shell=shell)
+    sys.path.insert(0, os.path.join(BENCH_DIR, "..", "docker"))
+    with shell.builtin_trap:
+        import claude_magic as cm
+
+    quiet = open(os.devnull, "w")
+    stdout, sys.stdout = sys.stdout, quiet
+    try:
+        for i in range(turns):
+            cells.append([])
+            shell.run_cell(f"%%claude --no-cache\n{prompt} cell={i}")
+    finally:
+        sys.stdout = stdout
+        cm._stop_worker()
+
+    nb = {
+        "cells": [
+            {"cell_type": "code", "execution_count": i + 1, "id": f"cell{i}", "metadata": {},
+             "source": f"%%claude\n{prompt}",
+             "outputs": [{k: v for k, v in o.items() if k != "_id"} for o in outputs]}
+            for i, outputs in enumerate(cells)
+        ],
+        "metadata": {}, "nbformat": 4, "nbformat_minor": 5,
+    }
+    text = json.dumps(nb, indent=1, ensure_ascii=False)
+    if out:
+        with open(out, "w", encoding="utf-8") as f:
+            f.write(text)
+    saved = len(text.encode("utf-8"))
+    return {
+        "turns": turns,
+        "updates": _Frontend.updates,
+        "bytes": _Frontend.bytes,
+        "bytes_per_update": _Frontend.bytes / max(_Frontend.updates, 1),
+        "ipynb_bytes": saved,
+        "status": dict(collections.Counter(m["status"] for m in cm._turn_metrics)),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    ap.add_argument("--turns", type=int, default=50)
+    ap.add_argument("--scenario", default="scenario:short chars=3000")
+    ap.add_argument("--out", help="also write the notebook here, for a look in JupyterLab")
+    ap.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        print(json.dumps(run(args.turns, args.scenario, args.out)))
+        return 0
+
+    with tempfile.TemporaryDirectory(prefix="bench-notebook-") as tmp:
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child",
+             "--turns", str(args.turns), "--scenario", args.scenario]
+            + (["--out", os.path.abspath(args.out)] if args.out else []),
+            env=_case_env(tmp), capture_output=True, text=True, timeout=600,
+        )
+    if proc.returncode != 0:
+        print(proc.stderr[-2000:])
+        return 1
+    r = json.loads(proc.stdout.strip().splitlines()[-1])
+    print(f"turns:            {r['turns']} ({', '.join(f'{n} {k}' for k, n in r['status'].items())})")
+    print(f"display updates:  {r['updates']}")
+    print(f"bytes sent:       {r['bytes']:,} ({r['bytes_per_update']:,.0f} per update)")
+    print(f"saved .ipynb:     {r['ipynb_bytes']:,} bytes ({r['ipynb_bytes'] / r['turns']:,.0f} per turn)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+"""
+Check for %proxy's endpoint probing (_probe_proxy / _rank_proxies).
+
+Ranks four stand-in upstreams from bench/fake_proxy.py, with no TLS and a
+local target, the way `%proxy mullvad` ranks PROXY_URLS:
+
+    http     HTTP CONNECT, --delay-ms per round trip
+    socks    SOCKS5, twice the delay (two round trips), so it ranks second
+    stall    accepts connections but never answers
+    refuse   closes every connection straight away
+
+and checks that the two healthy ones come first, fastest first, that the
+stall times out and the refusal fails, and that the whole ranking returns
+within the deadline. Prints the probe table and exits 1 on a failed check.
+
+Usage:
+    python bench/bench_probe.py [--deadline 1] [--delay-ms 20]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "docker"))
+
+import fake_proxy  # noqa: E402
+from IPython.core.interactiveshell import InteractiveShell  # noqa: E402
+
+with InteractiveShell.instance().builtin_trap:
+    import claude_magic as cm  # noqa: E402
+
+
+def run(deadline, delay_ms):
+    target_srv, target = fake_proxy.serve_target()
+    ups = [
+        fake_proxy.serve(socks=False, delay_ms=delay_ms),
+        fake_proxy.serve(socks=True, delay_ms=delay_ms),
+        fake_proxy.serve(mode="stall"),
+        fake_proxy.serve(socks=True, mode="refuse"),
+    ]
+    try:
+        t0 = time.monotonic()
+        results = cm._rank_proxies([u for _, u in ups], deadline=deadline, target=target, tls=False)
+        elapsed = time.monotonic() - t0
+    finally:
+        for srv, _ in ups:
+            srv.shutdown()
+        target_srv.shutdown()
+    return results, elapsed
+
+
+def check(results, elapsed, deadline):
+    by_index = {r["index"]: r for r in results}
+    failures = []
+    if [r["index"] for r in results[:2]] != [0, 1]:
+        failures.append(f"expected http then socks first, got {[r['index'] for r in results]}")
+    for i in (0, 1):
+        if not by_index[i]["ok"]:
+            failures.append(f"{by_index[i]['label']} failed: {by_index[i]['error']}")
+    if by_index[2]["ok"] or by_index[2]["error"] != "timeout":
+        failures.append(f"stall: expected timeout, got {by_index[2]['error'] or 'ok'}")
+    if by_index[3]["ok"]:
+        failures.append("refuse: expected an error, got ok")
+    if elapsed > deadline + 0.5:
+        failures.append(f"ranking took {elapsed:.2f}s, over the {deadline}s deadline")
+    return failures
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    ap.add_argument("--deadline", type=float, default=1)
+    ap.add_argument("--delay-ms", type=float, default=20, help="stand-in round trip to an upstream")
+    args = ap.parse_args()
+
+    results, elapsed = run(args.deadline, args.delay_ms)
+    cm._print_proxy_table(results)
+    print(f"  ranked in {elapsed:.2f}s (deadline {args.deadline}s)")
+    failures = check(results, elapsed, args.deadline)
+    for f in failures:
+        print(f"FAIL {f}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+"""
+Failover and latency benchmark for docker/claude_proxy.py.
+
+Starts stand-in upstream proxies (bench/fake_proxy.py) and a local HTTP
+target, runs claude_proxy as its own process the way `%proxy local` does,
+and makes sequential requests (CONNECT, then a GET through the tunnel)
+two ways:
+
+    direct   straight to one upstream, as `%proxy mullvad` sets it up
+    local    through claude_proxy on 127.0.0.1
+
+Scenarios:
+    healthy  two SOCKS5 upstreams, --delay-ms per round trip
+    stall    the first upstream accepts connections but never answers
+    dies     the upstream in use goes away after a third of the requests
+
+A request that gets no answer within --client-timeout counts as failed
+(the CLI would wait its own timeout, minutes, instead).
+
+Usage:
+    python bench/bench_proxy.py [--requests 30] [--delay-ms 20] [--scenario healthy,stall,dies]
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+import fake_proxy  # noqa: E402
+
+PROXY = os.path.join(BENCH_DIR, "..", "docker", "claude_proxy.py")
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _status(port):
+    with socket.create_connection(("127.0.0.1", port), timeout=2) as s:
+        s.sendall(b"GET /status HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        data = b""
+        while chunk := s.recv(65536):
+            data += chunk
+    return json.loads(data.partition(b"\r\n\r\n")[2])
+
+
+def _start_proxy(urls, target, connect_timeout):
+    port = _free_port()
+    env = dict(os.environ, PROXY_URLS=",".join(urls), PROXY_PROBE_TARGET=target,
+               PROXY_CONNECT_TIMEOUT=str(connect_timeout), PROXY_HEALTH_INTERVAL="2")
+    proc = subprocess.Popen([sys.executable, PROXY, "--port", str(port)], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            _status(port)
+            return proc, port
+        except OSError:
+            if proc.poll() is not None or time.monotonic() > deadline:
+                proc.kill()
+                raise RuntimeError(f"claude_proxy did not start:\n{proc.stderr.read().decode()[-2000:]}")
+            time.sleep(0.05)
+
+
+def _socks_tunnel(sock, host, port):
+    sock.sendall(b"\x05\x01\x00")
+    fake_proxy._recv_exact(sock, 2)
+    name = host.encode()
+    sock.sendall(b"\x05\x01\x00\x03" + bytes([len(name)]) + name + port.to_bytes(2, "big"))
+    reply = fake_proxy._recv_exact(sock, 10)
+    if reply[1] != 0:
+        raise ConnectionError(f"SOCKS5 code {reply[1]}")
+
+
+def _http_tunnel(sock, target):
+    sock.sendall(f"CONNECT {target} HTTP/1.1\r\nHost: {target}\r\n\r\n".encode())
+    head = b""
+    while b"\r\n\r\n" not in head:
+        chunk = sock.recv(4096)
+        if not chunk:
+            raise ConnectionError("proxy closed the connection")
+        head += chunk
+    if head.split()[1] != b"200":
+        raise ConnectionError(head.split(b"\r\n", 1)[0].decode())
+
+
+def request(proxy_url, target, timeout):
+    """CONNECT through proxy_url, GET / from the target; returns (seconds, error)."""
+    parts = proxy_url.split("://", 1)
+    host, _, port = parts[1].rpartition(":")
+    host_t, _, port_t = target.rpartition(":")
+    t0 = time.monotonic()
+    try:
+        with socket.create_connection((host, int(port)), timeout=timeout) as sock:
+            sock.settimeout(max(timeout - (time.monotonic() - t0), 0.01))
+            if parts[0].startswith("socks"):
+                _socks_tunnel(sock, host_t, int(port_t))
+            else:
+                _http_tunnel(sock, target)
+            sock.sendall(b"GET / HTTP/1.1\r\nHost: target\r\nConnection: close\r\n\r\n")
+            data = b""
+            while chunk := sock.recv(4096):
+                data += chunk
+            if b" 200 " not in data.split(b"\r\n", 1)[0] + b" ":
+                raise ConnectionError(data[:80].decode("latin-1") or "empty response")
+    except (OSError, ValueError) as e:
+        return time.monotonic() - t0, "timeout" if isinstance(e, socket.timeout) else str(e)
+    return time.monotonic() - t0, None
+
+
+def run(scenario, n, delay_ms, client_timeout, connect_timeout, mode):
+    target_srv, target = fake_proxy.serve_target()
+    modes = ["stall", "ok"] if scenario == "stall" else ["ok", "ok"]
+    ups = [fake_proxy.serve(socks=True, mode=m, delay_ms=delay_ms) for m in modes]
+    proc = None
+    try:
+        if mode == "local":
+            proc, port = _start_proxy([u for _, u in ups], target, connect_timeout)
+            proxy_url = f"http://127.0.0.1:{port}"
+            time.sleep(0.2)  # let the first health check and warm-up finish
+        else:
+            proxy_url = ups[0][1]
+        times, errors = [], 0
+        for i in range(n):
+            if scenario == "dies" and i == n // 3:
+                ups[_status(port)["primary"] if mode == "local" else 0][0].shutdown()
+            secs, err = request(proxy_url, target, client_timeout)
+            times.append(secs)
+            errors += err is not None
+        stats = _status(port) if mode == "local" else {}
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(5)
+        for srv, _ in ups:
+            if not srv.stopping:
+                srv.shutdown()
+        target_srv.shutdown()
+    return {
+        "median_ms": statistics.median(times) * 1000,
+        "max_ms": max(times) * 1000,
+        "total_s": sum(times),
+        "failed": errors,
+        "failovers": stats.get("failovers", 0),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    ap.add_argument("--requests", type=int, default=30)
+    ap.add_argument("--delay-ms", type=float, default=20, help="stand-in round trip to an upstream")
+    ap.add_argument("--client-timeout", type=float, default=2)
+    ap.add_argument("--connect-timeout", type=float, default=1, help="PROXY_CONNECT_TIMEOUT for claude_proxy")
+    ap.add_argument("--scenario", default="healthy,stall,dies")
+    args = ap.parse_args()
+
+    print(f"{'scenario':<10}{'path':<8}{'median ms':>11}{'max ms':>9}{'total s':>9}{'failed':>8}{'failovers':>11}")
+    for scenario in args.scenario.split(","):
+        for mode in ("direct", "local"):
+            r = run(scenario, args.requests, args.delay_ms, args.client_timeout,
+                    args.connect_timeout, mode)
+            print(f"{scenario:<10}{mode:<8}{r['median_ms']:>11.1f}{r['max_ms']:>9.0f}"
+                  f"{r['total_s']:>9.2f}{r['failed']:>8}{r['failovers'] if mode == 'local' else '-':>11}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
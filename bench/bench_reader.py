@@ -0,0 +1,116 @@
+"""
+Stream-json reader micro-benchmark for claude_magic.
+
+Pipes a stream containing multi-megabyte lines (tool_result-sized "user"
+events and long assistant text full of multi-byte characters) through the
+original string-concatenating 8 KB reader and through _EventReader, and
+reports wall time, CPU time and whether every event decoded intact.
+
+Usage:
+    python bench/bench_reader.py [--mb 4] [--lines 6]
+"""
+
+import argparse
+import json
+import os
+import select
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "docker"))
+
+from IPython.core.interactiveshell import InteractiveShell
+
+# Magics register against get_ipython(), which only exists inside the builtin trap
+with InteractiveShell.instance().builtin_trap:
+    import claude_magic as cm
+
+
+def build_stream(mb, lines):
+    """Alternate huge tool results with huge assistant text blocks."""
+    size = mb * 1024 * 1024
+    text = ("naïve café → 数据 ✓ " * (size // 24 + 1))[: size // 3]
+    out = [json.dumps({"type": "system", "subtype": "init"})]
+    expected = 0
+    for i in range(lines):
+        if i % 2:
+            out.append(json.dumps({"type": "user", "message": {"content": [
+                {"type": "tool_result", "content": "x" * size}]}}))
+        else:
+            out.append(json.dumps({"type": "assistant", "message": {"content": [
+                {"type": "text", "text": text}]}}, ensure_ascii=False))
+            expected += 1
+    out.append(json.dumps({"type": "result", "result": "ok"}))
+    return ("\n".join(out) + "\n").encode("utf-8"), text, expected
+
+
+def legacy_read(fd):
+    """The original loop: 8 KB reads, str concat, split per line, errors=replace."""
+    line_buf = ""
+    events = []
+    while True:
+        ready, _, _ = select.select([fd], [], [], 0.3)
+        if not ready:
+            continue
+        chunk = os.read(fd, 8192)
+        if not chunk:
+            return events
+        line_buf += chunk.decode("utf-8", errors="replace")
+        while "\n" in line_buf:
+            line, line_buf = line_buf.split("\n", 1)
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                events.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+
+
+def current_read(fd):
+    reader = cm._EventReader(fd)
+    events = []
+    while True:
+        batch = reader.read(0.3)
+        if batch is None:
+            return events
+        events.extend(batch)
+
+
+def run(read_fn, payload):
+    r, w = os.pipe()
+
+    def _feed():
+        with os.fdopen(w, "wb") as f:
+            f.write(payload)
+
+    feeder = threading.Thread(target=_feed, daemon=True)
+    wall, cpu = time.perf_counter(), time.process_time()
+    feeder.start()
+    events = read_fn(r)
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    feeder.join()
+    os.close(r)
+    return events, wall, cpu
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    ap.add_argument("--mb", type=int, default=4, help="size of each huge line in MB")
+    ap.add_argument("--lines", type=int, default=6, help="number of huge lines")
+    args = ap.parse_args()
+
+    payload, text, expected = build_stream(args.mb, args.lines)
+    print(f"stream: {len(payload) / 1024 / 1024:.1f} MB, {args.lines} lines of ~{args.mb} MB")
+    print(f"{'mode':<10}{'wall (s)':>10}{'cpu (s)':>10}{'events':>8}{'intact':>8}")
+    for name, fn in (("legacy", legacy_read), ("current", current_read)):
+        events, wall, cpu = run(fn, payload)
+        texts = [b["text"] for e in events if e.get("type") == "assistant"
+                 for b in e["message"]["content"]]
+        intact = sum(t == text for t in texts)
+        print(f"{name:<10}{wall:>10.3f}{cpu:>10.3f}{len(events):>8}{intact:>5}/{expected}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Streaming render benchmark for claude_magic.
+
+Feeds a synthetic 200 KB thinking + answer stream through the live renderer
+and reports kernel CPU time, display updates and bytes sent to the frontend.
+"legacy" replays the original per-event join/escape/re-render loop; "current"
+uses _StreamRenderer with its frame cap.
+
+Usage:
+    python bench/bench_render.py [--kb 200] [--chunk 40] [--event-ms 10]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "docker"))
+
+from IPython.core.interactiveshell import InteractiveShell
+
+# Magics register against get_ipython(), which only exists inside the builtin trap
+with InteractiveShell.instance().builtin_trap:
+    import claude_magic as cm
+
+# Keep thinking spill files out of the real home directory
+cm._spill_dir = tempfile.mkdtemp(prefix="bench-render-")
+
+
+class _Meter:
+    """Stand-in for IPython.display that counts updates and payload bytes."""
+
+    def __init__(self):
+        self.updates = 0
+        self.bytes = 0
+
+    def record(self, obj):
+        self.updates += 1
+        self.bytes += len(obj.data.encode("utf-8"))
+
+    def display(self, obj, display_id=False):
+        self.record(obj)
+        return _Handle(self)
+
+
+class _Handle:
+    def __init__(self, meter):
+        self.meter = meter
+
+    def update(self, obj):
+        self.meter.record(obj)
+
+
+def synthetic_stream(total_kb, chunk):
+    """Yield (kind, text) events: ~60% thinking, then answer, newline every ~80 chars."""
+    words = "the quick <brown> fox & jumps over lazy dogs while pondering tensors ".split()
+    total = total_kb * 1024
+    emitted = 0
+    line = 0
+    i = 0
+    while emitted < total:
+        kind = "thinking" if emitted < total * 0.6 else "text"
+        parts = []
+        size = 0
+        while size < chunk:
+            w = words[i % len(words)] + " "
+            i += 1
+            line += len(w)
+            if line > 80:
+                w += "\n"
+                line = 0
+            parts.append(w)
+            size += len(w)
+        text = "".join(parts)
+        emitted += len(text)
+        yield kind, text
+
+
+def run_legacy(events, event_s):
+    meter = _Meter()
+    handle = meter.display(cm.HTML(cm._render_streaming_html("", "", 0)))
+    thinking_buf, answer_buf = [], []
+    start = 0.0
+    cpu = time.process_time()
+    for n, (kind, text) in enumerate(events):
+        (thinking_buf if kind == "thinking" else answer_buf).append(text)
+        thinking_text = "".join(thinking_buf)
+        answer_text = "".join(answer_buf)
+        elapsed = n * event_s - start
+        if answer_text:
+            answer_html = cm._escape_html(answer_text).replace("\n", "<br>")
+            handle.update(cm.HTML(cm._render_streaming_html(
+                cm._escape_html(thinking_text), answer_html, elapsed)))
+        else:
+            handle.update(cm.HTML(cm._render_streaming_html(
+                cm._escape_html(thinking_text), "", elapsed)))
+    return time.process_time() - cpu, meter
+
+
+def run_current(events, event_s):
+    meter = _Meter()
+    cm.display = meter.display
+    handle = meter.display(cm.HTML(cm._render_streaming_html("", "", 0)))
+    renderer = cm._StreamRenderer(handle, 0.0)
+    cpu = time.process_time()
+    for n, (kind, text) in enumerate(events):
+        now = n * event_s
+        if kind == "thinking":
+            renderer.add_thinking(text, now=now)
+        else:
+            renderer.add_answer(text)
+        renderer.flush(now=now)
+    renderer.flush(now=len(events) * event_s, force=True)
+    return time.process_time() - cpu, meter
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    ap.add_argument("--kb", type=int, default=200, help="stream size in KB")
+    ap.add_argument("--chunk", type=int, default=40, help="chars per stream event")
+    ap.add_argument("--event-ms", type=float, default=10.0, help="simulated gap between events")
+    args = ap.parse_args()
+
+    events = list(synthetic_stream(args.kb, args.chunk))
+    event_s = args.event_ms / 1000.0
+    print(f"stream: {args.kb} KB in {len(events)} events, "
+          f"{len(events) * event_s:.1f}s simulated, cap {cm._max_fps:g} fps, "
+          f"thinking tail {cm._thinking_tail_chars // 1024} KB")
+    print(f"{'mode':<10}{'cpu (s)':>10}{'updates':>12}{'bytes':>14}")
+    for name, fn in (("legacy", run_legacy), ("current", run_current)):
+        cpu, meter = fn(events, event_s)
+        print(f"{name:<10}{cpu:>10.3f}{meter.updates:>12}{meter.bytes:>14,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Kernel startup benchmark for the 00-claude.py auto-loader.
+
+Starts fresh IPython processes with a throwaway profile whose startup
+directory holds (a) nothing, (b) the old eager loader that imported
+claude_magic, and (c) the current lazy 00-claude.py. Reports median
+shell-ready wall time and the extra import time (`python -X importtime`)
+each loader adds on top of a bare shell.
+
+IPython start-up stands in for kernel-ready time: ipykernel runs the same
+profile startup files before it answers kernel_info.
+
+Usage:
+    python bench/bench_startup.py [--runs 7]
+"""
+
+import argparse
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DOCKER = os.path.abspath(os.path.join(HERE, "..", "docker"))
+
+EAGER = """\
+import sys
+sys.path.insert(0, "/opt/ai")
+from claude_magic import CLAUDE_SESSION_ID, ask
+print(f"Claude magic loaded.  Session: {CLAUDE_SESSION_ID[:8]}...")
+"""
+
+
+def make_profile(root, startup_src):
+    startup = os.path.join(root, "profile_default", "startup")
+    os.makedirs(startup)
+    if startup_src is not None:
+        with open(os.path.join(startup, "00-claude.py"), "w") as f:
+            f.write(startup_src)
+
+
+def run_ipython(ipdir, importtime=False):
+    env = {**os.environ, "IPYTHONDIR": ipdir, "PYTHONPATH": DOCKER, "CLAUDE_BANNER": "off"}
+    cmd = [sys.executable]
+    if importtime:
+        cmd += ["-X", "importtime"]
+    cmd += ["-m", "IPython", "--no-banner", "-c", "pass"]
+    t0 = time.perf_counter()
+    proc = subprocess.run(cmd, env=env, capture_output=True, text=True)
+    wall = time.perf_counter() - t0
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr[-2000:])
+    return wall, proc.stderr
+
+
+def import_self_times(stderr):
+    """{module: self-time us} from -X importtime output."""
+    times = {}
+    for line in stderr.splitlines():
+        m = re.match(r"import time:\s+(\d+) \|\s+\d+ \|\s*(.+)$", line)
+        if m:
+            times[m.group(2).strip()] = int(m.group(1))
+    return times
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    ap.add_argument("--runs", type=int, default=7, help="IPython launches per variant")
+    args = ap.parse_args()
+
+    with open(os.path.join(DOCKER, "00-claude.py")) as f:
+        lazy = f.read()
+    variants = [("none", None), ("eager", EAGER), ("lazy", lazy)]
+
+    tmp = tempfile.mkdtemp(prefix="bench-startup-")
+    try:
+        results = {}
+        for name, src in variants:
+            ipdir = os.path.join(tmp, name)
+            make_profile(ipdir, src)
+            run_ipython(ipdir)  # warm the filesystem cache
+            walls = [run_ipython(ipdir)[0] for _ in range(args.runs)]
+            _, stderr = run_ipython(ipdir, importtime=True)
+            results[name] = (statistics.median(walls), import_self_times(stderr))
+
+        base_mods = results["none"][1]
+        print(f"{'loader':<8}{'ready (ms)':>12}{'+ready':>10}{'+imports (ms)':>15}{'+modules':>10}")
+        for name, _ in variants:
+            wall, mods = results[name]
+            extra = {m: t for m, t in mods.items() if m not in base_mods}
+            print(f"{name:<8}{wall * 1000:>12.0f}{(wall - results['none'][0]) * 1000:>10.0f}"
+                  f"{sum(extra.values()) / 1000:>15.1f}{len(extra):>10}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""
+Performance regression suite for claude_magic's streaming path.
+
+Drives _run_claude, ask() and the %%claude magic under a headless IPython
+shell against bench/fake_claude.py and, for routed cases, bench/fake_ollama.py
+(no network, no real CLI or model server) and measures
+per case: kernel CPU, display updates, bytes published to the frontend,
+peak RSS and end-to-end latency. Every case runs in a fresh process so
+peak RSS is its own, after one warm-up turn so the worker is already up.
+
+Results are compared with bench/baseline.json. A metric that grew by more
+than --tolerance (and by more than a small absolute floor, to ignore
+noise on tiny values) is flagged, as is a changed turn status, and the
+exit status is 1. Baselines are machine-specific: re-save after moving
+to new hardware, and commit the baseline together with intended changes.
+
+Usage:
+    python bench/bench_suite.py                  # run all cases, compare with baseline
+    python bench/bench_suite.py -k huge          # only cases whose name contains "huge"
+    python bench/bench_suite.py --save           # run and write bench/baseline.json
+    python bench/bench_suite.py --repeat 5       # median of 5 runs per case
+"""
+
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+
+# (case name, driver, prompt); prompts select fake_claude.py scenarios
+CASES = [
+    ("short/run_claude", "run_claude", "scenario:short"),
+    ("short/ask", "ask", "scenario:short"),
+    ("short/magic", "magic", "scenario:short"),
+    ("short/pooled", "pooled", "scenario:short"),
+    ("thinking_burst/run_claude", "run_claude", "scenario:thinking_burst"),
+    ("huge_lines/run_claude", "run_claude", "scenario:huge_lines"),
+    ("trickle/run_claude", "run_claude", "scenario:trickle"),
+    ("stderr_noise/run_claude", "run_claude", "scenario:stderr_noise"),
+    ("tools/run_claude", "run_claude", "scenario:tools"),
+    ("route_local/ask", "ask_local", "What is the capital of France?"),
+    ("route_escalate/ask", "ask_local", "scenario:short fail=1"),
+    ("rate_limit/run_claude", "run_claude", "scenario:rate_limit fails=2"),
+    ("crash/run_claude", "run_claude", "scenario:crash"),
+]
+
+# Lower is better for every metric. Growth below the floor is never flagged.
+METRICS = [
+    ("cpu_s", "cpu (s)", "{:.3f}", 0.05),
+    ("latency_s", "latency (s)", "{:.3f}", 0.10),
+    ("updates", "updates", "{:.0f}", 5),
+    ("bytes", "bytes", "{:,.0f}", 16384),
+    ("peak_rss_mb", "rss (MB)", "{:.1f}", 8),
+]
+
+
+# --- child: one case in a headless shell ----------------------------------
+
+def run_case(name):
+    from IPython.core.displaypub import DisplayPublisher
+    from IPython.core.interactiveshell import InteractiveShell
+
+    class _Meter(DisplayPublisher):
+        """Counts display/update messages and their payload bytes."""
+
+        updates = 0
+        bytes = 0
+
+        def publish(self, data, metadata=None, source=None, *, transient=None,
+                    update=False, **kwargs):
+            type(self).updates += 1
+            type(self).bytes += len(json.dumps(data))
+
+    shell = InteractiveShell.instance()
+    shell.display_pub = _Meter(shell=shell)
+    sys.path.insert(0, os.path.join(BENCH_DIR, "..", "docker"))
+    with shell.builtin_trap:
+        import claude_magic as cm
+
+    driver, prompt = next((d, p) for n, d, p in CASES if n == name)
+    if driver == "ask_local":
+        sys.path.insert(0, BENCH_DIR)
+        import fake_ollama
+
+        _, cm._ollama_host = fake_ollama.serve()
+    if driver == "pooled":
+        _serve_pool(cm)
+    run = {
+        "run_claude": lambda: cm._run_claude(prompt),
+        "ask": lambda: cm.ask(prompt),
+        "ask_local": lambda: cm.ask(prompt),
+        "magic": lambda: shell.run_cell(f"%%claude\n{prompt}"),
+        "pooled": lambda: cm._run_claude(prompt),
+    }[driver]
+
+    quiet = open(os.devnull, "w")
+    stdout, sys.stdout = sys.stdout, quiet
+    try:
+        cm._run_claude("scenario:short chars=30", backend="claude")  # spawn the worker
+        _Meter.updates = _Meter.bytes = 0
+        wall, cpu = time.perf_counter(), time.process_time()
+        run()
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    finally:
+        sys.stdout = stdout
+        cm._stop_worker()
+        try:
+            os.remove(cm._rate_limiter.path())  # backoff state is pod-wide; don't leak it into the next case
+        except OSError:
+            pass
+    return {
+        "cpu_s": cpu,
+        "latency_s": wall,
+        "updates": _Meter.updates,
+        "bytes": _Meter.bytes,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "status": f"{cm._turn_metrics[-1]['status']}/{cm._turn_metrics[-1]['backend']}",
+    }
+
+
+def _serve_pool(cm):
+    """Run claude_pool (with a spare, like the chart default) on a thread for this case."""
+    import asyncio
+    import threading
+
+    import claude_pool
+
+    path = os.path.join(os.environ["HOME"], f"pool-{os.getpid()}.sock")
+    pool = claude_pool.Pool(size=3, spares=1)
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_until_complete, args=(claude_pool.serve(pool, path),),
+                     daemon=True).start()
+    deadline = time.monotonic() + 10
+    while not (os.path.exists(path) and pool.live() > 0) and time.monotonic() < deadline:
+        time.sleep(0.02)  # wait for the socket and the pre-spawned spare
+    os.environ["CLAUDE_POOL"] = "1"
+    cm._pool_socket = path
+
+
+# --- parent: run cases in subprocesses, compare ---------------------------
+
+def _case_env(tmp):
+    bindir = os.path.join(tmp, "bin")
+    os.makedirs(bindir, exist_ok=True)
+    fake = os.path.join(bindir, "claude")
+    with open(fake, "w") as f:
+        f.write(f"#!/bin/sh\nexec {sys.executable} {os.path.join(BENCH_DIR, 'fake_claude.py')} \"$@\"\n")
+    os.chmod(fake, 0o755)
+    config = os.path.join(tmp, "config")
+    os.makedirs(config, exist_ok=True)
+    with open(os.path.join(config, ".credentials.json"), "w") as f:
+        f.write("{}")
+    env = dict(os.environ)
+    env.update({
+        "PATH": bindir + os.pathsep + env.get("PATH", ""),
+        "HOME": tmp,
+        "CLAUDE_CONFIG_DIR": config,
+        "CLAUDE_SPILL_DIR": os.path.join(tmp, "spill"),
+        "CLAUDE_POOL": "0",
+        "CLAUDE_CACHE": "0",
+        "CLAUDE_STATS_FILE": "",
+        "CLAUDE_METRICS": "0",
+        "CLAUDE_RATE_BACKOFF": "0.05",
+        "CLAUDE_BACKEND": "auto",
+        "OLLAMA_HOST": "",
+    })
+    return env
+
+
+def measure(name, env, repeat):
+    runs = []
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--case", name],
+            env=env, capture_output=True, text=True, timeout=300,
+        )
+        if proc.returncode != 0:
+            raise RuntimeError(f"{name} failed:\n{proc.stderr[-2000:]}")
+        runs.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+    result = {key: round(statistics.median(r[key] for r in runs), 4) for key, *_ in METRICS}
+    result["status"] = runs[-1]["status"]
+    return result
+
+
+def compare(name, result, baseline, tolerance):
+    """Return human-readable regressions of `result` against the baseline case."""
+    if baseline is None:
+        return []
+    problems = []
+    if result["status"] != baseline.get("status"):
+        problems.append(f"status {baseline.get('status')} -> {result['status']}")
+    for key, label, fmt, floor in METRICS:
+        old, new = baseline.get(key), result[key]
+        if old is None:
+            continue
+        if new > old * (1 + tolerance) and new - old > floor:
+            pct = f"+{(new - old) / old * 100:.0f}%" if old else "new"
+            problems.append(f"{label} {fmt.format(old)} -> {fmt.format(new)} ({pct})")
+    return problems
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    ap.add_argument("--case", help=argparse.SUPPRESS)  # child mode
+    ap.add_argument("-k", default="", help="only run cases whose name contains this")
+    ap.add_argument("--repeat", type=int, default=3, help="runs per case (median is kept)")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="allowed relative growth")
+    ap.add_argument("--save", action="store_true", help="write results as the new baseline")
+    ap.add_argument("--baseline", default=BASELINE, help="baseline file")
+    args = ap.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(args.case)))
+        return 0
+
+    try:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f).get("cases", {})
+    except FileNotFoundError:
+        baseline = {}
+
+    cases = [c for c in CASES if args.k in c[0]]
+    results = {}
+    regressions = 0
+    with tempfile.TemporaryDirectory(prefix="bench-suite-") as tmp:
+        env = _case_env(tmp)
+        print(f"{'case':<28}" + "".join(f"{label:>14}" for _, label, _, _ in METRICS) + "  status")
+        for name, _, _ in cases:
+            result = results[name] = measure(name, env, args.repeat)
+            row = "".join(f"{fmt.format(result[key]):>14}" for key, _, fmt, _ in METRICS)
+            print(f"{name:<28}{row}  {result['status']}")
+            if not args.save:
+                for problem in compare(name, result, baseline.get(name), args.tolerance):
+                    print(f"  REGRESSION {problem}")
+                    regressions += 1
+
+    if args.save:
+        merged = {**baseline, **results}
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "cases": merged}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline written: {args.baseline}")
+        return 0
+    if not baseline:
+        print("No baseline yet; run with --save to record one.")
+    elif regressions:
+        print(f"{regressions} regression(s) against {args.baseline}")
+        return 1
+    else:
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
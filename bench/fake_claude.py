@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Stand-in for the `claude` CLI that replays stream-json turns offline.
+
+Accepts the flags claude_magic passes (-p, --session-id/--resume,
+--input-format/--output-format stream-json, ...), emits a system init
+event, then answers each user message on stdin with one scripted turn:
+
+- a prompt of the form "scenario:<name>" plays a built-in scenario
+  (see SCENARIOS), optionally "scenario:<name> key=value ..." to tune it
+- otherwise, if FAKE_CLAUDE_TRANSCRIPT names a JSONL file, that recorded
+  turn is replayed (events captured from a real `claude -p --output-format
+  stream-json` run work as-is)
+- otherwise the prompt is echoed back as a short thinking + answer turn
+
+Transcript lines are stream-json events plus optional directives:
+
+    {"_delay_ms": 50}          sleep before the next line
+    {"_stderr": "text"}        write a line to stderr
+    {"_exit": 3}               exit with this status mid-turn
+
+Any event may also carry "_delay_ms" itself. FAKE_CLAUDE_SPEED scales all
+delays (2 = twice as fast, 0 = no sleeping).
+
+Install by putting an executable named `claude` that runs this file first
+on PATH; bench_suite.py does this in a temp directory.
+"""
+import collections
+import json
+import os
+import sys
+import time
+
+_speed = float(os.environ.get("FAKE_CLAUDE_SPEED", "1"))
+_attempts = collections.Counter()  # per-process scenario state
+
+
+def _sleep(ms):
+    if ms and _speed:
+        time.sleep(ms / 1000.0 / _speed)
+
+
+def _assistant(btype, text):
+    key = "thinking" if btype == "thinking" else "text"
+    return {"type": "assistant", "message": {"content": [{"type": btype, key: text}]}}
+
+
+def _result(text="", is_error=False, turn=1):
+    return {
+        "type": "result", "subtype": "error" if is_error else "success",
+        "is_error": is_error, "result": text,
+        "usage": {"input_tokens": 1000 * turn, "output_tokens": 200},
+        "total_cost_usd": 0.001 * turn, "duration_ms": 0, "num_turns": 1,
+    }
+
+
+def _words(n, width=80):
+    """Deterministic filler text of n chars with a newline every `width` chars."""
+    base = "the quick <brown> fox & jumps over lazy dogs while pondering tensors "
+    text = (base * (n // len(base) + 1))[:n]
+    return "\n".join(text[i:i + width] for i in range(0, n, width))
+
+
+def scenario_short(turn, chars=600, **_):
+    yield {"_delay_ms": 50}
+    yield _assistant("thinking", _words(chars // 3))
+    yield _assistant("text", _words(chars))
+    yield _result(turn=turn)
+
+
+def scenario_thinking_burst(turn, chunks=2000, chunk=100, **_):
+    """Thousands of small thinking events with no gap, then the answer."""
+    for _ in range(chunks):
+        yield _assistant("thinking", _words(chunk))
+    yield _assistant("text", _words(2000))
+    yield _result(turn=turn)
+
+
+def scenario_huge_lines(turn, blocks=3, mb=4, **_):
+    """A few multi-MB text blocks, each on one stream-json line."""
+    for _ in range(blocks):
+        yield _assistant("text", _words(mb * 1024 * 1024))
+    yield _result(turn=turn)
+
+
+def scenario_trickle(turn, chunks=200, chunk=20, ms=5, **_):
+    """A slow answer: small chunks with a gap between each."""
+    for _ in range(chunks):
+        yield {"_delay_ms": ms}
+        yield _assistant("text", _words(chunk))
+    yield _result(turn=turn)
+
+
+def scenario_stderr_noise(turn, lines=5000, **_):
+    """Heavy stderr chatter interleaved with a normal turn."""
+    for i in range(lines):
+        yield {"_stderr": f"debug: noise line {i} " + "x" * 60}
+        if i % 500 == 0:
+            yield _assistant("text", _words(200))
+    yield _result(turn=turn)
+
+
+def scenario_tools(turn, calls=4, ms=250, kb=2, **_):
+    """Tool calls with a pause each, every other one returning a large output."""
+    yield _assistant("thinking", _words(300))
+    for i in range(calls):
+        tool_id = f"toolu_{turn}_{i}"
+        yield {"type": "assistant", "message": {"content": [{
+            "type": "tool_use", "id": tool_id, "name": "Bash",
+            "input": {"command": f"ls -la /data/{i}", "description": "List files"}}]}}
+        yield {"_delay_ms": ms}
+        size = kb * 1024 * (64 if i % 2 else 1)
+        yield {"type": "user", "message": {"role": "user", "content": [{
+            "type": "tool_result", "tool_use_id": tool_id,
+            "content": _words(size), "is_error": False}]}}
+    yield _assistant("text", _words(1500))
+    yield _result(turn=turn)
+
+
+def scenario_rate_limit(turn, fails=2, after=0, **_):
+    """API 429s for this process's first `fails` turns, then a short answer."""
+    _attempts["rate_limit"] += 1
+    if _attempts["rate_limit"] <= fails:
+        hint = f" (retry-after: {after})" if after else ""
+        yield {"_delay_ms": 20}
+        yield _assistant("text", 'API Error: 429 {"type":"error","error":{"type":"rate_limit_error",'
+                                 '"message":"This request would exceed your rate limit"}}' + hint)
+        yield _result("API Error: 429 rate_limit_error" + hint, is_error=True, turn=turn)
+        return
+    yield from scenario_short(turn, chars=300)
+
+
+def scenario_crash(turn, code=3, **_):
+    """Partial answer, then a non-zero exit with no result event."""
+    yield _assistant("thinking", _words(500))
+    yield _assistant("text", _words(1000))
+    yield {"_stderr": "Error: simulated crash"}
+    yield {"_exit": code}
+
+
+SCENARIOS = {
+    "short": scenario_short,
+    "thinking_burst": scenario_thinking_burst,
+    "huge_lines": scenario_huge_lines,
+    "trickle": scenario_trickle,
+    "stderr_noise": scenario_stderr_noise,
+    "tools": scenario_tools,
+    "rate_limit": scenario_rate_limit,
+    "crash": scenario_crash,
+}
+
+
+def _parse_scenario(prompt):
+    name, *args = prompt[len("scenario:"):].split()
+    params = {}
+    for arg in args:
+        key, _, value = arg.partition("=")
+        params[key] = float(value) if "." in value else int(value)
+    return SCENARIOS[name], params
+
+
+def _transcript(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _echo(prompt, turn):
+    yield _assistant("thinking", f"echo turn {turn}")
+    yield _assistant("text", f"echo {turn}: {prompt}")
+    yield _result(turn=turn)
+
+
+def play(lines, out=sys.stdout, err=sys.stderr):
+    for obj in lines:
+        _sleep(obj.pop("_delay_ms", 0))
+        if "_stderr" in obj:
+            err.write(obj["_stderr"] + "\n")
+            err.flush()
+        elif "_exit" in obj:
+            out.flush()
+            sys.exit(obj["_exit"])
+        elif obj:
+            out.write(json.dumps(obj) + "\n")
+            out.flush()
+
+
+def main():
+    session = None
+    for flag in ("--session-id", "--resume"):
+        if flag in sys.argv:
+            session = sys.argv[sys.argv.index(flag) + 1]
+    play([{"type": "system", "subtype": "init", "session_id": session, "tools": []}])
+    transcript = os.environ.get("FAKE_CLAUDE_TRANSCRIPT")
+    turn = 0
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        turn += 1
+        msg = json.loads(line)
+        prompt = "".join(
+            b.get("text", "") for b in msg.get("message", {}).get("content", [])
+        )
+        # Context/backlog may be prepended; the scenario directive is the last line
+        last = prompt.strip().splitlines()[-1] if prompt.strip() else ""
+        if last.startswith("scenario:"):
+            fn, params = _parse_scenario(last)
+            play(fn(turn, **params))
+        elif transcript:
+            play(_transcript(transcript))
+        else:
+            play(_echo(prompt, turn))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Stand-in for an Ollama server, for exercising claude_magic's router offline.
+
+Serves the two endpoints claude_magic uses:
+
+    GET  /api/tags    lists FAKE_OLLAMA_MODELS (default "llama3.2:latest")
+    POST /api/chat    streams the reply as NDJSON chunks, then a done chunk
+                      with prompt_eval_count / eval_count
+
+The reply echoes the last user message word by word, FAKE_OLLAMA_DELAY_MS
+apart (default 10). A chat for a model that isn't listed gets a 404 with
+Ollama's error body, and a message containing "fail" breaks off mid-stream
+with an error chunk, so escalation to Claude can be tested.
+
+Usage:
+    python bench/fake_ollama.py [--port 11434]
+    OLLAMA_HOST=http://127.0.0.1:11434 jupyter lab ...
+
+Or in-process: server, url = fake_ollama.serve(); ...; server.shutdown()
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MODELS = os.environ.get("FAKE_OLLAMA_MODELS", "llama3.2:latest").split(",")
+DELAY_MS = float(os.environ.get("FAKE_OLLAMA_DELAY_MS", "10"))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _json(self, code, obj):
+        body = json.dumps(obj).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._json(200, {"models": [{"name": m} for m in MODELS]})
+        else:
+            self._json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/api/chat":
+            self._json(404, {"error": "not found"})
+            return
+        req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        model = req.get("model", "")
+        if model not in MODELS and f"{model}:latest" not in MODELS:
+            self._json(404, {"error": f"model '{model}' not found"})
+            return
+        messages = req.get("messages", [])
+        prompt = messages[-1]["content"] if messages else ""
+        start = time.time()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        def chunk(obj):
+            self.wfile.write(json.dumps(obj).encode() + b"\n")
+            self.wfile.flush()
+
+        words = f"Local answer ({len(messages) // 2} earlier turns): {prompt}".split()
+        try:
+            for i, word in enumerate(words):
+                time.sleep(DELAY_MS / 1000)
+                if "fail" in prompt and i == 2:
+                    chunk({"error": "simulated model failure"})
+                    return
+                chunk({"model": model, "message": {"role": "assistant", "content": word + " "},
+                       "done": False})
+            chunk({
+                "model": model, "message": {"role": "assistant", "content": ""}, "done": True,
+                "prompt_eval_count": sum(len(m["content"].split()) for m in messages),
+                "eval_count": len(words), "total_duration": int((time.time() - start) * 1e9),
+            })
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # client stopped the turn
+
+
+def serve(host="127.0.0.1", port=0):
+    """Start the server on a daemon thread; returns (server, base URL)."""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=11434)
+    args = ap.parse_args()
+    server = ThreadingHTTPServer((args.host, args.port), _Handler)
+    print(f"fake ollama on http://{args.host}:{args.port} serving {', '.join(MODELS)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
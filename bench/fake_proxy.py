@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Stand-in upstream proxies, for exercising claude_proxy offline.
+
+Speaks HTTP CONNECT (plus absolute-URI GETs) or SOCKS5, like a Mullvad
+endpoint, and reaches only local targets. Each server's `mode` can be
+changed while it runs:
+
+    ok        tunnel normally
+    stall     accept the connection, then never answer (a hung endpoint)
+    refuse    close every connection straight away
+
+`delay_ms` is slept before every reply the proxy sends (CONNECT response,
+SOCKS5 greeting and connect reply) to stand in for a round trip to a
+remote endpoint; TCP connects on loopback are otherwise free.
+
+serve_target() starts a small HTTP server to tunnel to; its response body
+names its port, so a test can tell which path a request took.
+
+Usage:
+    python bench/fake_proxy.py [--port 8080] [--socks] [--mode ok] [--delay-ms 0]
+
+Or in-process: server, url = fake_proxy.serve(socks=True, delay_ms=20); ...; server.shutdown()
+"""
+import argparse
+import socket
+import socketserver
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _recv_exact(sock, n):
+    data = b""
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError("client closed")
+        data += chunk
+    return data
+
+
+def _pipe(src, dst):
+    try:
+        while True:
+            data = src.recv(65536)
+            if not data:
+                break
+            dst.sendall(data)
+        dst.shutdown(socket.SHUT_WR)
+    except OSError:
+        pass
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def _pause(self):
+        if self.server.delay_ms:
+            time.sleep(self.server.delay_ms / 1000)
+
+    def _stalled(self):
+        if self.server.mode == "refuse":
+            return True
+        while self.server.mode == "stall" and not self.server.stopping:
+            time.sleep(0.05)
+        return self.server.stopping or self.server.mode != "ok"
+
+    def setup(self):
+        self.server.open.add(self.request)
+
+    def finish(self):
+        self.server.open.discard(self.request)
+
+    def handle(self):
+        self.server.connections += 1
+        sock = self.request
+        try:
+            if self._stalled():
+                return
+            if self.server.socks:
+                upstream = self._socks()
+            else:
+                upstream = self._http()
+            if upstream is None:
+                return
+            self.server.tunnels += 1
+            t = threading.Thread(target=_pipe, args=(upstream, sock), daemon=True)
+            t.start()
+            _pipe(sock, upstream)
+            t.join()
+            upstream.close()
+        except (OSError, ValueError):
+            pass
+
+    def _socks(self):
+        sock = self.request
+        ver, n = _recv_exact(sock, 2)
+        _recv_exact(sock, n)
+        self._pause()
+        sock.sendall(b"\x05\x00")
+        _, cmd, _, atyp = _recv_exact(sock, 4)
+        if self._stalled():
+            return None
+        if atyp == 1:
+            host = socket.inet_ntoa(_recv_exact(sock, 4))
+        elif atyp == 4:
+            host = socket.inet_ntop(socket.AF_INET6, _recv_exact(sock, 16))
+        else:
+            host = _recv_exact(sock, _recv_exact(sock, 1)[0]).decode()
+        port = int.from_bytes(_recv_exact(sock, 2), "big")
+        self._pause()
+        try:
+            upstream = socket.create_connection((host, port), timeout=5)
+        except OSError:
+            sock.sendall(b"\x05\x05\x00\x01" + bytes(6))  # connection refused
+            return None
+        sock.sendall(b"\x05\x00\x00\x01" + bytes(6))
+        return upstream
+
+    def _http(self):
+        sock = self.request
+        head = b""
+        while b"\r\n\r\n" not in head:
+            chunk = sock.recv(4096)
+            if not chunk:
+                return None
+            head += chunk
+        head, _, rest = head.partition(b"\r\n\r\n")
+        method, target, _ = head.split(b"\r\n", 1)[0].decode("latin-1").split()
+        self._pause()
+        if method == "CONNECT":
+            host, _, port = target.rpartition(":")
+            try:
+                upstream = socket.create_connection((host.strip("[]"), int(port)), timeout=5)
+            except OSError:
+                sock.sendall(b"HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\n\r\n")
+                return None
+            sock.sendall(b"HTTP/1.1 200 Connection established\r\n\r\n")
+            if rest:
+                upstream.sendall(rest)
+            return upstream
+        # Absolute-URI request: send it on in origin form
+        url = urllib.parse.urlsplit(target)
+        upstream = socket.create_connection((url.hostname, url.port or 80), timeout=5)
+        lines = head.split(b"\r\n")
+        path = urllib.parse.urlunsplit(("", "", url.path or "/", url.query, ""))
+        upstream.sendall(f"{method} {path} HTTP/1.1\r\n".encode()
+                         + b"".join(h + b"\r\n" for h in lines[1:]
+                                    if not h.lower().startswith(b"proxy-"))
+                         + b"\r\n" + rest)
+        return upstream
+
+
+class FakeProxy(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, addr, socks=False, mode="ok", delay_ms=0):
+        self.socks = socks
+        self.mode = mode
+        self.delay_ms = delay_ms
+        self.stopping = False
+        self.connections = 0
+        self.tunnels = 0
+        self.open = set()
+        super().__init__(addr, _Handler)
+
+    def shutdown(self):
+        """Stop listening and drop every open connection, like an endpoint going away."""
+        self.stopping = True
+        super().shutdown()
+        self.server_close()
+        for sock in list(self.open):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+def serve(host="127.0.0.1", port=0, socks=False, mode="ok", delay_ms=0):
+    """Start a stand-in proxy on a daemon thread; returns (server, proxy URL)."""
+    server = FakeProxy((host, port), socks, mode, delay_ms)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    scheme = "socks5h" if socks else "http"
+    return server, f"{scheme}://{host}:{server.server_address[1]}"
+
+
+class _Target(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        body = f"target {self.server.server_address[1]} {self.path}\n".encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve_target(host="127.0.0.1", port=0):
+    """Start the HTTP target on a daemon thread; returns (server, "host:port")."""
+    server = ThreadingHTTPServer((host, port), _Target)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"{host}:{server.server_address[1]}"
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8080)
+    ap.add_argument("--socks", action="store_true")
+    ap.add_argument("--mode", default="ok", choices=("ok", "stall", "refuse"))
+    ap.add_argument("--delay-ms", type=float, default=0)
+    args = ap.parse_args()
+    server = FakeProxy((args.host, args.port), args.socks, args.mode, args.delay_ms)
+    print(f"fake {'socks5' if args.socks else 'http'} proxy on {args.host}:{args.port} ({args.mode})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,14 @@
 # Auto-load Claude magic on kernel start
+#
+# Kept near-zero cost: the magics and ask()/aask()/ask_many() are registered
+# as lightweight stubs, and claude_magic (with subprocess, threading, asyncio,
+# ssl, ...) is only imported the first time one of them is used. Batch runs
+# (papermill, nbconvert) that never call Claude pay nothing.
+#
+# CLAUDE_BANNER=full|short|off controls the startup banner (default: short).
+# The short banner is skipped in kernels nobody is watching (papermill,
+# nbconvert, jupyter execute, no shell) so it doesn't land in executed
+# notebooks; full always prints.
 import sys
 sys.path.insert(0, "/opt/ai")
 
@@ -28,17 +38,93 @@ except Exception:
     pass  # Non-critical — ask() and %%claude still work
 
 import os as _os
-from claude_magic import CLAUDE_SESSION_ID, ask
-
-_image_version = _os.environ.get('IMAGE_VERSION', 'unknown')
-_image_tag = _os.environ.get('IMAGE_TAG', 'unknown')
-_image_sha = _os.environ.get('IMAGE_SHA', 'unknown')[:8]
-print(f"Claude magic loaded. [v{_image_version} ({_image_tag}) build {_image_sha}]  Session: {CLAUDE_SESSION_ID[:8]}...")
-print('  ask("your question here")  - recommended (handles ? and quotes)')
-print("  %claude <query>             - line magic")
-print("  %%claude                    - cell magic for multi-line prompts")
-print("  %claude_auth                - authenticate (first time)")
-print("  %claude_reset               - fresh conversation")
-print("  %claude_thinking            - toggle thinking visibility")
-print("  %claude_status              - show session info")
-print("  %claude_version             - show image tag and git SHA")
+
+# Must match the magics registered by claude_magic._register_magics()
+_CLAUDE_LINE_MAGICS = (
+    "claude", "claude_auth", "claude_reset", "claude_compact", "claude_backend",
+    "claude_pipeline", "claude_history", "claude_resume", "claude_thinking",
+    "claude_timeout", "claude_cache", "claude_stats", "claude_status",
+    "claude_version", "proxy",
+)
+_CLAUDE_CELL_MAGICS = ("claude",)
+
+
+def _claude_magic():
+    """Import claude_magic on first use; its import replaces the stubs below."""
+    import claude_magic
+    return claude_magic
+
+
+def _claude_line_stub(name):
+    def stub(line):
+        _claude_magic()
+        return get_ipython().run_line_magic(name, line)
+    stub.__doc__ = f"%{name} (loads Claude magic on first use)"
+    return stub
+
+
+def _claude_cell_stub(name):
+    def stub(line, cell):
+        _claude_magic()
+        return get_ipython().run_cell_magic(name, line, cell)
+    stub.__doc__ = f"%%{name} (loads Claude magic on first use)"
+    return stub
+
+
+def ask(prompt, *args, **kwargs):
+    """Send a question to Claude. See claude_magic.ask."""
+    return _claude_magic().ask(prompt, *args, **kwargs)
+
+
+async def aask(prompt, **kwargs):
+    """Awaitable ask(). See claude_magic.aask."""
+    return await _claude_magic().aask(prompt, **kwargs)
+
+
+def ask_many(prompts, *args, **kwargs):
+    """Run many prompts concurrently. See claude_magic.ask_many."""
+    return _claude_magic().ask_many(prompts, *args, **kwargs)
+
+
+try:
+    _ip = get_ipython()
+    for _name in _CLAUDE_LINE_MAGICS:
+        _ip.register_magic_function(_claude_line_stub(_name), "line", _name)
+    for _name in _CLAUDE_CELL_MAGICS:
+        _ip.register_magic_function(_claude_cell_stub(_name), "cell", _name)
+except Exception:
+    pass  # No shell (plain python); ask() still works
+
+
+def _claude_interactive():
+    """False for batch runs (papermill, nbconvert, jupyter execute) and plain python."""
+    try:
+        if get_ipython() is None:
+            return False
+    except NameError:
+        return False
+    if any(k.startswith(("PAPERMILL", "NBCONVERT")) for k in _os.environ):
+        return False
+    if "ipykernel" in sys.modules:
+        # Set by jupyter_server for kernels it starts for a notebook or
+        # console; nbclient (nbconvert, papermill, jupyter execute) does not
+        return "JPY_SESSION_NAME" in _os.environ
+    return sys.stdout.isatty()
+
+
+_banner = _os.environ.get("CLAUDE_BANNER", "short").lower()
+if _banner == "full":
+    _image_version = _os.environ.get('IMAGE_VERSION', 'unknown')
+    _image_tag = _os.environ.get('IMAGE_TAG', 'unknown')
+    _image_sha = _os.environ.get('IMAGE_SHA', 'unknown')[:8]
+    print(f"Claude magic ready. [v{_image_version} ({_image_tag}) build {_image_sha}]")
+    print('  ask("your question here")  - recommended (handles ? and quotes)')
+    print("  %claude <query>             - line magic")
+    print("  %%claude                    - cell magic for multi-line prompts")
+    print("  %claude_auth                - authenticate (first time)")
+    print("  %claude_reset               - fresh conversation")
+    print("  %claude_thinking            - toggle thinking visibility")
+    print("  %claude_status              - show session info")
+    print("  %claude_version             - show image tag and git SHA")
+elif _banner != "off" and _claude_interactive():
+    print('Claude magic ready: ask("..."), %claude, %%claude  (%claude for help)')
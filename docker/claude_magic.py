@@ -8,13 +8,18 @@ Features:
     - Streaming output (tokens appear as they arrive)
     - Collapsible thinking section (like Cursor's Claude extension)
     - Session persistence across cells
+    - Warm CLI worker per kernel (no Node startup or transcript reload per turn)
 
 Usage:
     ask("What are the three laws of robotics?")   # function — works with ? and quotes
+    t = ask("...", background=True)                # non-blocking; t.result() / t.cancel()
+    answer = await aask("...")                     # asyncio-native (IPython autoawait)
+    answers = ask_many(prompts, workers=8)         # concurrent batch, results in input order
     %%claude
     What are the three laws of robotics?           # cell magic — also works with ?
 
     %claude explain the error above                # line magic
+    %%claude --bg                                  # cell magic, streams in the background
     %claude What are the three laws of robotics?   # works — HelpEnd patch blocks ? interception
 
     %claude_auth       # authenticate (first time only)
@@ -22,14 +27,33 @@ Usage:
     %claude_status     # show session info
 """
 
+import asyncio
+import atexit
+import base64
+import collections
+import concurrent.futures
+import contextlib
+import hashlib
 import json
 import os
+import queue
 import re
+import reprlib
+import select
+import shutil
+import signal
+import socket
+import ssl
 import subprocess
+import sys
 import threading
 import time
+import traceback
+import urllib.parse
 import uuid
+import weakref
 
+from IPython import get_ipython
 from IPython.core.magic import register_line_magic, register_cell_magic
 from IPython.display import display, Markdown, HTML
 
@@ -66,307 +90,3504 @@ def _escape_html(text):
     return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
 
 
-def _render_streaming_html(thinking, answer, elapsed, phase_idx=0, done=False):
+def _render_streaming_html(thinking_html, answer, elapsed, phase_idx=0, done=False, status=None,
+                           tools_html=""):
     """Render the combined thinking + answer HTML for a streaming update.
 
+    `thinking_html` must already be escaped (see _StreamRenderer). `status`
+    replaces the rotating spinner phrase (e.g. a queue position).
+    `tools_html` (see _render_tool_rows) goes below the thinking box.
+
     While streaming thinking: <details open> with thinking content, no answer yet.
     While streaming answer: <details> collapsed, answer below.
-    When done: <details> collapsed, answer rendered as final.
+    When done: the caller replaces all of this (see _render_final).
+    """
+    parts = []
+
+    if thinking_html and _show_thinking:
+        is_open = " open" if (not answer and not done) else ""
+        elapsed_str = f" ({elapsed:.1f}s)" if elapsed else ""
+        parts.append(f"""<details class="claude-thinking"{is_open}><summary>Thinking{elapsed_str}</summary>\
+<div>{thinking_html}</div></details>""")
+    elif not done and not answer:
+        # No thinking yet, show animated spinner
+        dots = "." * ((phase_idx % 3) + 1)
+        pad = " " * (3 - (phase_idx % 3) - 1)
+        phase = status or _PHASES[int(phase_idx // 3) % len(_PHASES)]
+        elapsed_str = f"{elapsed:.0f}s" if elapsed else ""
+        parts.append(f"""<div class="claude-box"><span class="claude-dot">&#x25cf;</span>\
+<b>{phase}{dots}{pad}</b><small>{elapsed_str}</small></div>""")
+
+    if tools_html:
+        parts.append(tools_html)
+
+    if answer:
+        # Render answer as-is (will be replaced with Markdown render when done)
+        parts.append(f"""<div class="claude-answer">{answer}</div>""")
+
+    return "\n".join(parts)
+
+
+# Tool calls are listed as compact rows under the thinking box: only the last
+# _TOOL_ROWS are shown, and tool output is cut to a short preview (the CLI
+# keeps the full result; the notebook never needs it).
+_TOOL_ROWS = 12
+_TOOL_PREVIEW_CHARS = 300
+# While a tool runs its row timer is refreshed this often (seconds)
+_TOOL_TICK_S = 1.0
+
+# Input field summarised for well-known tools; others show their first string input
+_TOOL_ARG_KEYS = {
+    "Bash": "command",
+    "Read": "file_path",
+    "Write": "file_path",
+    "Edit": "file_path",
+    "MultiEdit": "file_path",
+    "NotebookEdit": "notebook_path",
+    "Glob": "pattern",
+    "Grep": "pattern",
+    "WebFetch": "url",
+    "WebSearch": "query",
+    "Task": "description",
+}
+
+
+def _tool_arg_summary(name, args, limit=80):
+    """One-line summary of a tool_use input, e.g. the command for Bash."""
+    if not isinstance(args, dict):
+        return ""
+    value = args.get(_TOOL_ARG_KEYS.get(name, ""))
+    if not isinstance(value, str):
+        value = next((v for v in args.values() if isinstance(v, str)), "")
+    value = " ".join(value.split())
+    return value if len(value) <= limit else value[:limit - 1] + "…"
+
+
+def _tool_result_text(block):
+    """Text of a tool_result block (a string or a list of text parts)."""
+    content = block.get("content")
+    if isinstance(content, list):
+        content = "".join(c.get("text", "") for c in content if isinstance(c, dict))
+    return content if isinstance(content, str) else ""
+
+
+def _format_size(n):
+    if n < 1024:
+        return f"{n} B"
+    if n < 1024 * 1024:
+        return f"{n / 1024:.1f} KB"
+    return f"{n / 1024 / 1024:.1f} MB"
+
+
+def _render_tool_rows(calls, total, now):
+    """Render tool calls as compact rows while the turn runs.
+
+    `calls` are _StreamRenderer tool dicts, of which only the tail is passed
+    in; `total` is the number of calls in the turn.
+    """
+    rows = []
+    if total > len(calls):
+        rows.append(f"<i>&hellip; {total - len(calls)} earlier tool calls</i>")
+    for call in calls:
+        if call["end"] is None:
+            kind = " claude-run"
+            result = f"running {now - call['start']:.0f}s"
+        else:
+            kind = " claude-err" if call["error"] else ""
+            result = f"{call['end'] - call['start']:.1f}s &middot; {_format_size(call['bytes'])}"
+        title = _escape_html(call["preview"]).replace('"', "&quot;")
+        rows.append(f"""<div class="claude-tool{kind}" title="{title}">\
+<b>{_escape_html(call['name'])}</b> {_escape_html(call['arg'])} <small>{result}</small></div>""")
+        if call["error"] and call["preview"]:
+            rows.append(f"""<div class="claude-tool-error">{_escape_html(call['preview'])}</div>""")
+    return f"""<div class="claude-tools">{"".join(rows)}</div>"""
+
+
+# Cap on live display refreshes per second; override with CLAUDE_MAX_FPS
+_max_fps = float(os.environ.get("CLAUDE_MAX_FPS", "12"))
+
+# The streaming answer is rendered as Markdown across a chain of outputs.
+# Once the live segment grows past this many chars, its completed blocks are
+# sealed into their own output and never re-sent; only the trailing open
+# block keeps re-rendering, so each refresh carries one small segment.
+_SEGMENT_CHARS = 2048
+
+_FENCE_RE = re.compile(r" {0,3}(`{3,}|~{3,})")
+
+
+def _markdown_cut(text):
+    """Find where a streaming Markdown segment can be split.
+
+    Returns (block_cut, line_cut, fence). block_cut is the offset of the last
+    top-level block start: after a blank line, outside code fences, and not an
+    indented continuation of a list item; 0 if there is none yet. line_cut is
+    the end of the last complete line, and fence the (marker, opening line)
+    of a code fence still open there, else None.
+    """
+    block_cut = line_cut = 0
+    fence = None
+    prev_blank = False
+    for line in text.splitlines(keepends=True):
+        if not line.endswith("\n"):
+            break  # still streaming
+        if prev_blank and line.strip() and line[0] not in " \t":
+            block_cut = line_cut
+        m = _FENCE_RE.match(line)
+        if m and fence is None:
+            fence = (m.group(1), line.rstrip("\n"))
+        elif (m and m.group(1)[0] == fence[0][0] and len(m.group(1)) >= len(fence[0])
+              and not line[m.end():].strip()):
+            fence = None
+        prev_blank = fence is None and not line.strip()
+        line_cut += len(line)
+    return block_cut, line_cut, fence
+
+
+# Only the last N KB of thinking is kept in memory, shown live and saved in
+# the notebook; longer thinking is spilled in full to a per-turn side file
+# under the session's directory in _spill_dir and linked from the output.
+_thinking_tail_chars = int(float(os.environ.get("CLAUDE_THINKING_TAIL_KB", "32")) * 1024)
+_spill_dir = os.environ.get(
+    "CLAUDE_SPILL_DIR",
+    os.path.join(os.environ.get("HOME", "/home/jovyan"), "work", "claude-turns"),
+)
+
+
+class _StreamRenderer:
+    """Incremental live view for one turn.
+
+    Chunks are HTML-escaped once on arrival, a display handle is only re-sent
+    when its own content changed, and refreshes are coalesced to _max_fps.
+    Thinking and tool-call rows live in `handle`; answer text streams as
+    Markdown into sealed segments displayed after it. Thinking is held as a
+    bounded tail (see _thinking_tail_chars) with the full text spilled to disk.
+    """
+
+    def __init__(self, handle, start, answer_handle=None):
+        self.handle = handle
+        self.start = start
+        # A fixed answer handle (background turns) disables segmenting
+        self._segmented = answer_handle is None
+        self.thinking_elapsed = 0
+        self.thinking_chars = 0
+        self.thinking_file = None
+        self.status = None  # overrides the spinner phrase while nothing has streamed
+        self.answer = []
+        self.tools = {}  # tool_use id -> call dict, in call order
+        self._tick = 0
+        self._thinking = collections.deque()  # (raw, escaped) tail chunks
+        self._tail_chars = 0
+        self._seg_handles = [] if answer_handle is None else [answer_handle]
+        self._seg = []
+        self._seg_len = 0
+        self._thinking_dirty = False
+        self._answer_dirty = False
+        self._last_flush = 0.0
+
+    def add_thinking(self, text, now=None):
+        if not text:
+            return
+        now = time.time() if now is None else now
+        self.thinking_chars += len(text)
+        if self.thinking_file is not None:
+            self._spill(text)
+        self._thinking.append((text, _escape_html(text)))
+        self._tail_chars += len(text)
+        if self._tail_chars > _thinking_tail_chars:
+            self._trim_thinking()
+        self.thinking_elapsed = now - self.start
+        self._thinking_dirty = True
+
+    def _trim_thinking(self):
+        """Drop head chunks beyond the tail cap, spilling everything to disk first."""
+        if self.thinking_file is None:
+            self._open_spill()
+        while len(self._thinking) > 1 and self._tail_chars - len(self._thinking[0][0]) >= _thinking_tail_chars:
+            raw, _ = self._thinking.popleft()
+            self._tail_chars -= len(raw)
+        if self._tail_chars > _thinking_tail_chars:
+            raw, _ = self._thinking[0]
+            keep = raw[len(raw) - (_thinking_tail_chars - (self._tail_chars - len(raw))):]
+            self._thinking[0] = (keep, _escape_html(keep))
+            self._tail_chars -= len(raw) - len(keep)
+
+    def _open_spill(self):
+        session_dir = os.path.join(_spill_dir, CLAUDE_SESSION_ID)
+        name = f"turn-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}-thinking.txt"
+        path = os.path.join(session_dir, name)
+        try:
+            os.makedirs(session_dir, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("".join(raw for raw, _ in self._thinking))
+        except OSError:
+            return  # no side file; the view still shows the tail
+        self.thinking_file = path
+
+    def _spill(self, text):
+        try:
+            with open(self.thinking_file, "a", encoding="utf-8") as f:
+                f.write(text)
+        except OSError:
+            pass
+
+    def add_answer(self, text):
+        if not text:
+            return
+        if not self.answer:
+            self._thinking_dirty = True  # collapse the thinking box
+        self.answer.append(text)
+        self._seg.append(text)
+        self._seg_len += len(text)
+        self._answer_dirty = True
+
+    def add_tool_use(self, block, now=None):
+        now = time.time() if now is None else now
+        name = block.get("name") or "tool"
+        self.tools[block.get("id") or uuid.uuid4().hex] = {
+            "name": name, "arg": _tool_arg_summary(name, block.get("input")),
+            "start": now, "end": None, "bytes": 0, "error": False, "preview": "",
+        }
+        self._thinking_dirty = True
+
+    def add_tool_result(self, tool_use_id, size, is_error=False, preview="", now=None):
+        call = self.tools.get(tool_use_id)
+        if call is None or call["end"] is not None:
+            return
+        call.update(end=time.time() if now is None else now, bytes=size,
+                    error=bool(is_error), preview=preview[:_TOOL_PREVIEW_CHARS])
+        self._thinking_dirty = True
+
+    def tools_running(self):
+        return any(call["end"] is None for call in self.tools.values())
+
+    def tool_seconds(self, now=None):
+        """Wall time spent in tools; overlapping (parallel) calls count once."""
+        now = time.time() if now is None else now
+        total, span_start, span_end = 0.0, None, None
+        for start, end in sorted((c["start"], c["end"] or now) for c in self.tools.values()):
+            if span_end is None or start > span_end:
+                if span_end is not None:
+                    total += span_end - span_start
+                span_start, span_end = start, end
+            else:
+                span_end = max(span_end, end)
+        if span_end is not None:
+            total += span_end - span_start
+        return total
+
+    def record_tools(self, metrics, now=None):
+        """Add tool call counts and times to the turn's metrics."""
+        if not self.tools:
+            return
+        now = time.time() if now is None else now
+        per_tool = {}
+        for call in self.tools.values():
+            entry = per_tool.setdefault(call["name"], [0, 0.0])
+            entry[0] += 1
+            entry[1] += (call["end"] or now) - call["start"]
+        metrics["tool_calls"] = len(self.tools)
+        metrics["tool_s"] = self.tool_seconds(now)
+        metrics["tools"] = {name: [n, round(s, 3)] for name, (n, s) in per_tool.items()}
+
+    def tools_html(self, now=None):
+        if not self.tools:
+            return ""
+        now = time.time() if now is None else now
+        return _render_tool_rows(list(self.tools.values())[-_TOOL_ROWS:], len(self.tools), now)
+
+    def thinking_text(self):
+        """Thinking held in memory: all of it, or the tail once spilled."""
+        return "".join(raw for raw, _ in self._thinking)
+
+    def answer_text(self):
+        return "".join(self.answer)
+
+    def thinking_html(self):
+        body = "".join(html for _, html in self._thinking)
+        omitted = self.thinking_chars - self._tail_chars
+        if omitted <= 0:
+            return body
+        note = f"&hellip; {omitted:,} earlier characters omitted"
+        if self.thinking_file is not None:
+            try:
+                href = os.path.relpath(self.thinking_file, os.getcwd())
+            except ValueError:
+                href = self.thinking_file
+            href = _escape_html(href).replace('"', "&quot;")
+            note += f' &mdash; <a href="{href}" target="_blank">load full thinking</a>'
+        return f"<i>{note}</i>{body}"
+
+    def flush(self, now=None, force=False):
+        """Push changed handles, at most once per 1/_max_fps unless forced."""
+        if not (self._thinking_dirty or self._answer_dirty):
+            return
+        now = time.time() if now is None else now
+        if not force and now - self._last_flush < 1.0 / _max_fps:
+            return
+        self._last_flush = now
+
+        if self._thinking_dirty:
+            self._thinking_dirty = False
+            answering = bool(self.answer)
+            elapsed = self.thinking_elapsed if answering else now - self.start
+            # done=answering renders the thinking box collapsed once the answer starts
+            self.handle.update(HTML(_render_streaming_html(
+                self.thinking_html(), "", elapsed, phase_idx=self._tick, done=answering,
+                status=self.status, tools_html=self.tools_html(now),
+            )))
+
+        if self._answer_dirty:
+            self._answer_dirty = False
+            if not (self._segmented and self._seg_len > _SEGMENT_CHARS and self._seal_segment()):
+                self._update_segment()
+
+    def next_frame_in(self, idle):
+        """Seconds until a pending update may be flushed, else `idle`."""
+        if not (self._thinking_dirty or self._answer_dirty):
+            return idle
+        wait = self._last_flush + 1.0 / _max_fps - time.time()
+        return min(idle, max(wait, 0.0))
+
+    def spinner(self, tick, now=None):
+        """Animate the placeholder while nothing has streamed yet; tick running tool timers."""
+        now = time.time() if now is None else now
+        self._tick = tick
+        if self.tools_running():
+            if now - self._last_flush >= _TOOL_TICK_S:
+                self._thinking_dirty = True
+                self.flush(now)
+            return
+        if self.thinking_chars or self.answer:
+            return
+        self.handle.update(HTML(_render_streaming_html(
+            "", "", now - self.start, phase_idx=tick, done=False, status=self.status,
+            tools_html=self.tools_html(now),
+        )))
+
+    def reset_answer(self):
+        """Drop streamed answer text (an error line before a retry); its output is reused."""
+        self.answer, self._seg, self._seg_len = [], [], 0
+        self._answer_dirty = False
+        for h in self._seg_handles:
+            h.update(Markdown(""))
+
+    def answer_handles(self):
+        return list(self._seg_handles)
+
+    def clear(self):
+        self.handle.update(HTML(""))
+        for h in self._seg_handles:
+            h.update(HTML(""))
+
+    def _update_segment(self):
+        view = Markdown("".join(self._seg))
+        if self._seg_handles:
+            self._seg_handles[-1].update(view)
+        else:
+            self._seg_handles.append(display(view, display_id=True))
+
+    def _seal_segment(self):
+        """Freeze the live segment's completed Markdown blocks; False if there are none yet."""
+        text = "".join(self._seg)
+        block_cut, line_cut, fence = _markdown_cut(text)
+        if block_cut:
+            cut, fence = block_cut, None
+        elif self._seg_len >= 4 * _SEGMENT_CHARS:
+            # One huge block, usually a code fence: split at a line break
+            # (mid-line if there is none), closing and reopening the fence
+            cut = line_cut or len(text)
+        else:
+            return False
+        head, tail = text[:cut], text[cut:]
+        if fence is not None:
+            head += ("" if head.endswith("\n") else "\n") + fence[0] + "\n"
+            tail = fence[1] + "\n" + tail
+        self._seg = [head]
+        self._update_segment()
+        self._seg = [tail] if tail else []
+        self._seg_len = len(tail)
+        self._seg_handles.append(display(Markdown(tail), display_id=True))
+        return True
+
+    def finish(self):
+        """Final answer update: re-send only the live segment, in place."""
+        if self._answer_dirty or (self.answer and not self._seg_handles):
+            self._answer_dirty = False
+            self._update_segment()
+
+
+# "user" events carry tool results, sometimes multi-MB. Lines of these types
+# longer than _SUMMARY_LINE_BYTES are not parsed: they become a summary event
+# {"type", "_summary": True, "bytes", "tool_use_ids", "is_error"} found by regex.
+_SUMMARY_EVENT_TYPES = frozenset({"user"})
+_SUMMARY_LINE_BYTES = 64 * 1024
+
+_EVENT_TYPE_RE = re.compile(rb'\s*\{\s*"type"\s*:\s*"([A-Za-z_]+)"')
+# Quotes inside JSON strings are escaped, so these only match real keys
+_TOOL_USE_ID_RE = re.compile(rb'"tool_use_id"\s*:\s*"([^"\\]+)"')
+_IS_ERROR_RE = re.compile(rb'"is_error"\s*:\s*true')
+
+
+class _EventReader:
+    """Incremental stream-json line reader over a pipe.
+
+    Bytes are buffered in a bytearray and split on b"\\n" (which never occurs
+    inside a UTF-8 sequence), so multi-byte characters that straddle a read
+    boundary decode intact. Newline search resumes where the last one left
+    off and the buffer is compacted once per read, keeping huge lines linear.
+    Read size adapts between 64 KB and 4 MB with the stream's burst size.
+    """
+
+    MIN_READ = 64 * 1024
+    MAX_READ = 4 * 1024 * 1024
+
+    def __init__(self, fd, summary_types=_SUMMARY_EVENT_TYPES):
+        self.fd = fd
+        self.summary_types = summary_types
+        self.read_size = self.MIN_READ
+        self.summarized = 0
+        self._buf = bytearray()
+        self._scanned = 0  # prefix of _buf known to hold no newline
+
+    def read(self, timeout):
+        """Return events parsed within `timeout` seconds; [] if none, None at EOF."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        chunk = os.read(self.fd, self.read_size)
+        if not chunk:
+            events = self._drain()
+            if self._buf:
+                # Trailing line without a newline
+                events.extend(self._parse(0, len(self._buf)))
+                self._buf.clear()
+            return events or None
+
+        if len(chunk) == self.read_size:
+            self.read_size = min(self.read_size * 2, self.MAX_READ)
+        elif len(chunk) < self.read_size // 8:
+            self.read_size = max(self.read_size // 2, self.MIN_READ)
+        self._buf += chunk
+        return self._drain()
+
+    def _drain(self):
+        buf = self._buf
+        events = []
+        start = 0
+        pos = self._scanned
+        while True:
+            nl = buf.find(b"\n", pos)
+            if nl < 0:
+                break
+            events.extend(self._parse(start, nl))
+            start = pos = nl + 1
+        if start:
+            del buf[:start]
+        self._scanned = len(buf)
+        return events
+
+    def _parse(self, start, end):
+        """Parse buf[start:end] as one event; returns a 0- or 1-item list."""
+        m = _EVENT_TYPE_RE.match(self._buf, start, end)
+        etype = m.group(1).decode() if m is not None else None
+        if etype in self.summary_types and end - start > _SUMMARY_LINE_BYTES:
+            self.summarized += 1
+            ids = [i.decode() for i in _TOOL_USE_ID_RE.findall(self._buf, start, end)]
+            return [{"type": etype, "_summary": True, "bytes": end - start,
+                     "tool_use_ids": list(dict.fromkeys(ids)),
+                     "is_error": _IS_ERROR_RE.search(self._buf, start, end) is not None}]
+        line = bytes(self._buf[start:end]).strip()
+        if not line:
+            return []
+        try:
+            return [json.loads(line)]
+        except ValueError:
+            return []
+
+
+# Env vars that change where the CLI connects; a warm worker spawned under
+# different values (e.g. before %proxy) must be restarted to pick them up.
+_WORKER_ENV_KEYS = (
+    "http_proxy", "https_proxy", "HTTP_PROXY", "HTTPS_PROXY",
+    "all_proxy", "ALL_PROXY", "CLAUDE_CONFIG_DIR",
+)
+
+
+class _ClaudeWorker:
+    """Long-lived `claude` process attached to one session ID.
+
+    Runs the CLI in bidirectional stream-json mode: each prompt is written to
+    stdin as a user message and the turn ends at the next ``result`` event.
+    The process stays warm between turns, so Node startup and the session
+    transcript load are paid once per worker instead of once per prompt.
+    """
+
+    pooled = False
+    queue_position = None
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.proc = None
+        self.stderr_buf = collections.deque(maxlen=200)
+        self.reader = None
+        self._env_key = None
+        self.started_at = None
+        self.ready_s = None  # spawn -> first stdout event
+
+    def alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def start(self, resume, fork=False):
+        """Spawn the CLI. `resume` selects --resume over --session-id.
+
+        With `fork`, the resumed conversation continues under a new session ID
+        and the original session is left untouched.
+        """
+        session_args = ["--resume" if resume else "--session-id", self.session_id]
+        if fork:
+            session_args.append("--fork-session")
+        cmd = [
+            "claude", "-p",
+            *session_args,
+            "--input-format", "stream-json",
+            "--output-format", "stream-json",
+            "--verbose",
+        ]
+        self.proc = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=os.environ.get("HOME", "/home/jovyan"),
+            # Own process group, so tool subprocesses the CLI started are
+            # signalled along with it instead of being orphaned
+            start_new_session=True,
+        )
+        self.reader = _EventReader(self.proc.stdout.fileno())
+        self._env_key = self._current_env_key()
+        self.stderr_buf.clear()
+        self.started_at = time.time()
+        self.ready_s = None
+
+        proc = self.proc
+
+        def _read_stderr():
+            for line in proc.stderr:
+                self.stderr_buf.append(line.decode("utf-8", errors="replace"))
+
+        threading.Thread(target=_read_stderr, daemon=True).start()
+
+    def stale(self):
+        """True if the environment changed since the worker was spawned."""
+        return self._env_key != self._current_env_key()
+
+    @staticmethod
+    def _current_env_key():
+        return tuple(os.environ.get(k) for k in _WORKER_ENV_KEYS)
+
+    def send(self, prompt):
+        """Write one user turn to the worker's stdin."""
+        msg = {
+            "type": "user",
+            "message": {"role": "user", "content": [{"type": "text", "text": prompt}]},
+        }
+        self.proc.stdin.write((json.dumps(msg) + "\n").encode("utf-8"))
+        self.proc.stdin.flush()
+
+    def read_events(self, timeout):
+        """Return events parsed from stdout within `timeout` seconds.
+
+        Returns [] if nothing arrived and None once stdout hits EOF.
+        """
+        events = self.reader.read(timeout)
+        if events and self.ready_s is None:
+            self.ready_s = time.time() - self.started_at
+        return events
+
+    def wait(self):
+        """Reap the exited process and return its exit code."""
+        return self.proc.wait()
+
+    def describe(self):
+        return f"pid {self.proc.pid}" if self.alive() else "not running"
+
+    def interrupt(self):
+        """Send SIGINT to the CLI's process group, as Ctrl-C in a terminal would."""
+        if self.alive():
+            _signal_group(self.proc, signal.SIGINT)
+
+    def stop(self, kill=False):
+        """Close stdin and reap the process, terminating its group if it lingers (or at once if `kill`)."""
+        proc, self.proc = self.proc, None
+        if proc is None:
+            return
+        try:
+            proc.stdin.close()
+        except OSError:
+            pass
+        if not kill:
+            try:
+                proc.wait(timeout=2)
+                return
+            except subprocess.TimeoutExpired:
+                pass
+        _terminate_group(proc)
+
+
+# CLI processes that outlived SIGKILL's grace period; polled by _reap_orphans
+# so a long-running kernel doesn't accumulate zombies from aborted turns.
+_orphans = []
+
+
+def _signal_group(proc, sig):
+    try:
+        os.killpg(proc.pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def _terminate_group(proc):
+    """SIGTERM the process group, then SIGKILL it; park it if it still won't exit."""
+    for sig, wait_s in ((signal.SIGTERM, 1), (signal.SIGKILL, 1)):
+        _signal_group(proc, sig)
+        try:
+            proc.wait(timeout=wait_s)
+            return
+        except subprocess.TimeoutExpired:
+            pass
+    _orphans.append(proc)
+
+
+def _reap_orphans():
+    _orphans[:] = [p for p in _orphans if p.poll() is None]
+
+
+# Pod-wide worker pool run by the claude_pool Jupyter server extension. When
+# its socket exists, turns go through the shared pool instead of a warm
+# process owned by this kernel; if it can't be reached the kernel falls back
+# to its own worker for _POOL_RETRY_S before trying the pool again.
+_pool_socket = os.environ.get("CLAUDE_POOL_SOCKET", f"/tmp/claude-pool-{os.getuid()}.sock")
+_pool_retry_at = 0.0
+_POOL_RETRY_S = 30
+
+
+def _pool_available():
+    return (
+        os.environ.get("CLAUDE_POOL", "1") != "0"
+        and time.time() >= _pool_retry_at
+        and os.path.exists(_pool_socket)
+    )
+
+
+def _pool_request(req, timeout=5):
+    """One-shot request/reply on the pool socket (stop, stats)."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        s.connect(_pool_socket)
+        s.sendall((json.dumps(req) + "\n").encode("utf-8"))
+        buf = b""
+        while not buf.endswith(b"\n"):
+            chunk = s.recv(65536)
+            if not chunk:
+                break
+            buf += chunk
+    return json.loads(buf or b"{}")
+
+
+def _pool_reserve(session_id):
+    """Ask the pool to pre-spawn a spare on this kernel's next session, if it runs."""
+    if not _pool_available():
+        return
+    try:
+        _pool_request({"op": "reserve", "session": session_id,
+                       "env": {k: os.environ.get(k) for k in _WORKER_ENV_KEYS}}, timeout=1)
+    except (OSError, ValueError):
+        pass
+
+
+class _PoolWorker:
+    """Worker interface backed by the shared pool (see claude_pool.py).
+
+    Each turn is one connection: the request goes out with the session ID and
+    this kernel's proxy/config env, and the CLI's stream-json events come
+    back on the same socket. Pool control events (queue position, grant) are
+    consumed here and never reach _run_turn.
+    Closing the connection mid-turn makes the pool kill the worker.
+    """
+
+    pooled = True
+
+    def __init__(self, session_id, fork_from=None):
+        self.session_id = session_id
+        self.fork_from = fork_from  # continue a copy of this session (see _throwaway_worker)
+        self.sock = None
+        self.reader = None
+        self.stderr_buf = collections.deque(maxlen=200)
+        self.queue_position = None
+        self.wait_s = None
+        self.started_at = None
+        self.ready_s = None  # set only when the pool spawned a process for this turn
+        self._spawned = False
+
+    def alive(self):
+        return True  # processes live in the pool
+
+    def stale(self):
+        return False  # env travels with every request
+
+    def start(self, resume, fork=False):
+        pass  # nothing to spawn here; send() reads the session state each turn
+
+    def send(self, prompt):
+        global _pool_retry_at
+        self._close()
+        # alive() is always True, so _get_worker never calls start(): whether
+        # the session already has turns must be read here, every turn. The
+        # pool may have evicted the process; it then respawns with --resume.
+        resume = _session_created and self.session_id == CLAUDE_SESSION_ID
+        req = {
+            "op": "turn",
+            "kernel": os.getpid(),
+            "session": self.session_id,
+            "resume": resume,
+            "new": not resume and not self.fork_from,
+            "env": {k: os.environ.get(k) for k in _WORKER_ENV_KEYS},
+            "prompt": prompt,
+        }
+        if self.fork_from:
+            req["fork_from"] = self.fork_from
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(_pool_socket)
+            sock.sendall((json.dumps(req) + "\n").encode("utf-8"))
+        except OSError:
+            sock.close()
+            _pool_retry_at = time.time() + _POOL_RETRY_S
+            raise
+        self.sock = sock
+        self.reader = _EventReader(sock.fileno())
+        self.queue_position = None
+        self.wait_s = None
+        self.started_at = time.time()
+        self.ready_s = None
+        self._spawned = False
+
+    def read_events(self, timeout):
+        events = self.reader.read(timeout)
+        if not events:
+            if events is None:
+                self.stderr_buf.append("connection to the Claude worker pool closed")
+            return events
+        out = []
+        for event in events:
+            etype = event.get("type", "")
+            if etype == "pool_queued":
+                self.queue_position = event.get("position")
+            elif etype == "pool_grant":
+                self.queue_position = None
+                self.wait_s = event.get("wait_s")
+                self._spawned = bool(event.get("spawned"))
+                self.started_at = time.time()
+            else:
+                out.append(event)
+        if out and self._spawned and self.ready_s is None:
+            self.ready_s = time.time() - self.started_at
+        return out
+
+    def wait(self):
+        return None  # no local process
+
+    def interrupt(self):
+        """Ask the pool to SIGINT this turn's CLI; events keep flowing until it exits."""
+        if self.sock is not None:
+            try:
+                self.sock.sendall(b'{"op": "interrupt"}\n')
+            except OSError:
+                pass
+
+    def describe(self):
+        try:
+            stats = _pool_request({"op": "stats"}, timeout=2)
+        except (OSError, ValueError):
+            return f"pool {_pool_socket} (unreachable)"
+        return (f"pool ({stats.get('live', 0)}/{stats.get('size', 0)} live, "
+                f"{stats.get('active', 0)} busy, {stats.get('queued', 0)} queued)")
+
+    def _close(self):
+        sock, self.sock = self.sock, None
+        if sock is not None:
+            sock.close()
+
+    def stop(self, kill=False):
+        """Drop the connection (the pool kills a running turn); unless `kill`, free the process."""
+        self._close()
+        if not kill:
+            try:
+                _pool_request({"op": "stop", "session": self.session_id}, timeout=2)
+            except (OSError, ValueError):
+                pass
+
+
+_worker = None
+
+
+def _get_worker():
+    """Return a running worker for the current session, (re)spawning as needed."""
+    global _worker
+    if _worker is not None and _worker.session_id != CLAUDE_SESSION_ID:
+        _stop_worker()
+    if _worker is not None and _worker.pooled != _pool_available():
+        _stop_worker()
+    if _worker is not None and _worker.alive() and _worker.stale():
+        _stop_worker()
+    _reap_orphans()
+    if _worker is None:
+        if _pool_available():
+            _worker = _PoolWorker(CLAUDE_SESSION_ID)
+        else:
+            _worker = _ClaudeWorker(CLAUDE_SESSION_ID)
+    if not _worker.alive():
+        # Crashed or never started: respawn attached to the same session
+        _worker.start(resume=_session_created)
+    return _worker
+
+
+def _stop_worker(kill=False):
+    global _worker
+    if _worker is not None:
+        _worker.stop(kill=kill)
+        _worker = None
+
+
+atexit.register(_stop_worker)
+
+
+# Other backends: the Gemini CLI and an Ollama server. Their workers live for
+# one turn and translate their output into the same stream-json events the
+# Claude CLI emits, so _run_turn, the renderer and the metrics are shared.
+_gemini_model = os.environ.get("CLAUDE_GEMINI_MODEL", "")
+_ollama_host = os.environ.get("OLLAMA_HOST", "")
+_ollama_model = os.environ.get("CLAUDE_OLLAMA_MODEL", "llama3.2")
+_OLLAMA_PROBE_S = 30  # re-probe the Ollama server at most this often
+
+_ollama_opener = None
+
+
+def _ollama_open(req, timeout):
+    """Open an Ollama URL or Request; in-cluster, so never through %proxy's HTTP(S)_PROXY."""
+    global _ollama_opener
+    import urllib.request
+
+    if _ollama_opener is None:
+        _ollama_opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+    return _ollama_opener.open(req, timeout=timeout)
+
+
+class _GeminiWorker:
+    """One `gemini -p` process per turn, its stream-json output mapped to Claude's events."""
+
+    pooled = False
+    queue_position = None
+    session_id = None
+
+    def __init__(self, model="", history=()):
+        self.model = model
+        self.history = list(history)
+        self.proc = None
+        self.reader = None
+        self.stderr_buf = collections.deque(maxlen=200)
+        self.started_at = None
+        self.ready_s = None
+
+    def alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def send(self, prompt):
+        if self.history:
+            # Each turn is a new process; carry recent turns as plain context
+            turns = "\n\n".join(f"User: {p}\nAssistant: {a}" for p, a in self.history)
+            prompt = f"Earlier in this conversation:\n\n{turns}\n\n---\n\n{prompt}"
+        cmd = ["gemini", "-p", prompt, "--output-format", "stream-json"]
+        if self.model:
+            cmd += ["-m", self.model]
+        self.proc = subprocess.Popen(
+            cmd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=os.environ.get("HOME", "/home/jovyan"),
+            start_new_session=True,
+        )
+        self.reader = _EventReader(self.proc.stdout.fileno())
+        self.started_at = time.time()
+        proc = self.proc
+
+        def _read_stderr():
+            for line in proc.stderr:
+                self.stderr_buf.append(line.decode("utf-8", errors="replace"))
+
+        threading.Thread(target=_read_stderr, daemon=True).start()
+
+    def read_events(self, timeout):
+        events = self.reader.read(timeout)
+        if events is None:
+            return None
+        if events and self.ready_s is None:
+            self.ready_s = time.time() - self.started_at
+        return [e for e in map(self._translate, events) if e is not None]
+
+    def _translate(self, event):
+        etype = event.get("type")
+        if etype == "message" and event.get("role") == "assistant":
+            block = {"type": "text", "text": event.get("content") or ""}
+        elif etype == "tool_use":
+            block = {"type": "tool_use", "id": event.get("tool_id"),
+                     "name": event.get("tool_name"), "input": event.get("parameters")}
+        elif etype == "tool_result":
+            output = event.get("output") or (event.get("error") or {}).get("message") or ""
+            return {"type": "user", "message": {"content": [{
+                "type": "tool_result", "tool_use_id": event.get("tool_id"),
+                "content": output if isinstance(output, str) else json.dumps(output),
+                "is_error": event.get("status") == "error"}]}}
+        elif etype == "result":
+            stats = event.get("stats") or {}
+            failed = event.get("status") == "error"
+            return {
+                "type": "result", "is_error": failed,
+                "result": (event.get("error") or {}).get("message", "") if failed else "",
+                "usage": {"input_tokens": stats.get("input_tokens", 0),
+                          "output_tokens": stats.get("output_tokens", 0)},
+                "duration_ms": stats.get("duration_ms"),
+            }
+        else:
+            if etype == "error":
+                self.stderr_buf.append(str(event.get("message", "")))
+            return None
+        return {"type": "assistant", "message": {"content": [block]}}
+
+    def wait(self):
+        return self.proc.wait()
+
+    def describe(self):
+        return f"gemini {self.model or '(default model)'}"
+
+    def interrupt(self):
+        if self.alive():
+            _signal_group(self.proc, signal.SIGINT)
+
+    def stop(self, kill=False):
+        proc, self.proc = self.proc, None
+        if proc is None:
+            return
+        if not kill:
+            try:
+                proc.wait(timeout=2)
+                return
+            except subprocess.TimeoutExpired:
+                pass
+        _terminate_group(proc)
+
+
+class _OllamaWorker:
+    """One streaming /api/chat request per turn, its chunks mapped to Claude's events.
+
+    Ollama keeps no conversation, so recent turns are sent along as chat history.
+    """
+
+    pooled = False
+    queue_position = None
+    session_id = None
+
+    def __init__(self, host, model, history=()):
+        self.host = host.rstrip("/")
+        self.model = model
+        self.messages = []
+        for prompt, answer in history:
+            self.messages += [{"role": "user", "content": prompt},
+                              {"role": "assistant", "content": answer}]
+        self.stderr_buf = collections.deque(maxlen=200)
+        self.started_at = None
+        self.ready_s = None
+        self._events = queue.Queue()
+        self._eof = False
+        self._resp = None
+        self._stopped = threading.Event()
+
+    def alive(self):
+        return self.started_at is not None and not self._eof
+
+    def send(self, prompt):
+        body = json.dumps({
+            "model": self.model,
+            "messages": self.messages + [{"role": "user", "content": prompt}],
+            "stream": True,
+        }).encode("utf-8")
+        self.started_at = time.time()
+        threading.Thread(target=self._stream, args=(body,), daemon=True).start()
+
+    def _stream(self, body):
+        import urllib.error
+        import urllib.request
+
+        req = urllib.request.Request(f"{self.host}/api/chat", data=body,
+                                     headers={"Content-Type": "application/json"})
+        try:
+            with _ollama_open(req, timeout=300) as resp:
+                self._resp = resp
+                for line in resp:
+                    if self._stopped.is_set():
+                        break
+                    try:
+                        chunk = json.loads(line)
+                    except ValueError:
+                        continue
+                    for event in self._translate(chunk):
+                        self._events.put(event)
+        except urllib.error.HTTPError as e:
+            try:
+                detail = json.loads(e.read()).get("error", "")
+            except (OSError, ValueError, AttributeError):
+                detail = ""
+            self.stderr_buf.append(f"HTTP {e.code} from {self.host}: {detail or e.reason}")
+        except Exception as e:
+            # stop() closing the response mid-read surfaces here too
+            if not self._stopped.is_set():
+                self.stderr_buf.append(f"{self.host}: {e}")
+        finally:
+            self._events.put(None)  # end of stream
+
+    def _translate(self, chunk):
+        if chunk.get("error"):
+            self.stderr_buf.append(str(chunk["error"]))
+            return [{"type": "result", "is_error": True, "result": str(chunk["error"])}]
+        msg = chunk.get("message") or {}
+        blocks = [{"type": key, key: msg[key]} if key == "thinking" else {"type": "text", "text": msg[key]}
+                  for key in ("thinking", "content") if msg.get(key)]
+        events = [{"type": "assistant", "message": {"content": blocks}}] if blocks else []
+        if chunk.get("done"):
+            events.append({
+                "type": "result", "is_error": False, "result": "",
+                "usage": {"input_tokens": chunk.get("prompt_eval_count", 0),
+                          "output_tokens": chunk.get("eval_count", 0)},
+                "duration_ms": int(chunk.get("total_duration", 0) / 1e6),
+            })
+        return events
+
+    def read_events(self, timeout):
+        if self._eof:
+            return None
+        try:
+            items = [self._events.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                items.append(self._events.get_nowait())
+            except queue.Empty:
+                break
+        if None in items:
+            self._eof = True
+            items = [i for i in items if i is not None]
+        if items and self.ready_s is None:
+            self.ready_s = time.time() - self.started_at
+        return items or (None if self._eof else [])
+
+    def wait(self):
+        return None  # no process; the error is in stderr_buf
+
+    def describe(self):
+        return f"ollama {self.model} at {self.host}"
+
+    def interrupt(self):
+        self.stop()
+
+    def stop(self, kill=False):
+        self._stopped.set()
+        resp = self._resp
+        if resp is not None and not self._eof:
+            try:
+                resp.close()
+            except (OSError, ValueError):
+                pass
+
+
+class _Backend:
+    """Where a turn runs. `worker()` returns an object with _ClaudeWorker's turn
+    interface (send, read_events, interrupt, stop, wait, stderr_buf, ...)."""
+
+    name = ""
+    label = ""
+
+    def available(self):
+        """(ok, reason) -- whether prompts can be routed here now."""
+        return True, ""
+
+    def problem(self):
+        """A message that blocks the turn before it starts (e.g. missing auth), else None."""
+        return None
+
+    def worker(self):
+        raise NotImplementedError
+
+    def release(self, worker, kill=False):
+        """Called when a turn ends; per-turn workers are stopped here."""
+        worker.stop(kill=kill)
+
+    def describe(self):
+        ok, reason = self.available()
+        return "ready" if ok else reason
+
+
+class _ClaudeBackend(_Backend):
+    name = "claude"
+    label = "Claude"
+
+    def problem(self):
+        return _auth_problem()
+
+    def worker(self):
+        return _get_worker()
+
+    def release(self, worker, kill=False):
+        if kill:
+            _stop_worker(kill=True)  # the warm worker is kept otherwise
+
+    def describe(self):
+        if _worker is not None and _worker.alive():
+            return f"worker {_worker.describe()}"
+        return "worker starts on next prompt"
+
+
+class _GeminiBackend(_Backend):
+    name = "gemini"
+    label = "Gemini"
+
+    def available(self):
+        if shutil.which("gemini") is None:
+            return False, "gemini CLI not installed"
+        return True, ""
+
+    def worker(self):
+        return _GeminiWorker(_gemini_model, _recent_turns)
+
+    def describe(self):
+        ok, reason = self.available()
+        return f"{_gemini_model or 'default model'}" if ok else reason
+
+
+class _OllamaBackend(_Backend):
+    name = "ollama"
+    label = "Ollama"
+
+    def __init__(self):
+        self._probed_at = 0.0
+        self._status = (False, "not probed")
+
+    def available(self):
+        """Probe /api/tags (cached for _OLLAMA_PROBE_S) for the server and the model."""
+        if not _ollama_host:
+            return False, "OLLAMA_HOST not set"
+        now = time.time()
+        if now - self._probed_at < _OLLAMA_PROBE_S:
+            return self._status
+        self._probed_at = now
+        try:
+            with _ollama_open(f"{_ollama_host.rstrip('/')}/api/tags", timeout=0.5) as resp:
+                names = {m.get("name", "") for m in json.loads(resp.read()).get("models", [])}
+        except (OSError, ValueError) as e:
+            self._status = (False, f"unreachable ({e})")
+            return self._status
+        if _ollama_model in names or f"{_ollama_model}:latest" in names:
+            self._status = (True, "")
+        else:
+            self._status = (False, f"model {_ollama_model} not pulled")
+        return self._status
+
+    def worker(self):
+        return _OllamaWorker(_ollama_host, _ollama_model, _recent_turns)
+
+    def describe(self):
+        ok, reason = self.available()
+        return f"{_ollama_model} at {_ollama_host}" if ok else reason
+
+
+_backends = {b.name: b for b in (_ClaudeBackend(), _OllamaBackend(), _GeminiBackend())}
+
+_MISSING_CLI = {
+    "claude": "Claude CLI not found. Is @anthropic-ai/claude-code installed?",
+    "gemini": "Gemini CLI not found. Is @google/gemini-cli installed?",
+}
+
+# Backend selection: "auto" routes each prompt (see _route); a backend name
+# pins every prompt to it. Set with %claude_backend or CLAUDE_BACKEND.
+_backend_mode = os.environ.get("CLAUDE_BACKEND", "auto")
+if _backend_mode != "auto" and _backend_mode not in _backends:
+    _backend_mode = "auto"
+
+# Router: prompts up to this many characters that don't look like code or
+# analysis go to the local model; everything else goes to Claude.
+_route_max_chars = int(os.environ.get("CLAUDE_ROUTE_MAX_CHARS", "300"))
+_ROUTE_HEAVY_RE = re.compile(
+    r"```|\n\s*\n|Traceback|\bdef |\bclass |\bimport |"
+    r"\b(refactor|debug|fix|implement|optimi[sz]e|analy[sz]e|review|design|prove|"
+    r"why|step[- ]by[- ]step|write (?:a|an|the|me)|explain (?:the|this) (?:error|code))\b",
+    re.IGNORECASE,
+)
+
+# Recent (prompt, answer) turns from any backend, sent as chat history to
+# backends that keep no conversation of their own
+_recent_turns = collections.deque(maxlen=6)
+_RECENT_ANSWER_CHARS = 4000
+
+
+def _route(prompt):
+    """Pick the backend for one prompt. Returns (backend, reason)."""
+    if _backend_mode != "auto":
+        return _backends[_backend_mode], "pinned"
+    claude = _backends["claude"]
+    if len(prompt) > _route_max_chars:
+        return claude, "long prompt"
+    if _ROUTE_HEAVY_RE.search(prompt):
+        return claude, "code or analysis"
+    ok, reason = _backends["ollama"].available()
+    if not ok:
+        return claude, f"local model unavailable: {reason}"
+    return _backends["ollama"], "short prompt"
+
+
+def _render_final(renderer):
+    """Replace the live thinking/tool view with a one-line Markdown summary.
+
+    The answer is already Markdown in its segments, so only the live one is
+    brought up to date. The thinking text and tool calls go into the output's
+    metadata under "claude" rather than into a rendered blob.
+    """
+    thinking_text = renderer.thinking_text()
+    meta, summary = {}, []
+
+    if thinking_text:
+        meta.update(thinking=thinking_text, thinking_s=round(renderer.thinking_elapsed, 2),
+                    thinking_chars=renderer.thinking_chars)
+        if _show_thinking:
+            summary.append(f"*Thought for {renderer.thinking_elapsed:.1f}s*")
+        if renderer.thinking_file is not None:
+            meta["thinking_file"] = renderer.thinking_file
+            if _show_thinking:
+                try:
+                    href = os.path.relpath(renderer.thinking_file, os.getcwd())
+                except ValueError:
+                    href = renderer.thinking_file
+                summary.append(f"[full thinking](<{href}>)")
+
+    if renderer.tools:
+        now = time.time()
+        calls = renderer.tools.values()
+        meta["tools"] = [
+            {"name": c["name"], "arg": c["arg"], "s": round((c["end"] or now) - c["start"], 2),
+             "bytes": c["bytes"], **({"error": c["preview"]} if c["error"] else {})}
+            for c in calls
+        ]
+        n, failed = len(renderer.tools), sum(1 for c in calls if c["error"])
+        summary.append(f"*{n} tool call{'s' if n != 1 else ''} ({renderer.tool_seconds(now):.1f}s"
+                       f"{f', {failed} failed' if failed else ''})*")
+
+    renderer.handle.update(Markdown(" · ".join(summary)), metadata={"claude": meta} if meta else None)
+    renderer.finish()
+
+
+# Opt-in response cache (%claude_cache on, or CLAUDE_CACHE=1). Entries are
+# keyed by prompt + hash of the prior turns + CLI flags, so a re-run notebook
+# replays identical turns instantly instead of going back to the CLI.
+_cache_enabled = os.environ.get("CLAUDE_CACHE", "") == "1"
+_cache_max_bytes = int(float(os.environ.get("CLAUDE_CACHE_MAX_MB", "200")) * 1024 * 1024)
+_cache_hits = 0
+_cache_misses = 0
+
+# Chained hash of the turns so far in this session (the cache's notion of
+# "prior transcript"); reset with the session.
+_transcript_hash = hashlib.sha256(b"").hexdigest()
+
+# Turns replayed from cache or answered by another backend never reached the
+# CLI session. They are sent as context with the next real prompt so the
+# conversation stays coherent.
+_cache_backlog = []
+
+
+def _cache_dir():
+    config_dir = os.environ.get("CLAUDE_CONFIG_DIR", os.path.expanduser("~/.claude"))
+    return os.path.join(config_dir, "notebook-cache")
+
+
+def _cache_key(prompt, backend="claude"):
+    flags = [os.environ.get("ANTHROPIC_MODEL", ""), "stream-json"]
+    if backend != "claude":
+        flags = [backend, _ollama_model if backend == "ollama" else _gemini_model]
+    blob = json.dumps([prompt, _transcript_hash, flags])
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def _cache_path(key):
+    return os.path.join(_cache_dir(), key[:2], key + ".json")
+
+
+def _cache_get(key):
+    path = _cache_path(key)
+    try:
+        with open(path, encoding="utf-8") as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    try:
+        os.utime(path)  # mtime doubles as LRU recency
+    except OSError:
+        pass
+    return entry
+
+
+def _cache_put(key, entry):
+    path = _cache_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(entry, f)
+    os.replace(tmp, path)
+    _cache_evict()
+
+
+def _cache_entries():
+    """Return [(mtime, size, path)] for every cache entry."""
+    entries = []
+    root = _cache_dir()
+    if not os.path.isdir(root):
+        return entries
+    for sub in os.scandir(root):
+        if not sub.is_dir():
+            continue
+        for ent in os.scandir(sub.path):
+            if ent.name.endswith(".json"):
+                st = ent.stat()
+                entries.append((st.st_mtime, st.st_size, ent.path))
+    return entries
+
+
+def _cache_evict():
+    """Drop least-recently-used entries until the cache fits _cache_max_bytes."""
+    entries = _cache_entries()
+    total = sum(size for _, size, _ in entries)
+    if total <= _cache_max_bytes:
+        return
+    for _, size, path in sorted(entries):
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        if total <= _cache_max_bytes:
+            break
+
+
+def _advance_transcript(prompt, answer):
+    global _transcript_hash
+    blob = json.dumps([_transcript_hash, prompt, answer])
+    _transcript_hash = hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def _with_backlog(prompt):
+    """Prefix a compacted session's summary and turns that never reached the Claude session."""
+    if not (_cache_backlog or _carryover):
+        return prompt
+    lines = []
+    if _carryover:
+        lines.append(f"Summary of our earlier conversation (compacted from a previous session):\n\n{_carryover}")
+    if _cache_backlog:
+        lines.append("Earlier in this conversation (replayed from cache or answered by another model):")
+    for p, a in _cache_backlog:
+        lines.append(f"User: {p}\nAssistant: {a}")
+    lines.append("---")
+    lines.append(prompt)
+    return "\n\n".join(lines)
+
+
+# Per-turn latency/usage metrics: a bounded ring for %claude_stats, plus an
+# optional JSONL log (CLAUDE_STATS_FILE) for offline capacity planning.
+_turn_metrics = collections.deque(maxlen=int(os.environ.get("CLAUDE_STATS_RING", "500")))
+_stats_file = os.environ.get("CLAUDE_STATS_FILE", "")
+
+# Pod-wide metrics (claude_metrics.py): one datagram per turn start and end
+# to the aggregator's socket. Sends never block and are simply dropped when
+# nothing listens, so metrics cost a turn one sendto().
+_metrics_socket = os.environ.get("CLAUDE_METRICS_SOCKET", f"/tmp/claude-metrics-{os.getuid()}.sock")
+if os.environ.get("CLAUDE_METRICS", "1") == "0":
+    _metrics_socket = ""
+_metrics_sock = None
+_METRICS_KEYS = (
+    "backend", "status", "total_s", "ttft_thinking_s", "ttft_answer_s", "queue_s",
+    "tool_calls", "tool_s", "input_tokens", "output_tokens", "cache_read_input_tokens",
+    "cache_creation_input_tokens", "cost_usd", "exit_code", "rate_limited", "rate_wait_s",
+)
+
+# (metric key, label, format) rows shown by %claude_stats
+_STATS_ROWS = [
+    ("rate_wait_s", "Rate-limit wait", "{:.2f}s"),
+    ("queue_s", "Pool queue", "{:.2f}s"),
+    ("spawn_s", "CLI spawn", "{:.2f}s"),
+    ("ttfe_s", "First event", "{:.2f}s"),
+    ("ttft_thinking_s", "First thinking", "{:.2f}s"),
+    ("ttft_answer_s", "First answer", "{:.2f}s"),
+    ("total_s", "Total", "{:.2f}s"),
+    ("model_s", "Model time", "{:.2f}s"),
+    ("tool_s", "Tool time", "{:.2f}s"),
+    ("tool_calls", "Tool calls", "{:.0f}"),
+    ("chars_per_s", "Output chars/s", "{:.0f}"),
+    ("input_tokens", "Input tokens", "{:.0f}"),
+    ("context_tokens", "Context tokens", "{:.0f}"),
+    ("output_tokens", "Output tokens", "{:.0f}"),
+    ("cost_usd", "Cost", "${:.4f}"),
+]
+
+
+def _percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def _record_turn(metrics):
+    """Finalize one turn's metrics into the ring (and the JSONL log, if set)."""
+    metrics["total_s"] = time.time() - metrics.pop("start")
+    chars = metrics.get("output_chars", 0)
+    first = metrics.get("ttft_thinking_s") or metrics.get("ttft_answer_s")
+    if chars and first is not None and metrics["total_s"] > first:
+        metrics["chars_per_s"] = chars / (metrics["total_s"] - first)
+    if "ttfe_s" in metrics:
+        # Whatever the CLI spent outside tools, queueing and startup
+        waiting = sum(metrics.get(k) or 0 for k in ("tool_s", "queue_s", "spawn_s"))
+        metrics["model_s"] = max(0.0, metrics["total_s"] - waiting)
+    _turn_metrics.append(metrics)
+    _metrics_send("end", metrics)
+    if _stats_file:
+        try:
+            with open(_stats_file, "a", encoding="utf-8") as f:
+                f.write(json.dumps(metrics) + "\n")
+        except OSError:
+            pass  # stats logging is best-effort
+
+
+def _metrics_send(event, metrics=None):
+    """Report a turn start/end to the pod's metrics aggregator, if one is listening."""
+    global _metrics_sock
+    if not _metrics_socket:
+        return
+    msg = {k: metrics[k] for k in _METRICS_KEYS if k in metrics} if metrics else {}
+    msg.update(ev=event, pid=os.getpid())
+    try:
+        if _metrics_sock is None:
+            _metrics_sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            _metrics_sock.setblocking(False)
+        _metrics_sock.sendto(json.dumps(msg).encode("utf-8"), _metrics_socket)
+    except OSError:
+        pass  # no aggregator, or its queue is full
+
+
+def _context_size(usage):
+    """Input tokens an API call read, cached or not."""
+    return sum(usage.get(k) or 0 for k in (
+        "input_tokens", "cache_read_input_tokens", "cache_creation_input_tokens"))
+
+
+def _metrics_from_result(metrics, event):
+    """Copy usage/duration/cost from the CLI's result event."""
+    usage = event.get("usage") or {}
+    if usage and "context_tokens" not in metrics:
+        metrics["context_tokens"] = _context_size(usage)
+    for key in ("input_tokens", "output_tokens",
+                "cache_read_input_tokens", "cache_creation_input_tokens"):
+        if key in usage:
+            metrics[key] = usage[key]
+    if "total_cost_usd" in event:
+        metrics["cost_usd"] = event["total_cost_usd"]
+    for key in ("duration_ms", "duration_api_ms", "num_turns"):
+        if key in event:
+            metrics[key] = event[key]
+
+
+# Turn index for %claude_history / %claude_resume: one row per turn in a
+# SQLite database on the PVC, with an FTS5 table over prompt and answer
+# preview so searches stay fast across thousands of sessions. The CLI's own
+# session files remain the source of truth for the conversation itself.
+_history_enabled = os.environ.get("CLAUDE_HISTORY", "1") != "0"
+_history_db = os.environ.get("CLAUDE_HISTORY_DB", "")
+_HISTORY_PROMPT_CHARS = 4000
+_HISTORY_ANSWER_CHARS = 2000
+_history_conn = None
+_history_fts = False
+_history_lock = threading.Lock()
+
+_HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY,
+    session TEXT NOT NULL,
+    notebook TEXT,
+    cell_id TEXT,
+    prompt TEXT NOT NULL,
+    answer TEXT NOT NULL,      -- preview, first _HISTORY_ANSWER_CHARS chars
+    answer_chars INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    started REAL NOT NULL,
+    finished REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS turns_session ON turns (session, id);
+"""
+_HISTORY_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS turns_fts
+    USING fts5(prompt, answer, content='turns', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS turns_ai AFTER INSERT ON turns BEGIN
+    INSERT INTO turns_fts (rowid, prompt, answer) VALUES (new.id, new.prompt, new.answer);
+END;
+"""
+
+
+def _history():
+    """Open (and create) the index on first use; None if unavailable."""
+    global _history_conn, _history_fts
+    if _history_conn is None:
+        import sqlite3
+
+        path = _history_db or os.path.join(
+            os.environ.get("CLAUDE_CONFIG_DIR", os.path.expanduser("~/.claude")),
+            "notebook-history.sqlite",
+        )
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        conn.executescript(_HISTORY_SCHEMA)
+        try:
+            conn.executescript(_HISTORY_FTS_SCHEMA)
+            _history_fts = True
+        except sqlite3.OperationalError:
+            _history_fts = False  # SQLite built without FTS5: fall back to LIKE
+        _history_conn = conn
+    return _history_conn
+
+
+def _turn_origin():
+    """(notebook path, cell ID) of the cell being executed, where the kernel knows them."""
+    ip = get_ipython()
+    header = getattr(ip, "parent_header", None) or {}
+    cell_id = (header.get("metadata") or {}).get("cellId")
+    return os.environ.get("JPY_SESSION_NAME"), cell_id
+
+
+def _history_add(prompt, answer, metrics):
+    """Append one turn to the index; never fails the turn."""
+    if not _history_enabled:
+        return
+    import sqlite3
+
+    try:
+        with _history_lock:
+            conn = _history()
+            with conn:
+                conn.execute(
+                    "INSERT INTO turns (session, notebook, cell_id, prompt, answer, answer_chars,"
+                    " status, started, finished) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (metrics.get("session") or CLAUDE_SESSION_ID, metrics.get("notebook"), metrics.get("cell_id"),
+                     prompt[-_HISTORY_PROMPT_CHARS:], answer[:_HISTORY_ANSWER_CHARS], len(answer),
+                     metrics.get("status", ""), metrics.get("ts", time.time()), time.time()),
+                )
+    except (OSError, sqlite3.Error):
+        pass  # history is best-effort
+
+
+def _history_search(query, limit=20):
+    """Most recent matching turns as (id, session, notebook, prompt, finished, status)."""
+    import sqlite3
+
+    cols = "t.id, t.session, t.notebook, t.prompt, t.finished, t.status"
+    with _history_lock:
+        conn = _history()
+        if not query:
+            return conn.execute(
+                f"SELECT {cols} FROM turns t ORDER BY t.id DESC LIMIT ?", (limit,)
+            ).fetchall()
+        if _history_fts:
+            # Quote each word so user text can't be parsed as FTS syntax
+            match = " ".join('"' + w.replace('"', '""') + '"' for w in query.split())
+            try:
+                return conn.execute(
+                    f"SELECT {cols} FROM turns_fts f JOIN turns t ON t.id = f.rowid"
+                    " WHERE turns_fts MATCH ? ORDER BY t.id DESC LIMIT ?", (match, limit),
+                ).fetchall()
+            except sqlite3.OperationalError:
+                pass
+        like = f"%{query}%"
+        return conn.execute(
+            f"SELECT {cols} FROM turns t WHERE t.prompt LIKE ? OR t.answer LIKE ?"
+            " ORDER BY t.id DESC LIMIT ?", (like, like, limit),
+        ).fetchall()
+
+
+def _history_session(ref):
+    """Resolve a turn ID or session ID prefix to (session, turn count), or None."""
+    with _history_lock:
+        conn = _history()
+        row = None
+        if ref.isdigit():
+            row = conn.execute("SELECT session FROM turns WHERE id = ?", (int(ref),)).fetchone()
+        if row is None:
+            row = conn.execute(
+                "SELECT session FROM turns WHERE session >= ? AND session < ? ORDER BY id DESC LIMIT 1",
+                (ref, ref + "\uffff"),
+            ).fetchone()
+        if row is None:
+            return None
+        count = conn.execute("SELECT COUNT(*) FROM turns WHERE session = ?", row).fetchone()[0]
+        return row[0], count
+
+
+# Auth state is cached so the hot path doesn't stat the PVC (a network
+# filesystem) on every prompt: the credentials file is re-stat'ed at most
+# every _auth_recheck_s seconds and only re-read when its mtime changes.
+_auth_recheck_s = float(os.environ.get("CLAUDE_AUTH_RECHECK", "30"))
+_auth_deadline_s = float(os.environ.get("CLAUDE_AUTH_DEADLINE", "20"))
+_AUTH_URL_RE = re.compile(r'https://[^\s<>"\x1b]+(?=[\s\x1b])')
+_ANSI_RE = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]")
+
+
+class _AuthState:
+    """Cached view of .credentials.json: "ok", "missing" or "expired".
+
+    "expired" means the OAuth access token is past its expiresAt and there is
+    no refresh token for the CLI to renew it with, so a prompt would fail.
+    """
+
+    def __init__(self):
+        self._path = None
+        self._checked = 0.0
+        self._mtime = None
+        self._status = "missing"
+        self._expires_at = None  # epoch seconds, if the file says
+
+    @staticmethod
+    def creds_file():
+        config_dir = os.environ.get("CLAUDE_CONFIG_DIR", os.path.expanduser("~/.claude"))
+        return os.path.join(config_dir, ".credentials.json")
+
+    def invalidate(self):
+        self._checked = 0.0
+
+    def status(self, now=None):
+        now = time.time() if now is None else now
+        path = self.creds_file()
+        # Only a usable state is trusted for the full interval; otherwise look
+        # again at once so logging in from a Terminal takes effect immediately
+        if (path != self._path or self._status != "ok"
+                or now - self._checked >= _auth_recheck_s):
+            self._refresh(path, now)
+        if self._status == "ok" and self._expires_at is not None and now >= self._expires_at:
+            self._status = "expired"
+        return self._status
+
+    def _refresh(self, path, now):
+        self._path, self._checked = path, now
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            self._mtime, self._status, self._expires_at = None, "missing", None
+            return
+        if mtime == self._mtime:
+            return
+        self._mtime, self._status, self._expires_at = mtime, "ok", None
+        try:
+            with open(path, encoding="utf-8") as f:
+                oauth = json.load(f).get("claudeAiOauth") or {}
+        except (OSError, ValueError, AttributeError):
+            return  # unknown layout: trust the file, let the CLI decide
+        expires_ms = oauth.get("expiresAt")
+        if isinstance(expires_ms, (int, float)) and not oauth.get("refreshToken"):
+            self._expires_at = expires_ms / 1000
+
+    def describe(self):
+        status = self.status()
+        if status == "ok" and self._expires_at is not None:
+            left = self._expires_at - time.time()
+            return f"authenticated (token expires in {left / 3600:.1f}h)"
+        return {"ok": "authenticated", "missing": "NOT authenticated",
+                "expired": "EXPIRED (run %claude_auth)"}[status]
+
+
+_auth = _AuthState()
+
+
+def _auth_problem():
+    """Message to show instead of running a prompt, or None if auth looks usable."""
+    status = _auth.status()
+    if status == "missing":
+        return "Not authenticated. Run %claude_auth or open a Terminal tab and run: claude"
+    if status == "expired":
+        return "Auth expired. Run %claude_auth or open a Terminal tab and run: claude"
+    return None
+
+
+# Rate limits and overload are per account, so every kernel in the pod shares
+# one backoff state: a small JSON file under CLAUDE_CONFIG_DIR, changed only
+# under flock. A limited turn backs off with jittered exponential delays (or
+# the reset time the CLI reports); turns that start meanwhile wait in a FIFO
+# queue and, while the pod recovers, are let through one per spacing interval.
+_RATE_RE = re.compile(r"rate.?limit|usage limit|too many requests|overloaded|\b(?:429|529)\b", re.I)
+_RATE_RESET_RE = re.compile(r"limit reached\|(\d{10})")  # "Claude AI usage limit reached|<epoch>"
+_RATE_AFTER_RE = re.compile(r"retry.after\D{0,5}(\d+)", re.I)
+_rate_backoff_s = float(os.environ.get("CLAUDE_RATE_BACKOFF", "5"))
+_rate_backoff_max_s = float(os.environ.get("CLAUDE_RATE_BACKOFF_MAX", "300"))
+# Longer blocks (a usage limit resetting in hours) fail at once instead of queueing
+_rate_max_wait_s = float(os.environ.get("CLAUDE_RATE_MAX_WAIT", "900"))
+_rate_retries = int(os.environ.get("CLAUDE_RATE_RETRIES", "6"))
+# Gap between turn starts per recent limit hit while the pod recovers
+_rate_spacing_s = float(os.environ.get("CLAUDE_RATE_SPACING", "2"))
+_RATE_POLL_S = 0.5
+_RATE_RECHECK_S = 1.0  # how long a clear state is trusted without a stat
+
+
+def _rate_limit_info(text):
+    """(reason, retry_at or None) if `text` reports a rate limit or overload, else None."""
+    if not text or not _RATE_RE.search(text):
+        return None
+    m = _RATE_RESET_RE.search(text)
+    if m:
+        return "usage limit", float(m.group(1))
+    reason = "overloaded" if re.search(r"overloaded|\b529\b", text, re.I) else "rate limit"
+    m = _RATE_AFTER_RE.search(text)
+    return reason, (time.time() + int(m.group(1)) if m else None)
+
+
+class _RateLimiter:
+    """Pod-wide backoff and turn queue, kept in $CLAUDE_CONFIG_DIR/rate-limit.json.
+
+    State: blocked_until (epoch), failures (recent limit hits, decays by one
+    per successful turn), next_slot (earliest next start while recovering),
+    reason, and waiters {ticket: {"pid", "since"}} in arrival order.
+    """
+
+    def __init__(self):
+        self._cached = None  # (path, file identity, state) as last read
+        self._checked = 0.0
+
+    @staticmethod
+    def path():
+        config_dir = os.environ.get("CLAUDE_CONFIG_DIR", os.path.expanduser("~/.claude"))
+        return os.path.join(config_dir, "rate-limit.json")
+
+    @staticmethod
+    def _identity(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _is_clear(state, now):
+        return (not state.get("failures") and state.get("blocked_until", 0) <= now
+                and not state.get("waiters"))
+
+    def _peek(self, now=None):
+        """Unlocked, cached read for the fast path; {} if there is no state.
+
+        Only a clear state is trusted for _RATE_RECHECK_S, so a limit hit by
+        another kernel shows up within that; otherwise the file is re-read
+        only when its stat identity changed.
+        """
+        now = time.time() if now is None else now
+        path = self.path()
+        cached = self._cached
+        if (cached is not None and cached[0] == path and now - self._checked < _RATE_RECHECK_S
+                and self._is_clear(cached[2], now)):
+            return cached[2]
+        self._checked = now
+        identity = self._identity(path)
+        if cached is not None and cached[0] == path and cached[1] == identity:
+            return cached[2]
+        state = self._read(path) if identity is not None else {}
+        self._cached = (path, identity, state)
+        return state
+
+    @contextlib.contextmanager
+    def _locked(self):
+        import fcntl
+
+        path = self.path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            state = self._read(path)
+            before = json.dumps(state, sort_keys=True)
+            yield state
+            if json.dumps(state, sort_keys=True) != before:
+                tmp = f"{path}.{os.getpid()}.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(state, f)
+                os.replace(tmp, path)
+                self._cached = (path, self._identity(path), state)
+                self._checked = time.time()
+
+    def clear(self, now=None):
+        """True if a turn may start without taking the lock (the common case)."""
+        now = time.time() if now is None else now
+        return self._is_clear(self._peek(now), now)
+
+    def poll(self, ticket, now=None):
+        """Join or check the queue. Returns (position, wait_s, blocked_until); position 0 = go."""
+        now = time.time() if now is None else now
+        with self._locked() as state:
+            waiters = state.setdefault("waiters", {})
+            for key, w in list(waiters.items()):
+                if key != ticket and not _pid_alive(w.get("pid")):
+                    del waiters[key]  # kernel died while queued
+            waiters.setdefault(ticket, {"pid": os.getpid(), "since": now})
+            order = sorted(waiters, key=lambda k: waiters[k]["since"])
+            pos = order.index(ticket) + 1
+            ready_at = max(state.get("blocked_until", 0), state.get("next_slot", 0))
+            if pos == 1 and now >= ready_at:
+                del waiters[ticket]
+                state["next_slot"] = now + _rate_spacing_s * state.get("failures", 0)
+                return 0, 0.0, state.get("blocked_until", 0)
+            wait = max(0.0, ready_at - now) + (pos - 1) * _rate_spacing_s * max(1, state.get("failures", 0))
+            return pos, wait, state.get("blocked_until", 0)
+
+    def leave(self, ticket):
+        with self._locked() as state:
+            state.get("waiters", {}).pop(ticket, None)
+
+    def hit(self, reason, retry_at=None, now=None):
+        """Record a limit response; returns the new blocked_until."""
+        import random
+
+        now = time.time() if now is None else now
+        with self._locked() as state:
+            if now < state.get("blocked_until", 0) and retry_at is None:
+                # Turns sent before the pod backed off; the current block already covers them
+                return state["blocked_until"]
+            failures = state["failures"] = state.get("failures", 0) + 1
+            if retry_at is None:
+                delay = min(_rate_backoff_max_s, _rate_backoff_s * 2 ** (failures - 1))
+                retry_at = now + delay * random.uniform(0.5, 1.5)  # spread kernels' retries
+            state["blocked_until"] = max(state.get("blocked_until", 0), retry_at)
+            state["next_slot"] = 0  # the block itself paces the first start after it
+            state["reason"] = reason
+            return state["blocked_until"]
+
+    def ok(self):
+        """A turn got through: relax the pod's spacing by one step."""
+        if not self._peek().get("failures"):
+            return
+        with self._locked() as state:
+            state["failures"] = max(0, state.get("failures", 0) - 1)
+
+    def describe(self, now=None):
+        state = self._peek()
+        now = time.time() if now is None else now
+        waiting = len(state.get("waiters", {}))
+        if state.get("blocked_until", 0) > now:
+            return (f"{state.get('reason', 'limited')}, backing off "
+                    f"{state['blocked_until'] - now:.0f}s ({waiting} queued)")
+        if state.get("failures"):
+            return f"recovering ({state['failures']} recent limit hits, {waiting} queued)"
+        return "clear"
+
+
+_rate_limiter = _RateLimiter()
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, TypeError, OverflowError):
+        pass
+    return True
+
+
+def _rate_limit_wait(deadline=None, cancelled=None, renderer=None):
+    """Hold a Claude turn while the pod backs off. None when it may start, else (status, message).
+
+    `renderer`, if given, shows the queue position in the turn's display.
+    """
+    if _rate_limiter.clear():
+        return None
+    ticket = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    admitted, tick = False, 0
+    try:
+        while True:
+            pos, wait, blocked_until = _rate_limiter.poll(ticket)
+            if pos == 0:
+                admitted = True
+                return None
+            now = time.time()
+            if blocked_until - now > _rate_max_wait_s:
+                when = time.strftime("%H:%M", time.localtime(blocked_until))
+                return "rate_limited", f"Claude is rate limited until {when}; not queueing that long."
+            if deadline and now + wait > deadline:
+                return "timeout", f"Claude is rate limited for another {wait:.0f}s, past this turn's deadline."
+            if cancelled is not None and cancelled():
+                return "cancelled", "Cancelled."
+            if renderer is not None:
+                renderer.status = f"Rate limited: queued #{pos}, retry in {wait:.0f}s"
+                renderer.spinner(tick)
+                tick += 1
+            time.sleep(min(_RATE_POLL_S, max(wait, 0.01)))
+    except KeyboardInterrupt:
+        return "interrupted", "Interrupted."
+    finally:
+        if not admitted:
+            _rate_limiter.leave(ticket)
+        if renderer is not None:
+            renderer.status = None
+
+
+def _wait_for_auth_urls(proc, deadline):
+    """Read the CLI's merged output until an auth URL appears or `deadline` passes.
+
+    Returns (urls, output). Output is consumed as it arrives, so the common
+    case returns as soon as the URL is printed.
+    """
+    fd = proc.stdout.fileno()
+    buf = bytearray()
+    while time.time() < deadline:
+        ready, _, _ = select.select([fd], [], [], max(0.0, min(0.25, deadline - time.time())))
+        if not ready:
+            continue
+        chunk = os.read(fd, 65536)
+        if not chunk:
+            break
+        buf += chunk
+        text = _ANSI_RE.sub("", buf.decode("utf-8", errors="replace"))
+        urls = _AUTH_URL_RE.findall(text)
+        if urls:
+            return list(dict.fromkeys(urls)), text
+    text = _ANSI_RE.sub("", buf.decode("utf-8", errors="replace"))
+    # EOF or deadline: take a URL even without trailing whitespace
+    return list(dict.fromkeys(re.findall(r'https://[^\s<>"]+', text))), text
+
+
+# Turn deadlines in seconds, 0 to disable: "total" for the whole turn, "idle"
+# for silence from the CLI, "ttft" until the first thinking or answer text.
+# Session defaults are changed with %claude_timeout; ask(..., timeout=...)
+# and the --timeout flags override them per call.
+_deadlines = {
+    "total": float(os.environ.get("CLAUDE_TIMEOUT", "1800")),
+    "idle": float(os.environ.get("CLAUDE_IDLE_TIMEOUT", "300")),
+    "ttft": float(os.environ.get("CLAUDE_TTFT_TIMEOUT", "180")),
+}
+# Stopping a turn sends SIGINT and waits this long for partial output
+_interrupt_grace_s = float(os.environ.get("CLAUDE_INTERRUPT_GRACE", "3"))
+
+# Turns on the shared worker are serialized; a foreground prompt waits for a
+# running background turn rather than interleaving on the same stdin.
+_turn_lock = threading.Lock()
+
+# Background turns still streaming (cancelled by %claude_reset)
+_background_turns = set()
+
+# Every turn re-sends the whole transcript, so a session kept open for days
+# gets slower and costlier per turn. The context size of the last turn
+# (input tokens incl. cache reads/writes) is tracked: past "warn" a one-time
+# hint is printed, past "compact" the session is summarized into a fresh one
+# that carries the summary forward. 0 disables; see %claude_compact.
+_context_limits = {
+    "warn": int(os.environ.get("CLAUDE_CONTEXT_WARN", "100000")),
+    "compact": int(os.environ.get("CLAUDE_CONTEXT_COMPACT", "0")),
+}
+_context_tokens = None  # context size of the session's last turn
+_session_input_tokens = 0  # input tokens billed across the session's turns
+_context_warned = False
+_compacting = False
+# Summary from the compacted session; sent with the fresh session's first prompt
+_carryover = None
+
+_COMPACT_PROMPT = """\
+Summarize our conversation so far so it can continue in a fresh session \
+that sees only your summary. Keep: the goal and current state of the work, \
+decisions made and why, names of files, variables, functions and data the \
+work refers to, code that is still relevant (verbatim), open questions and \
+next steps. Drop pleasantries, superseded attempts and anything already \
+resolved. Reply with the summary only."""
+
+
+def _run_claude(prompt, turn=None, cache=None, timeouts=None, backend=None):
+    """Send prompt to the warm Claude worker with streaming output and collapsible thinking.
+
+    `turn` is the _BackgroundTurn when called off the main thread; `cache`
+    overrides the session's cache setting; `timeouts` overrides entries of
+    _deadlines for this turn; `backend` names a backend, else _route picks
+    one. A routed turn that fails on a local backend is retried on Claude.
+    Returns the answer text on success, else None.
+    """
+    report = turn.report if turn is not None else print
+    if backend is None:
+        chosen, reason = _route(prompt)
+    else:
+        chosen, reason = _backends[backend], "requested"
+    escalate = chosen.name != "claude" and reason not in ("pinned", "requested")
+    messages = []
+    turn_report = messages.append if escalate else report
+    if not _turn_lock.acquire(blocking=False):
+        report("Waiting for the running Claude turn to finish...")
+        _turn_lock.acquire()
+    notebook, cell_id = turn.origin if turn is not None else _turn_origin()
+    metrics = {"ts": time.time(), "session": CLAUDE_SESSION_ID, "status": "error",
+               "notebook": notebook, "cell_id": cell_id, "backend": chosen.name}
+    answer = None
+    try:
+        if turn is not None and turn.cancelled():
+            report("Cancelled.")
+            return None
+        use_cache = _cache_enabled if cache is None else cache
+        limits = {**_deadlines, **{k: v for k, v in (timeouts or {}).items() if v is not None}}
+        answer = _run_turn(prompt, turn, turn_report, use_cache, metrics, limits, chosen)
+    finally:
+        _turn_lock.release()
+        if "start" in metrics:
+            _record_turn(metrics)
+    if escalate and answer is None and metrics["status"] in ("error", "empty"):
+        why = messages[-1] if messages else "no answer"
+        report(f"{chosen.label} failed ({why[:200]}); asking Claude instead.")
+        return _run_claude(prompt, turn, cache, timeouts, backend="claude")
+    for msg in messages:
+        report(msg)
+    if answer is not None and not _compacting and chosen.name == "claude":
+        # Compaction runs here, after the lock is released; background turns only warn
+        _check_context(metrics, report, auto=turn is None)
+    return answer
+
+
+def _check_context(metrics, report, auto):
+    """Track the session's context size after a turn; warn or compact past the limits."""
+    global _context_tokens, _session_input_tokens, _context_warned
+    tokens = metrics.get("context_tokens")
+    if tokens is None:
+        return
+    _context_tokens = tokens
+    _session_input_tokens += sum(metrics.get(k, 0) for k in (
+        "input_tokens", "cache_read_input_tokens", "cache_creation_input_tokens"))
+    compact_at, warn_at = _context_limits["compact"], _context_limits["warn"]
+    if compact_at and tokens >= compact_at and auto:
+        report(f"Context is {tokens:,} tokens (auto-compact at {compact_at:,}); "
+               "summarizing into a fresh session...")
+        _compact(report)
+    elif warn_at and tokens >= warn_at and not _context_warned:
+        _context_warned = True
+        report(f"Context is {tokens:,} tokens and every turn re-reads all of it. "
+               "Run %claude_compact to continue in a fresh session from a summary.")
+
+
+def _reset_session(new_id, created, turns=0):
+    """Stop this session's turns and worker and switch to `new_id`.
+
+    `created` says whether the CLI already has that session on disk (a
+    resumed one) or will create it with the next prompt.
+    """
+    global CLAUDE_SESSION_ID, _turn_count, _session_created, _transcript_hash
+    global _context_tokens, _session_input_tokens, _context_warned, _carryover
+    for turn in list(_background_turns):
+        turn.cancel()
+        try:
+            turn.future.exception(timeout=_interrupt_grace_s)  # wait for it to release the worker
+        except concurrent.futures.TimeoutError:
+            # Stuck in the CLI or the pool queue: kill its worker, then give
+            # the thread one more grace period to wind down
+            _stop_worker(kill=True)
+            try:
+                turn.future.exception(timeout=_interrupt_grace_s)
+            except concurrent.futures.TimeoutError:
+                pass
+    _stop_worker()
+    CLAUDE_SESSION_ID = new_id
+    _turn_count = turns
+    _session_created = created
+    _transcript_hash = hashlib.sha256(new_id.encode() if created else b"").hexdigest()
+    _cache_backlog.clear()
+    _context_tokens = None
+    _session_input_tokens = 0
+    _context_warned = False
+    _carryover = None
+    _recent_turns.clear()
+    if not created:
+        _pool_reserve(new_id)
+
+
+def _fresh_session():
+    """Switch to a new, empty session; returns the previous session ID if it had turns."""
+    previous = CLAUDE_SESSION_ID if _session_created else None
+    _reset_session(str(uuid.uuid4()), created=False)
+    return previous
+
+
+def _compact(report, instructions=""):
+    """Summarize the session, then continue in a fresh one seeded with the summary.
+
+    The summary is streamed like any answer and sent as context with the
+    new session's first prompt. Returns True on success; on failure the
+    session is left as it was.
+    """
+    global _compacting, _carryover, _transcript_hash
+    if not _session_created:
+        report("Nothing to compact: this session has no turns yet.")
+        return False
+    prompt = _COMPACT_PROMPT
+    if instructions:
+        prompt += f"\n\nAlso: {instructions}"
+    before = _context_tokens
+    _compacting = True
+    try:
+        summary = _run_claude(prompt, cache=False, backend="claude")
+    finally:
+        _compacting = False
+    if not summary or not summary.strip():
+        report("Compaction failed; the session is unchanged.")
+        return False
+    previous = _fresh_session()
+    _carryover = summary.strip()
+    _transcript_hash = hashlib.sha256(_carryover.encode("utf-8")).hexdigest()
+    size = f"{before:,} tokens" if before else "The session"
+    report(f"{size} compacted into a {len(_carryover):,}-char summary; "
+           f"new session {CLAUDE_SESSION_ID[:8]}... starts from it with your next prompt.")
+    if previous and _history_enabled:
+        report(f"Previous one: %claude_resume {previous[:8]}")
+    return True
+
+
+def _apply_event(event, renderer, metrics, elapsed):
+    """Feed one stream-json event into the renderer; True for the turn's result event."""
+    etype = event.get("type", "")
+
+    # Claude Code CLI stream-json format:
+    #   {"type":"system"} — init (once per worker)
+    #   {"type":"assistant","message":{"content":[...]}} — content blocks
+    #   {"type":"user","message":{"content":[{"type":"tool_result",...}]}} — tool output
+    #   {"type":"result","result":"..."} — end of turn
+
+    now = renderer.start + elapsed
+    if etype == "assistant":
+        msg = event.get("message", {})
+        usage = msg.get("usage")
+        if usage:
+            # The latest API call's input is the conversation's current size
+            metrics["context_tokens"] = _context_size(usage)
+        for block in msg.get("content", []):
+            btype = block.get("type", "")
+            if btype == "thinking":
+                metrics.setdefault("ttft_thinking_s", elapsed)
+                renderer.add_thinking(block.get("thinking", ""))
+            elif btype == "text":
+                metrics.setdefault("ttft_answer_s", elapsed)
+                renderer.add_answer(block.get("text", ""))
+            elif btype == "tool_use":
+                renderer.add_tool_use(block, now)
+
+    elif etype == "user":
+        if event.get("_summary"):
+            # Oversized line summarised by _EventReader; its size is shared out
+            ids = event.get("tool_use_ids") or []
+            for tool_use_id in ids:
+                renderer.add_tool_result(tool_use_id, event["bytes"] // len(ids),
+                                         event.get("is_error"), now=now)
+        else:
+            content = event.get("message", {}).get("content")
+            for block in content if isinstance(content, list) else []:
+                if isinstance(block, dict) and block.get("type") == "tool_result":
+                    text = _tool_result_text(block)
+                    renderer.add_tool_result(block.get("tool_use_id"), len(text.encode("utf-8")),
+                                             block.get("is_error"), text, now)
+
+    elif etype == "result":
+        _metrics_from_result(metrics, event)
+        # Fallback: if no answer from assistant events, use result text
+        if not renderer.answer and not event.get("is_error"):
+            renderer.add_answer(event.get("result", ""))
+        return True
+    return False
+
+
+def _abort_turn(worker, renderer, metrics, start, backend):
+    """Stop a running turn: SIGINT, keep what it streams for a grace period, then kill.
+
+    A second KeyboardInterrupt skips the grace period.
+    """
+    try:
+        worker.interrupt()
+        deadline = time.time() + _interrupt_grace_s
+        while time.time() < deadline:
+            events = worker.read_events(min(0.1, max(0.0, deadline - time.time())))
+            if events is None:
+                break
+            now = time.time()
+            if any([_apply_event(e, renderer, metrics, now - start) for e in events]):
+                break
+    except (KeyboardInterrupt, OSError):
+        pass
+    backend.release(worker, kill=True)
+
+
+def _run_turn(prompt, turn, report, use_cache, metrics, limits, backend):
+    global _turn_count, _session_created, _cache_hits, _cache_misses, _carryover
+
+    claude = backend.name == "claude"
+    problem = backend.problem()
+    if problem:
+        report(problem)
+        return
+
+    # Create the display handle for live updates. Background turns get theirs
+    # up front: display() from a thread would land in whichever cell is running.
+    if turn is not None:
+        handle = turn.handle
+        renderer = _StreamRenderer(handle, time.time(), answer_handle=turn.answer_handle)
+    else:
+        handle = display(HTML(_render_streaming_html("", "", 0)), display_id=True)
+        renderer = _StreamRenderer(handle, time.time())
+    start = renderer.start
+    metrics["start"] = start
+    _metrics_send("start")
+    tick = 0
+    result_event = None
+    exit_code = None
+
+    cache_key = _cache_key(prompt, backend.name) if use_cache else None
+    if cache_key is not None:
+        entry = _cache_get(cache_key)
+        if entry is not None:
+            # Replay through the normal renderer; nothing is sent to the CLI
+            _cache_hits += 1
+            renderer.add_thinking(entry.get("thinking", ""))
+            renderer.add_answer(entry.get("answer", ""))
+            renderer.thinking_elapsed = entry.get("thinking_elapsed", 0)
+            renderer.thinking_chars = entry.get("thinking_chars", renderer.thinking_chars)
+            renderer.thinking_file = entry.get("thinking_file")
+            _render_final(renderer)
+            _turn_count += 1
+            metrics["status"] = "cached"
+            metrics["output_chars"] = len(entry.get("thinking", "")) + len(entry.get("answer", ""))
+            _cache_backlog.append((prompt, entry.get("answer", "")))
+            _recent_turns.append((prompt, entry.get("answer", "")[:_RECENT_ANSWER_CHARS]))
+            _advance_transcript(prompt, entry.get("answer", ""))
+            return entry.get("answer", "")
+        _cache_misses += 1
+
+    # Other backends get recent turns as their own history instead
+    cli_prompt = _with_backlog(prompt) if claude else prompt
+    total_s, idle_s, ttft_s = limits["total"], limits["idle"], limits["ttft"]
+    abort = None
+    rate_retries = 0
+    while True:
+        if claude:
+            # Hold the turn while the pod backs off from a rate limit
+            waited = time.time()
+            blocked = _rate_limit_wait(start + total_s if total_s else None,
+                                       turn.cancelled if turn is not None else None, renderer)
+            if time.time() - waited > 0.05:
+                metrics["rate_wait_s"] = metrics.get("rate_wait_s", 0.0) + time.time() - waited
+            if blocked is not None:
+                metrics["status"], message = blocked
+                renderer.clear()
+                report(message)
+                return None
+        try:
+            spawning = claude and (_worker is None or not _worker.alive() or _worker.stale())
+            worker = backend.worker()
+            worker.stderr_buf.clear()
+            try:
+                worker.send(cli_prompt)
+            except (BrokenPipeError, OSError):
+                # Worker died while idle — respawn once and retry
+                backend.release(worker, kill=True)
+                worker = backend.worker()
+                worker.send(cli_prompt)
+        except FileNotFoundError:
+            handle.update(HTML(""))
+            report(_MISSING_CLI.get(backend.name, f"{backend.label} CLI not found."))
+            return
+
+        last_event = waited_from = time.time()
+        try:
+            while result_event is None:
+                # Wake up in time for the next frame if a coalesced update is pending
+                events = worker.read_events(renderer.next_frame_in(0.3))
+                if events is None:
+                    # Worker exited mid-turn; it is respawned on the next prompt
+                    exit_code = metrics["exit_code"] = worker.wait()
+                    break
+                if worker.queue_position:
+                    renderer.status = f"Queued #{worker.queue_position}"
+                else:
+                    renderer.status = None
+
+                now = time.time()
+                if worker.queue_position:
+                    # Waiting for a pooled worker doesn't count as a stalled CLI
+                    last_event = waited_from = now
+                if events:
+                    last_event = now
+                    metrics.setdefault("ttfe_s", now - start)
+
+                for event in events:
+                    if _apply_event(event, renderer, metrics, now - start):
+                        result_event = event
+
+                renderer.flush()
+                if not events:
+                    renderer.spinner(tick)
+                    tick += 1
+
+                if turn is not None and turn.cancelled():
+                    abort = ("cancelled", "Cancelled.")
+                elif total_s and now - start > total_s:
+                    abort = ("timeout", f"{backend.label} timed out after {total_s:g}s.")
+                elif (ttft_s and "ttft_thinking_s" not in metrics and "ttft_answer_s" not in metrics
+                        and not renderer.tools and now - waited_from > ttft_s):
+                    abort = ("ttft_timeout", f"No response from {backend.label} within {ttft_s:g}s.")
+                elif idle_s and now - last_event > idle_s and not renderer.tools_running():
+                    # A long-running tool is silent by design; only total_s bounds it
+                    abort = ("idle_timeout", f"{backend.label} stalled: no output for {idle_s:g}s.")
+                if abort:
+                    break
+
+        except KeyboardInterrupt:
+            abort = ("interrupted", "Interrupted.")
+
+        # A limit or overload answer with nothing else streamed backs the
+        # whole pod off; this turn then queues and is sent again
+        if not claude or abort:
+            break
+        failed = result_event is None or result_event.get("is_error")
+        answer_text = renderer.answer_text()
+        if not failed or renderer.thinking_chars or renderer.tools or len(answer_text) > 2000:
+            break
+        info = _rate_limit_info("\n".join((
+            (result_event or {}).get("result") or "", answer_text, "".join(worker.stderr_buf))))
+        if info is None:
+            break
+        _rate_limiter.hit(*info)
+        metrics["rate_limited"] = metrics.get("rate_limited", 0) + 1
+        if rate_retries >= _rate_retries:
+            break
+        rate_retries += 1
+        if result_event is not None:
+            _session_created = True  # the CLI recorded the prompt; resume if it respawns
+        if exit_code is not None:
+            backend.release(worker, kill=True)
+        renderer.reset_answer()
+        for key in ("ttfe_s", "ttft_answer_s", "exit_code"):
+            metrics.pop(key, None)
+        result_event = exit_code = None
+
+    if abort:
+        metrics["status"], message = abort
+        _abort_turn(worker, renderer, metrics, start, backend)
+        renderer.record_tools(metrics)
+        metrics["output_chars"] = renderer.thinking_chars + len(renderer.answer_text())
+        if claude and "ttfe_s" in metrics:
+            # The CLI saw the prompt, so the session exists; resume it next time
+            _session_created = True
+        if "ttfe_s" in metrics:
+            _history_add(prompt, renderer.answer_text(), metrics)
+        if renderer.answer or renderer.thinking_chars:
+            # Keep what streamed before the turn was stopped
+            _render_final(renderer)
+            report(f"{message} Partial answer kept above.")
+        else:
+            renderer.clear()
+            report(message)
+        return None
+
+    # Final render
+    backend.release(worker)
+    thinking_text = renderer.thinking_text()
+    answer_text = renderer.answer_text()
+    stderr_text = "".join(worker.stderr_buf).strip()
+    ok = result_event is not None and not result_event.get("is_error")
+    metrics["output_chars"] = renderer.thinking_chars + len(answer_text)
+    renderer.record_tools(metrics)
+    # A pooled turn on an already-warm process has no spawn time
+    if (spawning or worker.pooled) and worker.ready_s is not None:
+        metrics["spawn_s"] = worker.ready_s
+    if worker.pooled and worker.wait_s is not None:
+        metrics["queue_s"] = worker.wait_s
+
+    if ok and (answer_text or thinking_text):
+        metrics["status"] = "ok"
+        if claude:
+            _rate_limiter.ok()
+            _turn_count += 1
+            _session_created = True
+            _cache_backlog.clear()
+            _carryover = None
+        else:
+            _cache_backlog.append((prompt, answer_text))  # so Claude sees this turn next time
+        _recent_turns.append((prompt, answer_text[:_RECENT_ANSWER_CHARS]))
+        _render_final(renderer)
+        if cache_key is not None:
+            try:
+                _cache_put(cache_key, {
+                    "prompt": prompt,
+                    "thinking": thinking_text,
+                    "answer": answer_text,
+                    "thinking_elapsed": renderer.thinking_elapsed,
+                    "thinking_chars": renderer.thinking_chars,
+                    "thinking_file": renderer.thinking_file,
+                    "created": time.time(),
+                })
+            except OSError:
+                pass  # cache is best-effort
+        _advance_transcript(prompt, answer_text)
+        _history_add(prompt, answer_text, metrics)
+        return answer_text
+    elif ok:
+        # CLI ran but no content events captured
+        _session_created = _session_created or claude  # session exists even if no output
+        metrics["status"] = "empty"
+        renderer.clear()
+        if stderr_text:
+            report(f"No output received. stderr: {stderr_text[:500]}")
+        else:
+            report(f"No output received from {backend.label}.")
+    else:
+        renderer.clear()
+        if result_event is not None:
+            _session_created = _session_created or claude
+            detail = result_event.get("result") or stderr_text
+        else:
+            detail = stderr_text
+        detail = (detail or "").strip()
+        if claude and ("not authenticated" in detail.lower() or "login" in detail.lower()):
+            _auth.invalidate()
+            report("Auth expired. Run %claude_auth or open a Terminal tab and run: claude")
+        elif exit_code is not None:
+            report(f"Error (exit {exit_code}): {detail[:500]}")
+        else:
+            report(f"Error: {detail[:500]}")
+
+
+class _BackgroundTurn:
+    """A turn streaming on a background thread; returned by ask(..., background=True).
+
+    Display handles are created on the calling (main) thread so updates land
+    in the originating cell. Use .result() to wait for the answer text and
+    .cancel() to stop the turn.
     """
-    parts = []
 
-    if thinking and _show_thinking:
-        is_open = "open" if (not answer and not done) else ""
-        elapsed_str = f"{elapsed:.1f}s" if elapsed else ""
-        thinking_escaped = _escape_html(thinking)
-        parts.append(f"""<details {is_open} style="
-            margin: 4px 0 8px 0;
-            border-left: 3px solid var(--jp-brand-color2, #6366f1);
-            border-radius: 0 4px 4px 0;
-            background: var(--jp-layout-color1, #1e1e2e);
-        ">
-            <summary style="
-                cursor: pointer;
-                padding: 6px 12px;
-                font-family: var(--jp-code-font-family, 'JetBrains Mono', monospace);
-                font-size: 12px;
-                color: var(--jp-content-font-color2, #a1a1aa);
-                user-select: none;
-            ">
-                <span style="color: var(--jp-brand-color2, #6366f1);">&#x25cf;</span>
-                Thinking{' (' + elapsed_str + ')' if elapsed_str else ''}
-            </summary>
-            <div style="
-                padding: 8px 12px;
-                font-family: var(--jp-code-font-family, 'JetBrains Mono', monospace);
-                font-size: 11px;
-                line-height: 1.5;
-                color: var(--jp-content-font-color3, #71717a);
-                white-space: pre-wrap;
-                word-break: break-word;
-                max-height: 400px;
-                overflow-y: auto;
-            ">{thinking_escaped}</div>
-        </details>""")
-    elif not done and not answer:
-        # No thinking yet, show animated spinner
-        dots = "." * ((phase_idx % 3) + 1)
-        pad = " " * (3 - (phase_idx % 3) - 1)
-        phase = _PHASES[int(phase_idx // 3) % len(_PHASES)]
-        elapsed_str = f"{elapsed:.0f}s" if elapsed else ""
-        parts.append(f"""<div style="
-            font-family: var(--jp-code-font-family, 'JetBrains Mono', monospace);
-            font-size: 13px; color: var(--jp-content-font-color2); padding: 8px 12px;
-            border-left: 3px solid var(--jp-brand-color1); background: var(--jp-layout-color1);
-            border-radius: 0 4px 4px 0; margin: 4px 0; display: inline-block;
-        "><span style="color: var(--jp-brand-color1); animation: cpulse 1.5s ease-in-out infinite;">&#x25cf;</span>
-        <span style="color: var(--jp-content-font-color1); margin-left: 6px;">{phase}{dots}{pad}</span>
-        <span style="color: var(--jp-content-font-color3); margin-left: 12px; font-size: 11px;">{elapsed_str}</span>
-        </div>
-        <style>@keyframes cpulse {{ 0%,100% {{ opacity: 0.3; }} 50% {{ opacity: 1; }} }}</style>""")
+    def __init__(self, prompt, cache=None, timeouts=None, backend=None):
+        self.prompt = prompt
+        self.cache = cache
+        self.timeouts = timeouts
+        self.backend = backend
+        self.origin = _turn_origin()  # the thread would see whichever cell runs next
+        self.handle = display(HTML(_render_streaming_html("", "", 0)), display_id=True)
+        self.answer_handle = display(HTML(""), display_id=True)
+        self.report_handle = display(HTML(""), display_id=True)
+        self._reports = []
+        self.future = concurrent.futures.Future()
+        self._cancel = threading.Event()
+        _background_turns.add(self)
+        threading.Thread(target=self._run, daemon=True).start()
 
-    if answer:
-        # Render answer as-is (will be replaced with Markdown render when done)
-        parts.append(f"""<div style="margin-top: 4px;">{answer}</div>""")
+    def _run(self):
+        try:
+            self.future.set_result(
+                _run_claude(self.prompt, self, cache=self.cache, timeouts=self.timeouts,
+                            backend=self.backend)
+            )
+        except BaseException as e:
+            self.future.set_exception(e)
+        finally:
+            _background_turns.discard(self)
 
-    return "\n".join(parts)
+    def report(self, msg):
+        # Appended below the answer, like print() in a foreground turn
+        self._reports.append(msg)
+        text = "\n".join(self._reports)
+        self.report_handle.update(HTML(f"<pre>{_escape_html(text)}</pre>"))
 
+    def cancel(self):
+        """Ask the turn to stop. Returns False if it had already finished."""
+        self._cancel.set()
+        return not self.future.done()
 
-def _run_claude(prompt):
-    """Send prompt to Claude Code CLI with streaming output and collapsible thinking."""
-    global _turn_count, _session_created
+    def cancelled(self):
+        return self._cancel.is_set()
 
-    claude_bin = "claude"
-    config_dir = os.environ.get("CLAUDE_CONFIG_DIR", os.path.expanduser("~/.claude"))
+    def done(self):
+        return self.future.done()
 
-    # Check auth exists
-    creds_file = os.path.join(config_dir, ".credentials.json")
-    if not os.path.exists(creds_file):
-        print("Not authenticated. Run %claude_auth or open a Terminal tab and run: claude")
-        return
+    def result(self, timeout=None):
+        """Block until the turn ends; returns the answer text (None on error)."""
+        return self.future.result(timeout)
 
-    # First turn: create session; subsequent turns: resume it
-    # _session_created tracks whether the session exists (even if first turn had no output)
-    if _turn_count == 0 and not _session_created:
-        session_args = ["--session-id", CLAUDE_SESSION_ID]
-    else:
-        session_args = ["--resume", CLAUDE_SESSION_ID]
+    def __repr__(self):
+        state = "done" if self.done() else ("cancelling" if self.cancelled() else "running")
+        return f"<Claude turn {state}: {self.prompt[:40]!r}>"
 
-    cmd = [
-        claude_bin, "-p",
-        *session_args,
-        "--output-format", "stream-json",
-        "--verbose",
-        prompt,
-    ]
 
-    # Create the display handle for live updates
-    handle = display(HTML(_render_streaming_html("", "", 0)), display_id=True)
+# Notebook context (--ctx / ask(context=[...])): kernel objects are
+# summarized into a compact block prepended to the prompt, within a strict
+# byte budget. Summaries of weakref-able objects are memoized by identity
+# plus a cheap version fingerprint, so a large DataFrame isn't re-summarized
+# every turn.
+_ctx_budget = int(os.environ.get("CLAUDE_CTX_BUDGET", "8000"))
+_ctx_memo = {}  # id(obj) -> (weakref, fingerprint, summary)
+
+_CTX_SAMPLE_ROWS = 5
+_CTX_MAX_COLUMNS = 30
+_CTX_STATS_SAMPLE = 100_000
 
-    thinking_buf = []
-    answer_buf = []
-    current_block_type = None  # "thinking" or "text"
-    thinking_elapsed = 0
-    start = time.time()
-    tick = 0
-    got_any_events = False
-    stderr_buf = []
 
+def _ctx_fingerprint(obj):
+    """Cheap version stamp: changes when shape, schema or the edge rows change."""
+    shape = getattr(obj, "shape", None)
+    fp = [type(obj).__name__, shape]
+    if hasattr(obj, "dtypes"):
+        fp.append(tuple(str(d) for d in getattr(obj.dtypes, "values", [obj.dtypes])))
     try:
-        proc = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1,
-            cwd=os.environ.get("HOME", "/home/jovyan"),
-        )
-    except FileNotFoundError:
-        handle.update(HTML(""))
-        print("Claude CLI not found. Is @anthropic-ai/claude-code installed?")
+        if hasattr(obj, "iloc") and len(obj):
+            fp.append(repr(obj.iloc[[0, -1]]))
+        elif hasattr(obj, "flat") and getattr(obj, "size", 0):
+            fp.append((obj.flat[0].item(), obj.flat[-1].item()))
+    except Exception:
+        pass
+    return repr(fp)
+
+
+def _summarize_frame(df):
+    rows, cols = df.shape
+    lines = [f"shape: {rows} rows x {cols} columns"]
+    shown = list(df.columns[:_CTX_MAX_COLUMNS])
+    lines.append("columns: " + ", ".join(f"{c} ({df.dtypes[c]})" for c in shown)
+                 + (f", ... +{cols - len(shown)} more" if cols > len(shown) else ""))
+    if rows:
+        # Evenly spaced rows: cheap on huge frames, unlike df.sample()
+        n = min(rows, _CTX_SAMPLE_ROWS)
+        idx = sorted({round(i * (rows - 1) / max(n - 1, 1)) for i in range(n)})
+        sample = df.iloc[idx, :_CTX_MAX_COLUMNS]
+        lines.append("sample rows:")
+        lines.append(sample.to_string(max_colwidth=40))
+    return "\n".join(lines)
+
+
+def _summarize_series(ser):
+    lines = [f"length: {len(ser)}, dtype: {ser.dtype}, name: {ser.name!r}"]
+    if len(ser):
+        n = min(len(ser), _CTX_SAMPLE_ROWS)
+        idx = sorted({round(i * (len(ser) - 1) / max(n - 1, 1)) for i in range(n)})
+        lines.append(ser.iloc[idx].to_string(max_rows=n))
+    return "\n".join(lines)
+
+
+def _summarize_array(arr):
+    np = sys.modules["numpy"]
+    lines = [f"shape: {arr.shape}, dtype: {arr.dtype}"]
+    if arr.size and arr.dtype.kind in "biuf":
+        if arr.size > _CTX_STATS_SAMPLE:
+            # Strided sample keeps stats O(1) in array size
+            idx = np.linspace(0, arr.size - 1, _CTX_STATS_SAMPLE).astype(np.intp)
+            data = arr.flat[idx]
+            label = f"stats (sample of {_CTX_STATS_SAMPLE:,})"
+        else:
+            data = arr
+            label = "stats"
+        with np.errstate(all="ignore"):
+            lines.append(f"{label}: min={np.nanmin(data):.6g} max={np.nanmax(data):.6g} "
+                         f"mean={np.nanmean(data):.6g} std={np.nanstd(data):.6g} "
+                         f"nan={int(np.isnan(data).sum()) if arr.dtype.kind == 'f' else 0}")
+    with np.printoptions(threshold=20, edgeitems=3, precision=4):
+        lines.append(repr(arr))
+    return "\n".join(lines)
+
+
+def _summarize_obj(obj):
+    """Compact text summary of one kernel object, by duck type."""
+    mod = type(obj).__module__.split(".")[0]
+    name = type(obj).__name__
+    if mod == "pandas" and name == "DataFrame":
+        return _summarize_frame(obj)
+    if mod == "pandas" and name == "Series":
+        return _summarize_series(obj)
+    if mod == "numpy" and name == "ndarray":
+        return _summarize_array(obj)
+    r = reprlib.Repr()
+    r.maxstring, r.maxother, r.maxlist, r.maxdict = 2000, 400, 20, 20
+    text = r.repr(obj)
+    if hasattr(obj, "__len__"):
+        try:
+            text = f"length: {len(obj)}\n{text}"
+        except Exception:
+            pass
+    return text
+
+
+def _ctx_summary(obj):
+    """Memoized _summarize_obj for weakref-able objects."""
+    try:
+        ref = weakref.ref(obj)
+    except TypeError:
+        return _summarize_obj(obj)
+    fp = _ctx_fingerprint(obj)
+    hit = _ctx_memo.get(id(obj))
+    if hit is not None and hit[0]() is obj and hit[1] == fp:
+        return hit[2]
+    summary = _summarize_obj(obj)
+    _ctx_memo[id(obj)] = (ref, fp, summary)
+    # Drop entries whose objects are gone
+    for key in [k for k, v in _ctx_memo.items() if v[0]() is None]:
+        del _ctx_memo[key]
+    return summary
+
+
+def _ctx_traceback():
+    if getattr(sys, "last_traceback", None) is None:
+        return "(no exception recorded in this kernel)"
+    lines = traceback.format_exception(sys.last_type, sys.last_value, sys.last_traceback)
+    return "".join(lines[-40:]).rstrip()
+
+
+def _ctx_cells(n):
+    ip = get_ipython()
+    inputs = ip.user_ns.get("In", [])
+    outputs = ip.user_ns.get("Out", {})
+    # The last entry is the cell being executed right now
+    start = max(1, len(inputs) - 1 - n)
+    parts = []
+    for i in range(start, len(inputs) - 1):
+        parts.append(f"In [{i}]:\n{inputs[i].rstrip()}")
+        if i in outputs:
+            parts.append(f"Out[{i}]:\n{reprlib.repr(outputs[i])}")
+    return "\n".join(parts) or "(no previous cells)"
+
+
+def _resolve_ctx(name):
+    """Return (label, summary) for a --ctx entry."""
+    if name == "@tb":
+        return "last traceback", _ctx_traceback()
+    if name == "@cells" or name.startswith("@cells:"):
+        n = int(name.split(":", 1)[1]) if ":" in name else 5
+        return f"last {n} cells", _ctx_cells(n)
+    root, *attrs = name.split(".")
+    ns = get_ipython().user_ns
+    if root not in ns:
+        return name, "(not defined)"
+    obj = ns[root]
+    try:
+        for attr in attrs:
+            obj = getattr(obj, attr)
+    except AttributeError as e:
+        return name, f"({e})"
+    kind = f"{type(obj).__module__}.{type(obj).__name__}".replace("builtins.", "")
+    try:
+        return f"{name} ({kind})", _ctx_summary(obj)
+    except Exception as e:
+        return f"{name} ({kind})", f"(could not summarize: {e})"
+
+
+def _build_context(names, budget=None):
+    """Render the context block for `names`, truncated to `budget` bytes total."""
+    budget = _ctx_budget if budget is None else budget
+    items = [_resolve_ctx(n.strip()) for n in names if n.strip()]
+    if not items:
+        return ""
+    # Fair share: small items keep everything, big ones split what's left
+    sizes = [len(f"### {label}\n{body}\n".encode("utf-8")) for label, body in items]
+    remaining = budget
+    order = sorted(range(len(items)), key=lambda i: sizes[i])
+    caps = {}
+    for rank, i in enumerate(order):
+        caps[i] = min(sizes[i], remaining // (len(items) - rank))
+        remaining -= caps[i]
+    parts = []
+    for i, (label, body) in enumerate(items):
+        block = f"### {label}\n{body}\n"
+        if sizes[i] > caps[i]:
+            cut = block.encode("utf-8")[:max(caps[i] - 20, 0)].decode("utf-8", errors="ignore")
+            block = cut + "\n... (truncated)\n"
+        parts.append(block)
+    return "<notebook-context>\n" + "\n".join(parts) + "</notebook-context>\n\n"
+
+
+def ask(prompt, background=False, cache=None, context=None,
+        timeout=None, idle_timeout=None, ttft_timeout=None, backend=None):
+    """Send a question to Claude. Works with ? and special characters.
+
+    Usage: ask("What are the three laws of robotics?")
+           t = ask("...", background=True)   # returns at once; t.result(), t.cancel()
+           ask("...", cache=False)           # bypass the response cache for this call
+           ask("why is this slow?", context=["df", "@tb", "@cells"])
+           ask("quick one", timeout=30, ttft_timeout=10)   # seconds; 0 disables
+           ask("capital of France?", backend="ollama")      # skip the router
+
+    Timeouts default to the session's (%claude_timeout); the backend to the
+    router's choice (%claude_backend).
+    """
+    if not prompt or not prompt.strip():
+        print('Usage: ask("your question here")')
         return
+    if backend is not None and backend not in _backends:
+        raise ValueError(f"Unknown backend {backend!r}; choose from {', '.join(_backends)}")
+    if context:
+        if isinstance(context, str):
+            context = context.split(",")
+        prompt = _build_context(context) + prompt
+    timeouts = {"total": timeout, "idle": idle_timeout, "ttft": ttft_timeout}
+    if background:
+        return _BackgroundTurn(prompt, cache=cache, timeouts=timeouts, backend=backend)
+    _run_claude(prompt, cache=cache, timeouts=timeouts, backend=backend)
 
-    # Read stderr in background thread
-    def _read_stderr():
-        for line in proc.stderr:
-            stderr_buf.append(line)
 
-    stderr_thread = threading.Thread(target=_read_stderr, daemon=True)
-    stderr_thread.start()
+async def aask(prompt, **kwargs):
+    """Awaitable ask(): `answer = await aask("...")` with IPython autoawait.
 
+    Streams from a background thread so the event loop stays free; cancelling
+    the awaiting task cancels the turn. Keyword arguments are passed to ask().
+    """
+    turn = ask(prompt, background=True, **kwargs)
+    if turn is None:
+        return None
     try:
-        import select
+        return await asyncio.wrap_future(turn.future)
+    except asyncio.CancelledError:
+        turn.cancel()
+        raise
+
+
+_BATCH_STATES = ("queued", "running", "retrying", "done", "failed")
+
 
-        fd = proc.stdout.fileno()
-        line_buf = ""
+def _render_batch_html(items, elapsed):
+    """Compact progress grid for ask_many(): one square per prompt."""
+    counts = collections.Counter(item["state"] for item in items)
+    cells = []
+    for i, item in enumerate(items):
+        tip = f"#{i} {item['state']}"
+        if item["elapsed"]:
+            tip += f" {item['elapsed']:.1f}s"
+        if item["error"]:
+            tip += f" — {item['error']}"
+        cells.append(f"""<span class="claude-{item['state']}" \
+title="{_escape_html(tip).replace('"', '&quot;')}">{i}</span>""")
+    summary = " · ".join(f"{counts[k]} {k}" for k in _BATCH_STATES if counts[k])
+    return f"""<div class="claude-batch"><div>{summary} · {elapsed:.0f}s</div>{"".join(cells)}</div>"""
 
+
+def _throwaway_worker(session_id=None, fork=False):
+    """A started worker on a fresh session, or a fork of the current one.
+
+    Used by ask_many() and pipeline speculation. When the pool runs, these
+    turns go through it like any other, so they count against its process
+    cap and queue fairly; otherwise each gets a private process.
+    """
+    session_id = session_id or str(uuid.uuid4())
+    if _pool_available():
+        return _PoolWorker(session_id, fork_from=CLAUDE_SESSION_ID if fork else None)
+    worker = _ClaudeWorker(CLAUDE_SESSION_ID if fork else session_id)
+    worker.start(resume=fork, fork=fork)
+    return worker
+
+
+def _exit_detail(worker):
+    """Why a throwaway worker's stream ended early: exit code (if local) and stderr."""
+    code = worker.wait()
+    detail = "".join(worker.stderr_buf).strip()
+    return f"exit {code}: {detail}" if code is not None else detail
+
+
+def _ask_one(prompt, fork, timeout, cancel):
+    """Run one prompt on a throwaway worker. Returns (answer, error)."""
+    blocked = _rate_limit_wait(time.time() + timeout, cancel.is_set)
+    if blocked is not None:
+        return None, blocked[1]
+    try:
+        worker = _throwaway_worker(fork=fork)
+    except FileNotFoundError:
+        return None, "Claude CLI not found"
+    answer = []
+    error = None
+    deadline = time.time() + timeout
+    try:
+        worker.send(prompt)
         while True:
-            ret = proc.poll()
+            events = worker.read_events(0.3)
+            if events is None:
+                error = _exit_detail(worker)[:200]
+                return None, error
+            for event in events:
+                etype = event.get("type", "")
+                if etype == "assistant":
+                    for block in event.get("message", {}).get("content", []):
+                        if block.get("type") == "text":
+                            answer.append(block.get("text", ""))
+                elif etype == "result":
+                    if event.get("is_error"):
+                        error = (event.get("result") or "error").strip()[:200]
+                        return None, error
+                    return "".join(answer) or event.get("result", ""), None
+            if cancel.is_set():
+                error = "cancelled"
+                return None, error
+            if time.time() > deadline:
+                error = f"timed out after {timeout:g}s"
+                return None, error
+    except OSError as e:
+        error = str(e)
+        return None, error
+    finally:
+        # A pooled throwaway is always stopped; closing its connection already kills a running turn
+        worker.stop(kill=error is not None and not worker.pooled)
+        info = error and _rate_limit_info(f"{error}\n{''.join(worker.stderr_buf)}")
+        if info:
+            _rate_limiter.hit(*info)
 
-            ready, _, _ = select.select([fd], [], [], 0.3)
-            if ready:
-                chunk = os.read(fd, 8192)
-                if not chunk:
-                    break
-                line_buf += chunk.decode("utf-8", errors="replace")
 
-                while "\n" in line_buf:
-                    line, line_buf = line_buf.split("\n", 1)
-                    line = line.strip()
-                    if not line:
-                        continue
+def ask_many(prompts, workers=4, timeout=300, retries=1, fork=False):
+    """Run many prompts concurrently; returns answers in input order.
 
-                    try:
-                        event = json.loads(line)
-                    except json.JSONDecodeError:
-                        continue
+    Each prompt runs in its own fresh session, or with fork=True in a fork of
+    the current conversation (it sees prior turns; the kernel's session is not
+    modified). Failed or timed-out prompts are retried up to `retries` times;
+    prompts that still fail come back as None. When the pod's worker pool
+    runs, prompts go through it, so at most claude.pool.size CLI processes
+    run however large `workers` is.
 
-                    got_any_events = True
-                    etype = event.get("type", "")
-
-                    # Claude Code CLI stream-json format:
-                    #   {"type":"system"} — init
-                    #   {"type":"assistant","message":{"content":[...]}} — content blocks
-                    #   {"type":"result","result":"..."} — final
-
-                    if etype == "assistant":
-                        msg = event.get("message", {})
-                        for block in msg.get("content", []):
-                            btype = block.get("type", "")
-                            if btype == "thinking":
-                                thinking_buf.append(block.get("thinking", ""))
-                                thinking_elapsed = time.time() - start
-                            elif btype == "text":
-                                answer_buf.append(block.get("text", ""))
-
-                    elif etype == "result":
-                        # Fallback: if no answer from assistant events, use result text
-                        if not answer_buf:
-                            result_text = event.get("result", "")
-                            if result_text:
-                                answer_buf.append(result_text)
-
-                    # Update display after each event
-                    thinking_text = "".join(thinking_buf)
-                    answer_text = "".join(answer_buf)
-                    elapsed = time.time() - start
-
-                    if answer_text:
-                        answer_html = _escape_html(answer_text)
-                        answer_html = answer_html.replace("\n", "<br>")
-                        handle.update(HTML(_render_streaming_html(
-                            thinking_text, answer_html, thinking_elapsed, done=False
-                        )))
-                    elif thinking_text:
-                        handle.update(HTML(_render_streaming_html(
-                            thinking_text, "", elapsed, done=False
-                        )))
+    Usage: answers = ask_many([f"Summarize:\\n{log}" for log in logs], workers=8)
+    """
+    prompts = list(prompts)
+    if not prompts:
+        return []
 
-            else:
-                if not got_any_events:
-                    elapsed = time.time() - start
-                    handle.update(HTML(_render_streaming_html(
-                        "", "", elapsed, phase_idx=tick, done=False
-                    )))
-                tick += 1
+    problem = _auth_problem()
+    if problem:
+        print(problem)
+        return None
+    if fork and not _session_created:
+        print("No conversation to fork yet; using fresh sessions.")
+        fork = False
 
-                if ret is not None:
-                    break
+    items = [{"state": "queued", "elapsed": 0.0, "error": None} for _ in prompts]
+    results = [None] * len(prompts)
+    cancel = threading.Event()
+    start = time.time()
 
-            if time.time() - start > 300:
-                proc.kill()
-                handle.update(HTML(""))
-                print("Claude timed out after 5 minutes.")
+    def _run_item(i):
+        item = items[i]
+        attempt = limited = 0
+        while attempt <= retries:
+            item["state"] = "running" if attempt == 0 and not limited else "retrying"
+            t0 = time.time()
+            answer, item["error"] = _ask_one(prompts[i], fork, timeout, cancel)
+            item["elapsed"] = time.time() - t0
+            if item["error"] is None:
+                _rate_limiter.ok()
+                results[i] = answer
+                item["state"] = "done"
                 return
+            if cancel.is_set():
+                break
+            if _rate_limit_info(item["error"]) and limited < _rate_retries:
+                limited += 1  # the pod backs off; this doesn't use up a retry
+            else:
+                attempt += 1
+        item["state"] = "failed"
 
+    handle = display(HTML(_render_batch_html(items, 0)), display_id=True)
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers))
+    futures = [pool.submit(_run_item, i) for i in range(len(prompts))]
+    try:
+        pending = set(futures)
+        while pending:
+            _, pending = concurrent.futures.wait(pending, timeout=0.5)
+            handle.update(HTML(_render_batch_html(items, time.time() - start)))
     except KeyboardInterrupt:
-        proc.kill()
-        handle.update(HTML(""))
+        cancel.set()
+        for f in futures:
+            f.cancel()
         print("Interrupted.")
-        return
+    finally:
+        pool.shutdown(wait=True)
+        for item in items:
+            if item["state"] == "queued":
+                item["state"], item["error"] = "failed", "cancelled"
+        handle.update(HTML(_render_batch_html(items, time.time() - start)))
 
-    proc.wait()
-    stderr_thread.join(timeout=2)
+    failed = [i for i, item in enumerate(items) if item["state"] != "done"]
+    if failed:
+        print(f"{len(failed)}/{len(prompts)} prompts failed: {failed[:20]}")
+    return results
 
-    # Final render
-    thinking_text = "".join(thinking_buf)
-    answer_text = "".join(answer_buf)
-
-    if proc.returncode == 0 and (answer_text or thinking_text):
-        _turn_count += 1
-        _session_created = True
-
-        # Build final output: collapsed thinking + Markdown answer
-        final_parts = []
-
-        if thinking_text and _show_thinking:
-            thinking_escaped = _escape_html(thinking_text)
-            final_parts.append(f"""<details style="
-                margin: 4px 0 12px 0;
-                border-left: 3px solid var(--jp-brand-color2, #6366f1);
-                border-radius: 0 4px 4px 0;
-                background: var(--jp-layout-color1, #1e1e2e);
-            ">
-                <summary style="
-                    cursor: pointer;
-                    padding: 6px 12px;
-                    font-family: var(--jp-code-font-family, 'JetBrains Mono', monospace);
-                    font-size: 12px;
-                    color: var(--jp-content-font-color2, #a1a1aa);
-                    user-select: none;
-                ">
-                    <span style="color: var(--jp-brand-color2, #6366f1);">&#x25cf;</span>
-                    Thinking ({thinking_elapsed:.1f}s)
-                </summary>
-                <div style="
-                    padding: 8px 12px;
-                    font-family: var(--jp-code-font-family, 'JetBrains Mono', monospace);
-                    font-size: 11px;
-                    line-height: 1.5;
-                    color: var(--jp-content-font-color3, #71717a);
-                    white-space: pre-wrap;
-                    word-break: break-word;
-                    max-height: 400px;
-                    overflow-y: auto;
-                ">{thinking_escaped}</div>
-            </details>""")
-
-        # Display: thinking as HTML, answer as Markdown
-        if final_parts:
-            handle.update(HTML("\n".join(final_parts)))
-            if answer_text:
-                display(Markdown(answer_text))
-        else:
-            handle.update(HTML(""))
-            if answer_text:
-                display(Markdown(answer_text))
-    elif proc.returncode == 0 and not answer_text and not thinking_text:
-        # CLI ran but no content events captured
-        _session_created = True  # session exists even if no output
-        handle.update(HTML(""))
-        stderr_text = "".join(stderr_buf).strip()
-        if stderr_text:
-            print(f"No output received. stderr: {stderr_text[:500]}")
+
+_MAGIC_FLAGS = ("--bg", "--no-cache", "--independent")
+_MAGIC_VALUE_FLAGS = ("--ctx", "--timeout", "--idle-timeout", "--ttft-timeout", "--backend")
+
+
+def _split_flags(line):
+    """Strip known --flags from a magic line; returns (line, {flag: value}).
+
+    Boolean flags map to True; value flags accept `--ctx a,b` or `--ctx=a,b`.
+    """
+    tokens = line.split()
+    flags = {}
+    rest = []
+    i = 0
+    while i < len(tokens):
+        tok = tokens[i]
+        name, eq, value = tok.partition("=")
+        if tok in _MAGIC_FLAGS:
+            flags[tok] = True
+        elif name in _MAGIC_VALUE_FLAGS and eq:
+            flags[name] = value
+        elif tok in _MAGIC_VALUE_FLAGS and i + 1 < len(tokens):
+            flags[tok] = tokens[i + 1]
+            i += 1
         else:
-            print("No output received from Claude.")
+            rest.append(tok)
+        i += 1
+    if not flags:
+        return line, flags
+    return " ".join(rest), flags
+
+
+def _ask_with_flags(prompt, flags):
+    try:
+        timeouts = {
+            key: float(flags[flag])
+            for key, flag in (("timeout", "--timeout"), ("idle_timeout", "--idle-timeout"),
+                              ("ttft_timeout", "--ttft-timeout"))
+            if flag in flags
+        }
+    except ValueError:
+        print("Timeouts are in seconds, e.g. --timeout 600")
+        return None
+    backend = flags.get("--backend")
+    if backend is not None and backend not in _backends:
+        print(f"Unknown backend {backend!r}; choose from {', '.join(_backends)}")
+        return None
+    return ask(
+        prompt,
+        background=flags.get("--bg", False),
+        cache=False if flags.get("--no-cache") else None,
+        context=flags.get("--ctx"),
+        backend=backend,
+        **timeouts,
+    )
+
+
+# Pipeline mode (%claude_pipeline on, or CLAUDE_PIPELINE=1). When a %%claude
+# cell runs, the notebook file is scanned from that cell onward for cells
+# marked `%%claude --independent`, and their prompts start at once, each on
+# its own throwaway worker and session. When execution reaches such a cell it
+# attaches to the stream (or the finished answer) instead of starting a turn,
+# so a Run All takes about as long as the slowest prompt, not the sum.
+_pipeline_enabled = os.environ.get("CLAUDE_PIPELINE", "") == "1"
+_pipeline_workers = int(os.environ.get("CLAUDE_PIPELINE_WORKERS", "4"))
+_pipeline_slots = threading.BoundedSemaphore(_pipeline_workers)
+_speculations = {}  # _pipeline_key(prompt) -> _Speculation
+_notebook_cache = (None, None, [])  # (path, mtime, [(cell id, source)]) of the last scan
+
+
+def _notebook_file():
+    """The running notebook's file: CLAUDE_NOTEBOOK (e.g. for papermill), else the server's session path."""
+    path = os.environ.get("CLAUDE_NOTEBOOK") or os.environ.get("JPY_SESSION_NAME")
+    if not path:
+        return None
+    # The session path may be relative to the server root; the kernel runs in the notebook's directory
+    for candidate in (path, os.path.basename(path)):
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def _notebook_cells(path):
+    """Code cells of the saved notebook as (cell id, source), re-read only when the file changes."""
+    global _notebook_cache
+    mtime = os.path.getmtime(path)
+    if _notebook_cache[:2] != (path, mtime):
+        with open(path, encoding="utf-8") as f:
+            nb = json.load(f)
+        cells = []
+        for cell in nb.get("cells", []):
+            if cell.get("cell_type") == "code":
+                source = cell.get("source", "")
+                cells.append((cell.get("id"), "".join(source) if isinstance(source, list) else source))
+        _notebook_cache = (path, mtime, cells)
+    return _notebook_cache[2]
+
+
+def _pipeline_key(prompt):
+    # 00-claude.py strips a trailing ? from %%claude cells before they run
+    return hashlib.sha256(prompt.strip().rstrip("?").strip().encode("utf-8")).hexdigest()
+
+
+def _independent_prompt(source):
+    """The prompt of a `%%claude --independent` cell that may run ahead, else None.
+
+    Cells that read kernel state (--ctx, {var} in the magic line) or run on
+    another backend are left to run in order.
+    """
+    first, _, body = source.partition("\n")
+    if first.split()[:1] != ["%%claude"]:
+        return None
+    line, flags = _split_flags(first.strip()[len("%%claude"):].strip())
+    if not flags.get("--independent") or "--ctx" in flags or "{" in line:
+        return None
+    if flags.get("--backend", "claude") != "claude":
+        return None
+    prompt = f"{line}\n{body}".strip() if line else body
+    return prompt if prompt.strip() else None
+
+
+def _pipeline_dispatch(cell):
+    """Start the independent %%claude cells from the running one onward; returns how many started.
+
+    The running cell is found by its ID, or failing that (e.g. papermill)
+    by its body. Nothing starts while auth is unusable: the running cell
+    reports that once instead of every speculation failing on its own.
+    """
+    path = _notebook_file()
+    if path is None or _auth_problem():
+        return 0
+    try:
+        cells = _notebook_cells(path)
+    except (OSError, ValueError):
+        return 0
+    _, cell_id = _turn_origin()
+    start = next((i for i, (cid, _) in enumerate(cells) if cell_id and cid == cell_id), None)
+    if start is None:
+        start = next((i for i, (_, src) in enumerate(cells)
+                      if src.startswith("%%claude") and src.partition("\n")[2].strip() == cell.strip()), None)
+    if start is None:
+        return 0
+    started = 0
+    for _, source in cells[start:]:
+        prompt = _independent_prompt(source)
+        if prompt is None:
+            continue
+        key = _pipeline_key(prompt)
+        if key not in _speculations:
+            _speculations[key] = _Speculation(prompt)
+            started += 1
+    return started
+
+
+def _pipeline_cancel():
+    """Stop every speculation no cell has attached to yet."""
+    for spec in list(_speculations.values()):
+        spec.cancel()
+    _speculations.clear()
+
+
+atexit.register(_pipeline_cancel)
+
+
+class _Speculation:
+    """An independent prompt streaming ahead of its cell on a throwaway worker.
+
+    Events are buffered with their arrival times; the cell replays them and
+    then follows the live stream (see _attach_speculation). At most
+    _pipeline_workers run at once; the rest wait for a slot.
+    """
+
+    def __init__(self, prompt):
+        self.prompt = prompt
+        self.session_id = str(uuid.uuid4())
+        self.queued_at = time.time()
+        self.started = None  # when a slot freed up and the worker was spawned
+        self.events = []  # (arrival time, event)
+        self.finished = False
+        self.error = None
+        self._cond = threading.Condition()
+        self._cancel = threading.Event()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        error = None
+        with _pipeline_slots:
+            blocked = _rate_limit_wait(cancelled=self._cancel.is_set)
+            if blocked is not None or self._cancel.is_set():
+                return self._finish(blocked[1] if blocked else "Cancelled.")
+            self.started = time.time()
+            total_s = _deadlines["total"]
+            worker = None
+            try:
+                worker = _throwaway_worker(self.session_id)
+                worker.send(self.prompt)
+                while not self._cancel.is_set():
+                    events = worker.read_events(0.3)
+                    if events is None:
+                        error = f"Error ({_exit_detail(worker)[:500]})"
+                        break
+                    if events:
+                        now = time.time()
+                        with self._cond:
+                            self.events.extend((now, e) for e in events)
+                            self._cond.notify_all()
+                        result = next((e for e in events if e.get("type") == "result"), None)
+                        if result is not None:
+                            info = result.get("is_error") and _rate_limit_info(result.get("result") or "")
+                            if info:
+                                _rate_limiter.hit(*info)
+                            break
+                    if total_s and time.time() - self.started > total_s:
+                        error = f"Claude timed out after {total_s:g}s."
+                        break
+                else:
+                    error = "Cancelled."
+            except FileNotFoundError:
+                error = "Claude CLI not found. Is @anthropic-ai/claude-code installed?"
+            except OSError as e:
+                error = f"Error: {e}"
+            finally:
+                if worker is not None:
+                    worker.stop(kill=error is not None and not worker.pooled)
+        self._finish(error)
+
+    def _finish(self, error):
+        with self._cond:
+            self.error = error
+            self.finished = True
+            self._cond.notify_all()
+
+    def next_events(self, seen, timeout):
+        """Events after the first `seen`, waiting up to `timeout` for some; ([], True) once all are consumed."""
+        with self._cond:
+            if len(self.events) <= seen and not self.finished:
+                self._cond.wait(timeout)
+            return self.events[seen:], self.finished and len(self.events) <= seen
+
+    def cancel(self):
+        self._cancel.set()
+
+    def state(self):
+        if self.finished:
+            return "failed" if self.error else "done"
+        return "streaming" if self.started else "queued"
+
+
+def _attach_speculation(spec):
+    """Show a speculative turn in the running cell: buffered events first, then live ones."""
+    notebook, cell_id = _turn_origin()
+    handle = display(HTML(_render_streaming_html("", "", 0)), display_id=True)
+    renderer = _StreamRenderer(handle, spec.queued_at)
+    metrics = {"ts": spec.queued_at, "session": spec.session_id, "status": "error",
+               "notebook": notebook, "cell_id": cell_id, "backend": "claude",
+               "speculative": True, "start": spec.queued_at}
+    _metrics_send("start")
+    seen, tick, result, message = 0, 0, None, None
+    try:
+        while True:
+            batch, finished = spec.next_events(seen, renderer.next_frame_in(0.3))
+            if finished:
+                break
+            seen += len(batch)
+            renderer.status = None if spec.started else "Queued (pipeline)"
+            for arrived, event in batch:
+                metrics.setdefault("ttfe_s", arrived - spec.queued_at)
+                if _apply_event(event, renderer, metrics, arrived - spec.queued_at):
+                    result = event
+            renderer.flush()
+            if not batch:
+                renderer.spinner(tick)
+                tick += 1
+    except KeyboardInterrupt:
+        spec.cancel()
+        metrics["status"], message = "interrupted", "Interrupted."
+
+    if spec.started:
+        metrics["queue_s"] = spec.started - spec.queued_at
+    renderer.record_tools(metrics)
+    answer = renderer.answer_text()
+    metrics["output_chars"] = renderer.thinking_chars + len(answer)
+    if message is None and result is not None and not result.get("is_error") and (answer or renderer.thinking_chars):
+        metrics["status"] = "ok"
+        _render_final(renderer)
+        # The conversation didn't see this turn; pass it along with the next prompt
+        _cache_backlog.append((spec.prompt, answer))
+        _recent_turns.append((spec.prompt, answer[:_RECENT_ANSWER_CHARS]))
+        _history_add(spec.prompt, answer, metrics)
     else:
-        handle.update(HTML(""))
-        stderr_text = "".join(stderr_buf).strip()
-        if "not authenticated" in stderr_text.lower() or "login" in stderr_text.lower():
-            print("Auth expired. Run %claude_auth or open a Terminal tab and run: claude")
+        if message is None:
+            detail = (result or {}).get("result") if result is not None else None
+            message = spec.error or (f"Error: {detail[:500]}" if detail else "No output received from Claude.")
+        if renderer.answer or renderer.thinking_chars:
+            _render_final(renderer)
+            message += " Partial answer kept above."
         else:
-            print(f"Error (exit {proc.returncode}): {stderr_text[:500]}")
+            renderer.clear()
+        print(message)
+    _record_turn(metrics)
 
 
-def ask(prompt):
-    """Send a question to Claude. Works with ? and special characters.
+# Proxy selection (%proxy). "best" mode probes every PROXY_URLS endpoint in
+# parallel, keeps the ranking for _proxy_rank_ttl seconds and re-probes in the
+# background, failing over if the active endpoint stops answering.
+_PROXY_VARS = [
+    "http_proxy", "https_proxy", "HTTP_PROXY", "HTTPS_PROXY",
+    "all_proxy", "ALL_PROXY",
+]
+_PROBE_TARGET = os.environ.get("PROXY_PROBE_TARGET", "api64.ipify.org:443")
+_proxy_rank_ttl = float(os.environ.get("PROXY_RANK_TTL", "300"))
+_proxy_probe_deadline = float(os.environ.get("PROXY_PROBE_DEADLINE", "3"))
+_proxy_ranking = None  # {"at": ts, "endpoints": tuple, "results": [probe dicts]}
+_proxy_best_stop = None  # Event for the background re-probe thread
 
-    Usage: ask("What are the three laws of robotics?")
+
+def _clear_proxy_env():
+    for var in _PROXY_VARS:
+        os.environ.pop(var, None)
+
+
+def _set_http_proxy(proxy_url):
+    _clear_proxy_env()
+    os.environ["http_proxy"] = proxy_url
+    os.environ["https_proxy"] = proxy_url
+    os.environ["HTTP_PROXY"] = proxy_url
+    os.environ["HTTPS_PROXY"] = proxy_url
+
+
+def _proxy_endpoints():
+    raw = os.environ.get("PROXY_URLS", "")
+    return [u.strip() for u in raw.split(",") if u.strip()]
+
+
+def _proxy_label(url):
+    """host:port of a proxy URL, without credentials."""
+    parts = urllib.parse.urlsplit(url if "://" in url else "http://" + url)
+    return f"{parts.hostname}:{parts.port}" if parts.port else str(parts.hostname)
+
+
+def _recv_exact(sock, n):
+    data = b""
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError("proxy closed the connection")
+        data += chunk
+    return data
+
+
+def _socks5_connect(sock, host, port, username=None, password=None):
+    methods = b"\x00\x02" if username else b"\x00"
+    sock.sendall(b"\x05" + bytes([len(methods)]) + methods)
+    ver, method = _recv_exact(sock, 2)
+    if ver != 5 or method == 0xFF:
+        raise ConnectionError("SOCKS5 auth method rejected")
+    if method == 2:
+        user = urllib.parse.unquote(username or "").encode()
+        pw = urllib.parse.unquote(password or "").encode()
+        sock.sendall(b"\x01" + bytes([len(user)]) + user + bytes([len(pw)]) + pw)
+        if _recv_exact(sock, 2)[1] != 0:
+            raise ConnectionError("SOCKS5 authentication failed")
+    name = host.encode("idna")
+    sock.sendall(b"\x05\x01\x00\x03" + bytes([len(name)]) + name + port.to_bytes(2, "big"))
+    _, rep, _, atyp = _recv_exact(sock, 4)
+    if rep != 0:
+        raise ConnectionError(f"SOCKS5 connect failed (code {rep})")
+    _recv_exact(sock, {1: 4, 4: 16}.get(atyp) or _recv_exact(sock, 1)[0])
+    _recv_exact(sock, 2)
+
+
+def _http_connect(sock, host, port, username=None, password=None):
+    req = f"CONNECT {host}:{port} HTTP/1.1\r\nHost: {host}:{port}\r\n"
+    if username:
+        token = base64.b64encode(
+            f"{urllib.parse.unquote(username)}:{urllib.parse.unquote(password or '')}".encode()
+        ).decode()
+        req += f"Proxy-Authorization: Basic {token}\r\n"
+    sock.sendall((req + "\r\n").encode())
+    resp = b""
+    while b"\r\n\r\n" not in resp:
+        chunk = sock.recv(4096)
+        if not chunk:
+            raise ConnectionError("proxy closed the connection")
+        resp += chunk
+        if len(resp) > 65536:
+            raise ConnectionError("oversized CONNECT response")
+    status = resp.split(b"\r\n", 1)[0].decode("latin-1")
+    if len(status.split()) < 2 or status.split()[1] != "200":
+        raise ConnectionError(status or "empty CONNECT response")
+
+
+def _probe_proxy(url, target=None, timeout=3.0, tls=True):
+    """Time one proxy: TCP connect, tunnel to `target` and TLS handshake through it.
+
+    Handles http(s):// (CONNECT) and socks5(h):// proxies. Returns a dict with
+    connect_s / tunnel_s / tls_s / total_s, and ok or error. `target` and
+    `tls` exist so local stand-in proxies can be probed without the internet.
     """
-    if not prompt or not prompt.strip():
-        print('Usage: ask("your question here")')
-        return
-    _run_claude(prompt)
+    target = target or _PROBE_TARGET
+    host, _, port = target.rpartition(":")
+    port = int(port)
+    parts = urllib.parse.urlsplit(url if "://" in url else "http://" + url)
+    scheme = parts.scheme.lower()
+    result = {"url": url, "label": _proxy_label(url), "ok": False, "error": None}
+    deadline = time.monotonic() + timeout
+    t0 = time.monotonic()
+    sock = None
+    try:
+        default_port = 1080 if scheme.startswith("socks") else 8080
+        sock = socket.create_connection((parts.hostname, parts.port or default_port), timeout=timeout)
+        t1 = time.monotonic()
+        result["connect_s"] = t1 - t0
+        sock.settimeout(max(deadline - t1, 0.01))
+        if scheme.startswith("socks"):
+            _socks5_connect(sock, host, port, parts.username, parts.password)
+        else:
+            _http_connect(sock, host, port, parts.username, parts.password)
+        t2 = time.monotonic()
+        result["tunnel_s"] = t2 - t1
+        if tls:
+            sock.settimeout(max(deadline - t2, 0.01))
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=host)
+            result["tls_s"] = time.monotonic() - t2
+        result["total_s"] = time.monotonic() - t0
+        result["ok"] = True
+    except (OSError, ValueError) as e:
+        result["error"] = "timeout" if isinstance(e, socket.timeout) else str(e) or type(e).__name__
+    finally:
+        if sock is not None:
+            sock.close()
+    return result
+
+
+def _rank_proxies(endpoints, deadline=None, target=None, tls=True):
+    """Probe all endpoints concurrently within `deadline` seconds; fastest healthy first."""
+    deadline = _proxy_probe_deadline if deadline is None else deadline
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=min(32, max(1, len(endpoints))))
+    futures = {pool.submit(_probe_proxy, url, target, deadline, tls): i
+               for i, url in enumerate(endpoints)}
+    done, _ = concurrent.futures.wait(futures, timeout=deadline + 0.5)
+    pool.shutdown(wait=False, cancel_futures=True)
+    results = []
+    for fut, i in futures.items():
+        if fut in done:
+            res = fut.result()
+        else:
+            res = {"url": endpoints[i], "label": _proxy_label(endpoints[i]),
+                   "ok": False, "error": "timeout"}
+        res["index"] = i
+        results.append(res)
+    results.sort(key=lambda r: (not r["ok"], r.get("total_s", float("inf"))))
+    return results
+
+
+def _proxy_rank(force=False):
+    """Cached ranking of PROXY_URLS, re-probed once older than _proxy_rank_ttl."""
+    global _proxy_ranking
+    endpoints = tuple(_proxy_endpoints())
+    cached = _proxy_ranking
+    if (not force and cached is not None and cached["endpoints"] == endpoints
+            and time.time() - cached["at"] < _proxy_rank_ttl):
+        return cached["results"]
+    results = _rank_proxies(list(endpoints))
+    _proxy_ranking = {"at": time.time(), "endpoints": endpoints, "results": results}
+    return results
+
+
+def _print_proxy_table(results):
+    def ms(r, key):
+        return f"{r[key] * 1000:.0f}" if r.get(key) is not None else "-"
+
+    print(f"  {'idx':>3}  {'endpoint':<32}{'connect':>9}{'tunnel':>9}{'tls':>9}{'total':>9}  status")
+    for r in results:
+        status = "ok" if r["ok"] else r["error"]
+        print(f"  {r['index']:>3}  {r['label'][:31]:<32}{ms(r, 'connect_s'):>9}"
+              f"{ms(r, 'tunnel_s'):>9}{ms(r, 'tls_s'):>9}{ms(r, 'total_s'):>9}  {status}")
+    print("  (ms)")
+
+
+def _stop_proxy_reprobe():
+    global _proxy_best_stop
+    if _proxy_best_stop is not None:
+        _proxy_best_stop.set()
+        _proxy_best_stop = None
+
+
+def _start_proxy_reprobe():
+    """Re-rank every _proxy_rank_ttl seconds; fail over if the active endpoint dies."""
+    global _proxy_best_stop
+    _stop_proxy_reprobe()
+    stop = _proxy_best_stop = threading.Event()
+
+    def _loop():
+        while not stop.wait(_proxy_rank_ttl):
+            results = _proxy_rank(force=True)
+            current = os.environ.get("http_proxy")
+            healthy = [r for r in results if r["ok"]]
+            if stop.is_set() or not healthy:
+                continue
+            if not any(r["url"] == current for r in healthy):
+                _set_http_proxy(healthy[0]["url"])
+
+    threading.Thread(target=_loop, daemon=True).start()
+
+
+# Local failover proxy (%proxy local): claude_proxy.py runs once per pod on
+# 127.0.0.1 and every kernel and terminal that opts in points at it.
+_proxy_local_port = int(os.environ.get("PROXY_LOCAL_PORT", "3128"))
+_proxy_local_url = f"http://127.0.0.1:{_proxy_local_port}"
+_proxy_local_log = f"/tmp/claude-proxy-{os.getuid()}.log"
+
+
+def _local_proxy_status(timeout=1.0):
+    """The running local proxy's /status, or None if nothing answers."""
+    try:
+        with socket.create_connection(("127.0.0.1", _proxy_local_port), timeout=timeout) as sock:
+            sock.settimeout(timeout)
+            sock.sendall(b"GET /status HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            data = b""
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+        head, _, body = data.partition(b"\r\n\r\n")
+        return json.loads(body) if b" 200 " in head.split(b"\r\n", 1)[0] + b" " else None
+    except (OSError, ValueError):
+        return None
+
+
+def _start_local_proxy():
+    """Start claude_proxy.py unless it already runs; wait for its first health check."""
+    status = _local_proxy_status()
+    if status is None:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "claude_proxy.py")
+        with open(_proxy_local_log, "ab") as log:
+            subprocess.Popen(
+                [sys.executable, path, "--port", str(_proxy_local_port)],
+                stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+                start_new_session=True,  # outlives this kernel; other kernels share it
+            )
+    deadline = time.monotonic() + float(os.environ.get("PROXY_CONNECT_TIMEOUT", "5")) + 2
+    while time.monotonic() < deadline:
+        status = _local_proxy_status()
+        if status is not None and all(u["healthy"] is not None for u in status["upstreams"]):
+            break
+        time.sleep(0.1)
+    return status
+
+
+def _print_local_proxy_table(status):
+    print(f"  {'idx':>3}  {'endpoint':<32}{'state':>7}{'ms':>7}{'active':>8}{'tunnels':>9}{'fails':>7}")
+    for u in status["upstreams"]:
+        state = {True: "ok", False: "down", None: "?"}[u["healthy"]]
+        ms = f"{u['latency_s'] * 1000:.0f}" if u.get("latency_s") is not None else "-"
+        mark = "*" if u["index"] == status.get("primary") else " "
+        print(f" {mark}{u['index']:>3}  {u['label'][:31]:<32}{state:>7}{ms:>7}{u['active']:>8}"
+              f"{u.get('tunnels', 0):>9}{u.get('failures', 0):>7}")
+    print(f"  (* in use; {status.get('failovers', 0)} failovers, "
+          f"{status.get('failed', 0)} requests failed on every endpoint)")
 
 
 def _register_magics():
@@ -374,69 +3595,84 @@ def _register_magics():
 
     @register_line_magic
     def claude(line):
-        """Send a single-line query: %claude explain this error"""
+        """Send a single-line query: %claude [--bg] [--no-cache] [--ctx a,b] explain this error"""
+        line, flags = _split_flags(line)
         if not line.strip():
             print("Usage:")
             print('  ask("your question here")    send a query (handles ? and quotes)')
             print("  %claude <query>              send a line query")
             print("  %%claude                     cell magic for multi-line prompts")
+            print("  %%claude --bg                stream in the background; returns a handle")
+            print("  %%claude --no-cache          skip the response cache for this cell")
+            print("  %%claude --independent       may run ahead in its own session (%claude_pipeline)")
+            print("  %claude --ctx df,@tb <query> include variable / traceback / @cells summaries")
             print()
             print("Session:")
             print("  %claude_auth                 authenticate with Claude Max")
             print("  %claude_reset                start a fresh conversation")
+            print("  %claude_compact              summarize into a fresh session")
+            print("  %claude_backend [auto|NAME]  route prompts or pin claude/ollama/gemini")
             print("  %claude_status               show session info")
             print("  %claude_version              show image tag and git SHA")
             print("  %claude_thinking             toggle thinking visibility")
+            print("  %claude_cache [on|off|clear|stats]  response cache for re-run cells")
+            print("  %claude_stats [last|clear]   latency / token / cost percentiles")
             print()
             print("Note: Trailing ? may trigger IPython help instead of Claude.")
             print('  Use ask("question?") or %%claude for prompts ending in ?')
             return
-        _run_claude(line)
+        return _ask_with_flags(line, flags)
 
     @register_cell_magic
     def claude(line, cell):
-        """Send a multi-line query: %%claude"""
+        """Send a multi-line query: %%claude [--bg] [--no-cache] [--ctx a,b] [--independent]"""
+        line, flags = _split_flags(line)
         prompt = f"{line}\n{cell}".strip() if line else cell
         if not prompt:
             print("Usage: %%claude\\n<your prompt>")
             return
-        _run_claude(prompt)
+        if _pipeline_enabled:
+            _pipeline_dispatch(cell)
+            spec = _speculations.pop(_pipeline_key(prompt), None) if flags.get("--independent") else None
+            if spec is not None:
+                return _attach_speculation(spec)
+        return _ask_with_flags(prompt, flags)
 
     @register_line_magic
     def claude_auth(line):
         """Authenticate with Claude Max: %claude_auth"""
         config_dir = os.environ.get("CLAUDE_CONFIG_DIR", os.path.expanduser("~/.claude"))
-        creds_file = os.path.join(config_dir, ".credentials.json")
+        _auth.invalidate()
+        status = _auth.status()
 
-        if os.path.exists(creds_file):
+        if status == "ok":
             print("Already authenticated.")
             return
+        if status == "expired":
+            print("Saved credentials have expired; starting a new login.")
 
         # Ensure config dir exists
         os.makedirs(config_dir, exist_ok=True)
 
         print("Starting Claude authentication...")
         try:
-            # Run claude and capture output — it prints an auth URL in headless mode
+            # Run claude and watch its output — it prints an auth URL in headless mode
             proc = subprocess.Popen(
                 ["claude"],
                 stdin=subprocess.PIPE,
                 stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
+                stderr=subprocess.STDOUT,
                 env={**os.environ, "CLAUDE_CONFIG_DIR": config_dir},
             )
-            # Give it time to print the auth URL
-            time.sleep(8)
-            proc.terminate()
             try:
-                stdout, stderr = proc.communicate(timeout=5)
-            except subprocess.TimeoutExpired:
-                proc.kill()
-                stdout, stderr = proc.communicate()
-
-            output = (stdout or "") + (stderr or "")
-            urls = re.findall(r'https://[^\s<>"]+', output)
+                urls, output = _wait_for_auth_urls(proc, time.time() + _auth_deadline_s)
+            finally:
+                proc.terminate()
+                try:
+                    proc.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+                    proc.wait()
 
             if urls:
                 print("Click the link below to authenticate:\n")
@@ -447,7 +3683,8 @@ def _register_magics():
                 # No URL found — show raw output and fallback
                 if output.strip():
                     print(output.strip())
-                print("\nIf no link appeared, open a Terminal tab (File > New > Terminal) and run: claude")
+                print(f"\nNo login link within {_auth_deadline_s:.0f}s.")
+                print("If no link appeared, open a Terminal tab (File > New > Terminal) and run: claude")
 
         except FileNotFoundError:
             print("Claude CLI not found. Is @anthropic-ai/claude-code installed?")
@@ -458,11 +3695,120 @@ def _register_magics():
     @register_line_magic
     def claude_reset(line):
         """Start a fresh conversation: %claude_reset"""
-        global CLAUDE_SESSION_ID, _turn_count, _session_created
-        CLAUDE_SESSION_ID = str(uuid.uuid4())
-        _turn_count = 0
-        _session_created = False
+        previous = _fresh_session()
         print(f"New session: {CLAUDE_SESSION_ID[:8]}...")
+        if previous and _history_enabled:
+            print(f"Previous one: %claude_resume {previous[:8]}")
+
+    @register_line_magic
+    def claude_history(line):
+        """Search past turns: %claude_history [query]"""
+        import sqlite3
+
+        try:
+            rows = _history_search(line.strip())
+        except (OSError, sqlite3.Error) as e:
+            print(f"History unavailable: {e}")
+            return
+        if not rows:
+            print("No matching turns." if line.strip() else "No turns recorded yet.")
+            return
+        print(f"{'id':>6}  {'when':<16}  {'session':<8}  {'notebook':<24}  prompt")
+        for turn_id, session, notebook, prompt, finished, status in rows:
+            when = time.strftime("%Y-%m-%d %H:%M", time.localtime(finished))
+            text = " ".join(prompt.split())
+            text = text[:60] + ("..." if len(text) > 60 else "")
+            if status != "ok":
+                text += f"  [{status}]"
+            name = os.path.basename(notebook or "") or "-"
+            print(f"{turn_id:>6}  {when:<16}  {session[:8]:<8}  {name[:24]:<24}  {text}")
+        print("\nResume a conversation with %claude_resume <id or session prefix>")
+
+    @register_line_magic
+    def claude_resume(line):
+        """Continue an earlier conversation: %claude_resume <turn id | session prefix>"""
+        import sqlite3
+
+        ref = line.strip()
+        if not ref:
+            print("Usage: %claude_resume <turn id | session prefix>  (see %claude_history)")
+            return
+        try:
+            found = _history_session(ref)
+        except (OSError, sqlite3.Error) as e:
+            print(f"History unavailable: {e}")
+            return
+        if found is None:
+            print(f"No session matches {ref!r}.")
+            return
+        session_id, turns = found
+        _reset_session(session_id, created=True, turns=turns)
+        print(f"Resumed session {session_id[:8]}... ({turns} turns)")
+
+    @register_line_magic
+    def claude_compact(line):
+        """Summarize the session into a fresh one: %claude_compact [status | warn=N compact=N | INSTRUCTIONS]"""
+        args = line.split()
+        settings = [a.partition("=") for a in args]
+        if args and all(eq and key in _context_limits for key, eq, _ in settings):
+            try:
+                for key, _, value in settings:
+                    _context_limits[key] = int(float(value))
+            except ValueError:
+                print("Usage: %claude_compact warn=TOKENS compact=TOKENS  (0 disables)")
+                return
+        elif args != ["status"]:
+            _compact(print, line.strip())
+            return
+        size = f"{_context_tokens:,} tokens" if _context_tokens is not None else "unknown (no turn yet)"
+        print(f"Context:    {size}, {_session_input_tokens:,} input tokens over the session")
+        for key, label in (("warn", "Warn at"), ("compact", "Compact at")):
+            value = _context_limits[key]
+            print(f"{label + ':':<12}{f'{value:,} tokens' if value else 'off'}")
+        if _carryover:
+            print(f"Pending:    {len(_carryover):,}-char summary goes with the next prompt")
+
+    @register_line_magic
+    def claude_backend(line):
+        """Choose where prompts run: %claude_backend [auto | claude | ollama | gemini | route PROMPT]"""
+        global _backend_mode
+        cmd, _, rest = line.strip().partition(" ")
+        if cmd == "route":
+            chosen, reason = _route(rest.strip())
+            print(f"{chosen.name}: {reason}")
+            return
+        if cmd:
+            if cmd != "auto" and cmd not in _backends:
+                print(f"Usage: %claude_backend [auto | {' | '.join(_backends)} | route PROMPT]")
+                return
+            _backend_mode = cmd
+        mode = "auto (router)" if _backend_mode == "auto" else f"pinned to {_backend_mode}"
+        print(f"Backend:   {mode}")
+        for backend in _backends.values():
+            print(f"  {backend.name:<8} {backend.describe()}")
+        if _backend_mode == "auto":
+            print(f"Router:    prompts up to {_route_max_chars} chars without code or analysis "
+                  "go to ollama; the rest to claude")
+
+    @register_line_magic
+    def claude_pipeline(line):
+        """Run independent %%claude cells ahead of time: %claude_pipeline [on|off|status]"""
+        global _pipeline_enabled
+        cmd = line.strip().lower()
+        if cmd in ("on", "off"):
+            _pipeline_enabled = cmd == "on"
+            if not _pipeline_enabled:
+                _pipeline_cancel()
+        elif cmd not in ("", "status"):
+            print("Usage: %claude_pipeline [on|off|status]")
+            return
+        print(f"Pipeline:  {'on' if _pipeline_enabled else 'off'} ({_pipeline_workers} at a time)")
+        path = _notebook_file()
+        print(f"Notebook:  {path or 'not found (set CLAUDE_NOTEBOOK)'}")
+        now = time.time()
+        for spec in _speculations.values():
+            text = " ".join(spec.prompt.split())
+            print(f"  {spec.state():<10}{now - spec.queued_at:>7.1f}s  {text[:60]}")
 
     @register_line_magic
     def claude_thinking(line):
@@ -472,17 +3818,129 @@ def _register_magics():
         state = "visible" if _show_thinking else "hidden"
         print(f"Thinking sections: {state}")
 
+    @register_line_magic
+    def claude_timeout(line):
+        """Session turn deadlines: %claude_timeout [SECONDS | total=S idle=S ttft=S]"""
+        args = line.split()
+        try:
+            for arg in args:
+                key, eq, value = arg.partition("=")
+                if not eq:
+                    key, value = "total", arg
+                if key not in _deadlines:
+                    raise ValueError(key)
+                _deadlines[key] = float(value)
+        except ValueError:
+            print("Usage: %claude_timeout [SECONDS | total=S idle=S ttft=S]  (0 disables)")
+            return
+        for key, label in (("total", "Total"), ("idle", "Idle"), ("ttft", "First token")):
+            value = _deadlines[key]
+            print(f"{label + ':':<13}{f'{value:g}s' if value else 'off'}")
+
+    @register_line_magic
+    def claude_cache(line):
+        """Response cache for re-run cells: %claude_cache [on|off|clear|stats]"""
+        global _cache_enabled
+        cmd = line.strip().lower() or "stats"
+        if cmd == "on":
+            _cache_enabled = True
+            print(f"Response cache: on ({_cache_dir()})")
+        elif cmd == "off":
+            _cache_enabled = False
+            print("Response cache: off")
+        elif cmd == "clear":
+            removed = 0
+            for _, _, path in _cache_entries():
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    pass
+            print(f"Cleared {removed} cached responses.")
+        elif cmd == "stats":
+            entries = _cache_entries()
+            size = sum(e[1] for e in entries)
+            lookups = _cache_hits + _cache_misses
+            rate = f" ({100 * _cache_hits / lookups:.0f}% hit)" if lookups else ""
+            print(f"Cache:     {'on' if _cache_enabled else 'off'}")
+            print(f"Entries:   {len(entries)}")
+            print(f"Size:      {size / 1024 / 1024:.1f} / {_cache_max_bytes / 1024 / 1024:.0f} MB")
+            print(f"Session:   {_cache_hits} hits, {_cache_misses} misses{rate}")
+            print(f"Path:      {_cache_dir()}")
+        else:
+            print("Usage: %claude_cache [on|off|clear|stats]")
+
+    @register_line_magic
+    def claude_stats(line):
+        """Per-turn latency and usage percentiles: %claude_stats [last|clear]"""
+        cmd = line.strip().lower()
+        if cmd == "clear":
+            _turn_metrics.clear()
+            print("Turn metrics cleared.")
+            return
+        if not _turn_metrics:
+            print("No turns recorded yet.")
+            return
+        if cmd == "last":
+            for key, value in _turn_metrics[-1].items():
+                print(f"{key + ':':<30}{value}")
+            return
+
+        turns = list(_turn_metrics)
+        statuses = collections.Counter(m["status"] for m in turns)
+        print(f"Turns:     {len(turns)} ({', '.join(f'{n} {k}' for k, n in statuses.most_common())})")
+        backends = collections.Counter(m.get("backend", "claude") for m in turns)
+        if len(backends) > 1:
+            print(f"Backends:  {', '.join(f'{n} {k}' for k, n in backends.most_common())}")
+        print(f"{'':<16}{'n':>6}{'p50':>12}{'p95':>12}{'max':>12}")
+        for key, label, fmt in _STATS_ROWS:
+            values = [m[key] for m in turns if m.get(key) is not None]
+            if not values:
+                continue
+            cols = "".join(f"{fmt.format(v):>12}" for v in (
+                _percentile(values, 50), _percentile(values, 95), max(values)))
+            print(f"{label:<16}{len(values):>6}{cols}")
+        cost = sum(m.get("cost_usd", 0) for m in turns)
+        tokens = sum(m.get("input_tokens", 0) + m.get("output_tokens", 0) for m in turns)
+        print(f"Total:     ${cost:.4f}, {tokens:,} tokens")
+        if _stats_file:
+            print(f"Log:       {_stats_file}")
+
     @register_line_magic
     def claude_status(line):
         """Show session info: %claude_status"""
         config_dir = os.environ.get("CLAUDE_CONFIG_DIR", os.path.expanduser("~/.claude"))
-        creds_file = os.path.join(config_dir, ".credentials.json")
-        auth_status = "authenticated" if os.path.exists(creds_file) else "NOT authenticated"
+        auth_status = _auth.describe()
         thinking_status = "visible" if _show_thinking else "hidden"
 
         print(f"Session:   {CLAUDE_SESSION_ID[:8]}...")
         print(f"Turns:     {_turn_count}")
+        if _context_tokens is not None:
+            compact_at = _context_limits["compact"]
+            print(f"Context:   {_context_tokens:,} tokens"
+                  + (f" (auto-compact at {compact_at:,})" if compact_at else " (%claude_compact to shrink)"))
+        if _turn_metrics:
+            last = _turn_metrics[-1]
+            ttft = last.get("ttft_thinking_s") or last.get("ttft_answer_s")
+            ttft_str = f", first token {ttft:.1f}s" if ttft is not None else ""
+            cost = sum(m.get("cost_usd", 0) for m in _turn_metrics)
+            print(f"Last turn: {last['status']}, {last['total_s']:.1f}s{ttft_str}")
+            if "model_s" in last:
+                tools = sorted((last.get("tools") or {}).items(), key=lambda kv: -kv[1][1])
+                detail = ", ".join(f"{name} {n}x {secs:.1f}s" for name, (n, secs) in tools[:4])
+                detail += ", ..." if len(tools) > 4 else ""
+                calls = last.get("tool_calls", 0)
+                print(f"Time:      model {last['model_s']:.1f}s, tools {last.get('tool_s', 0):.1f}s"
+                      + (f" ({calls} call{'s' if calls != 1 else ''}: {detail})" if calls else ""))
+            print(f"Cost:      ${cost:.4f} over {len(_turn_metrics)} turns (%claude_stats for more)")
+        if _worker is not None and _worker.alive():
+            print(f"Worker:    {_worker.describe()}")
+        else:
+            print("Worker:    not running (starts on next prompt)")
         print(f"Auth:      {auth_status}")
+        print(f"Limits:    {_rate_limiter.describe()}")
+        print(f"Backend:   {'auto' if _backend_mode == 'auto' else 'pinned to ' + _backend_mode}"
+              + (f" (last turn: {_turn_metrics[-1].get('backend', 'claude')})" if _turn_metrics else ""))
         print(f"Thinking:  {thinking_status}")
         print(f"Config:    {config_dir}")
 
@@ -497,10 +3955,13 @@ def _register_magics():
 
     @register_line_magic
     def proxy(line):
-        """Route traffic through Mullvad or Tor: %proxy [mullvad [index] | tor | off | status]
+        """Route traffic through Mullvad or Tor: %proxy [mullvad [index|best] | local [stop] | tor | off | status]
 
         %proxy mullvad        — random endpoint from PROXY_URLS pool
         %proxy mullvad 2      — specific endpoint (0-indexed)
+        %proxy mullvad best   — probe all endpoints, use the fastest healthy one
+        %proxy local          — local proxy on 127.0.0.1, failing over across PROXY_URLS
+        %proxy local stop     — stop the local proxy
         %proxy tor            — Tor SOCKS5 sidecar (requires tor.enabled=true)
         %proxy off            — clear proxy, use node IP
         %proxy status         — show current proxy and exit IP
@@ -511,20 +3972,15 @@ def _register_magics():
         if not args:
             print("Usage:")
             print("  %proxy mullvad [idx]  — route via Mullvad proxy pool")
+            print("  %proxy mullvad best   — lowest-latency healthy endpoint")
+            print("  %proxy local          — local failover proxy over the pool")
             print("  %proxy tor            — route via Tor sidecar")
             print("  %proxy off            — clear proxy, use node IP")
             print("  %proxy status         — show current proxy and exit IP")
             return
         cmd = args[0].lower()
-
-        _proxy_vars = [
-            "http_proxy", "https_proxy", "HTTP_PROXY", "HTTPS_PROXY",
-            "all_proxy", "ALL_PROXY",
-        ]
-
-        def _clear_proxy():
-            for var in _proxy_vars:
-                os.environ.pop(var, None)
+        if cmd in ("mullvad", "local", "tor", "off"):
+            _stop_proxy_reprobe()
 
         def _get_exit_ip(proxy_url=None):
             try:
@@ -542,11 +3998,27 @@ def _register_magics():
             if not proxy_urls_raw:
                 print("No PROXY_URLS configured. Set mullvad.proxySecretName in Helm values.")
                 return
-            endpoints = [u.strip() for u in proxy_urls_raw.split(",") if u.strip()]
+            endpoints = _proxy_endpoints()
             if not endpoints:
                 print("PROXY_URLS is empty.")
                 return
 
+            if len(args) > 1 and args[1].lower() == "best":
+                refresh = len(args) > 2 and args[2].lower() == "refresh"
+                print(f"  Probing {len(endpoints)} endpoints...", flush=True)
+                results = _proxy_rank(force=refresh)
+                _print_proxy_table(results)
+                healthy = [r for r in results if r["ok"]]
+                if not healthy:
+                    print("No endpoint answered. Proxy unchanged.")
+                    return
+                best = healthy[0]
+                _set_http_proxy(best["url"])
+                _start_proxy_reprobe()
+                print(f"→ Mullvad best [{best['index']}/{len(endpoints) - 1}]: {best['label']} "
+                      f"({best['total_s'] * 1000:.0f} ms; re-probing every {_proxy_rank_ttl:.0f}s)")
+                return
+
             if len(args) > 1:
                 try:
                     idx = int(args[1])
@@ -560,15 +4032,37 @@ def _register_magics():
                 idx = random.randrange(len(endpoints))
 
             proxy_url = endpoints[idx]
-            _clear_proxy()
-            os.environ["http_proxy"] = proxy_url
-            os.environ["https_proxy"] = proxy_url
-            os.environ["HTTP_PROXY"] = proxy_url
-            os.environ["HTTPS_PROXY"] = proxy_url
+            _set_http_proxy(proxy_url)
             print(f"→ Mullvad [{idx}/{len(endpoints) - 1}]: {proxy_url}")
             print(f"  Checking exit IP...", end=" ", flush=True)
             print(_get_exit_ip(proxy_url))
 
+        elif cmd == "local" and len(args) > 1 and args[1].lower() == "stop":
+            status = _local_proxy_status()
+            if os.environ.get("http_proxy") == _proxy_local_url:
+                _clear_proxy_env()
+            if status is None:
+                print("Local proxy is not running.")
+                return
+            os.kill(status["pid"], signal.SIGTERM)
+            print(f"→ Local proxy stopped (pid {status['pid']}). Kernels still pointing at it "
+                  f"need %proxy off or another %proxy.")
+
+        elif cmd == "local":
+            if not _proxy_endpoints():
+                print("No PROXY_URLS configured. Set mullvad.proxySecretName in Helm values.")
+                return
+            print(f"  Starting local proxy over {len(_proxy_endpoints())} endpoints...", flush=True)
+            status = _start_local_proxy()
+            if status is None:
+                print(f"Local proxy did not start; see {_proxy_local_log}")
+                return
+            _print_local_proxy_table(status)
+            _set_http_proxy(_proxy_local_url)
+            print(f"→ Local proxy: {_proxy_local_url} (pid {status['pid']})")
+            print("  Checking exit IP...", end=" ", flush=True)
+            print(_get_exit_ip(_proxy_local_url))
+
         elif cmd == "tor":
             tor_proxy = "socks5h://127.0.0.1:9050"
             print("  Connecting to Tor...", end=" ", flush=True)
@@ -588,7 +4082,7 @@ def _register_magics():
                 print("Enable with: tor.enabled=true in Helm values, then redeploy.")
                 return
 
-            _clear_proxy()
+            _clear_proxy_env()
             os.environ["all_proxy"] = tor_proxy
             os.environ["ALL_PROXY"] = tor_proxy
 
@@ -603,7 +4097,7 @@ def _register_magics():
             print(f"→ Tor: {tor_proxy}")
 
         elif cmd == "off":
-            _clear_proxy()
+            _clear_proxy_env()
             print(f"→ Proxy cleared.  Exit IP: {_get_exit_ip()}")
 
         elif cmd == "status":
@@ -611,11 +4105,23 @@ def _register_magics():
                        os.environ.get("all_proxy") or os.environ.get("ALL_PROXY"))
             label = current if current else "none (direct)"
             print(f"→ Proxy:   {label}")
+            if _proxy_best_stop is not None and _proxy_ranking is not None:
+                age = time.time() - _proxy_ranking["at"]
+                print(f"  Mode:    best (ranking {age:.0f}s old, re-probe every {_proxy_rank_ttl:.0f}s)")
+            if current == _proxy_local_url:
+                status = _local_proxy_status()
+                if status is None:
+                    print("  Local proxy is not running; %proxy local starts it again")
+                else:
+                    print(f"  Mode:    local (pid {status['pid']}, up {status['uptime_s'] / 60:.0f} min)")
+                    _print_local_proxy_table(status)
             print(f"  Exit IP: {_get_exit_ip(current)}")
 
         else:
             print("Usage:")
             print("  %proxy mullvad [idx]  — route via Mullvad proxy pool")
+            print("  %proxy mullvad best   — lowest-latency healthy endpoint")
+            print("  %proxy local          — local failover proxy over the pool")
             print("  %proxy tor            — route via Tor (requires tor.enabled=true)")
             print("  %proxy off            — clear proxy, use node IP")
             print("  %proxy status         — show current proxy and exit IP")
@@ -623,3 +4129,6 @@ def _register_magics():
 
 # Register on import
 _register_magics()
+
+# Let the pool start warming a process for this kernel's first conversation
+_pool_reserve(CLAUDE_SESSION_ID)
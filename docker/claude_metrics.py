@@ -0,0 +1,381 @@
+"""
+Pod-wide Prometheus metrics for Claude turns, run as a Jupyter server extension.
+
+Every kernel's claude_magic sends one small JSON datagram when a turn starts
+and one when it ends to a Unix socket (CLAUDE_METRICS_SOCKET). Sends are
+non-blocking and dropped if nothing listens or the buffer is full, so a
+turn never waits on metrics. This module receives them inside the Jupyter
+server and serves the aggregate on its own port (CLAUDE_METRICS_PORT, no
+Jupyter auth) for Prometheus to scrape:
+
+    -> {"ev": "start", "pid": p}
+    -> {"ev": "end", "pid": p, "backend": b, "status": s, "total_s": .., ...}
+
+    GET /metrics
+    claude_turns_in_flight                          gauge
+    claude_turns_total{backend,status}              counter
+    claude_turn_duration_seconds{backend}           histogram
+    claude_turn_ttft_seconds{backend}               histogram, first thinking/answer text
+    claude_turn_queue_seconds                       histogram, wait for a pooled worker
+    claude_tool_calls_total, claude_tool_seconds_total
+    claude_rate_limited_total, claude_rate_wait_seconds_total   retries and queueing on API limits
+    claude_tokens_total{backend,kind}               input, output, cache_read, cache_creation
+    claude_cost_usd_total{backend}
+    claude_cli_exits_total{code}                    CLI died mid-turn
+    claude_cli_processes                            live `claude` processes in the pod
+    claude_kernels                                  kernels that reported a turn and still run
+    claude_pool_*                                   claude_pool's stats, when it runs
+
+Labels are limited to small fixed sets (backend, status, token kind, exit
+code); per-notebook detail stays in each kernel's %claude_stats.
+
+Enable with:
+    jupyter server extension enable claude_metrics
+or the config file shipped in the image. Set CLAUDE_METRICS=0 to disable.
+Standalone (debugging): python claude_metrics.py
+"""
+import asyncio
+import atexit
+import collections
+import json
+import os
+import signal
+import socket
+
+_metrics_port = int(os.environ.get("CLAUDE_METRICS_PORT", "9464"))
+_metrics_addr = os.environ.get("CLAUDE_METRICS_ADDR", "0.0.0.0")
+_metrics_socket = os.environ.get(
+    "CLAUDE_METRICS_SOCKET", f"/tmp/claude-metrics-{os.getuid()}.sock"
+)
+# Must match claude_pool._pool_socket
+_pool_socket = os.environ.get(
+    "CLAUDE_POOL_SOCKET", f"/tmp/claude-pool-{os.getuid()}.sock"
+)
+
+_DURATION_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 1800)
+_TTFT_BUCKETS = (0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60, 120)
+_QUEUE_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30, 60, 120)
+
+_TOKEN_KINDS = (
+    ("input_tokens", "input"),
+    ("output_tokens", "output"),
+    ("cache_read_input_tokens", "cache_read"),
+    ("cache_creation_input_tokens", "cache_creation"),
+)
+_POOL_GAUGES = ("size", "live", "spares", "active", "queued", "kernels_waiting")
+_POOL_COUNTERS = ("turns", "spawns", "spare_hits", "evictions", "reaped", "interrupted", "cancelled")
+
+
+class _Histogram:
+    """Cumulative-bucket histogram per label tuple."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.series = {}  # labels -> [bucket counts..., count, sum]
+
+    def observe(self, labels, value):
+        row = self.series.setdefault(labels, [0] * (len(self.buckets) + 1) + [0.0])
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                row[i] += 1
+        row[-2] += 1
+        row[-1] += value
+
+    def lines(self, name, label_names):
+        for labels, row in sorted(self.series.items()):
+            base = _labels(label_names, labels)
+            for bound, n in zip(self.buckets, row):
+                yield f'{name}_bucket{{{base}{"," if base else ""}le="{bound:g}"}} {n}'
+            yield f'{name}_bucket{{{base}{"," if base else ""}le="+Inf"}} {row[-2]}'
+            yield f"{name}_count{_braced(base)} {row[-2]}"
+            yield f"{name}_sum{_braced(base)} {row[-1]:.6g}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    return ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+
+
+def _braced(labels):
+    return f"{{{labels}}}" if labels else ""
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OverflowError, ValueError):
+        pass
+    return True
+
+
+def _cli_processes():
+    """Count `claude` CLI processes in the pod (node or native), from /proc."""
+    count = 0
+    try:
+        pids = [p for p in os.listdir("/proc") if p.isdigit()]
+    except OSError:
+        return None
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                args = f.read().split(b"\0")[:2]
+        except OSError:
+            continue  # exited, or not ours to read
+        if any(os.path.basename(a) == b"claude" for a in args):
+            count += 1
+    return count
+
+
+class Metrics:
+    """Aggregated turn metrics from every kernel in the pod."""
+
+    def __init__(self):
+        self.in_flight = collections.Counter()  # kernel pid -> running turns
+        self.kernels = set()
+        self.turns = collections.Counter()      # (backend, status)
+        self.tokens = collections.Counter()     # (backend, kind)
+        self.cost = collections.Counter()       # (backend,)
+        self.exits = collections.Counter()      # (code,)
+        self.tool_calls = 0
+        self.tool_seconds = 0.0
+        self.rate_limited = 0
+        self.rate_wait = 0.0
+        self.dropped = 0
+        self.duration = _Histogram(_DURATION_BUCKETS)
+        self.ttft = _Histogram(_TTFT_BUCKETS)
+        self.queue = _Histogram(_QUEUE_BUCKETS)
+
+    def record(self, msg):
+        """Apply one datagram from a kernel."""
+        pid = msg.get("pid")
+        if not isinstance(pid, int):
+            self.dropped += 1
+            return
+        self.kernels.add(pid)
+        if msg.get("ev") == "start":
+            self.in_flight[pid] += 1
+            return
+        if msg.get("ev") != "end":
+            self.dropped += 1
+            return
+        if self.in_flight[pid] > 0:
+            self.in_flight[pid] -= 1
+        backend = str(msg.get("backend") or "claude")
+        self.turns[backend, str(msg.get("status") or "unknown")] += 1
+        if isinstance(msg.get("total_s"), (int, float)):
+            self.duration.observe((backend,), msg["total_s"])
+        ttft = [msg[k] for k in ("ttft_thinking_s", "ttft_answer_s") if isinstance(msg.get(k), (int, float))]
+        if ttft:
+            self.ttft.observe((backend,), min(ttft))
+        if isinstance(msg.get("queue_s"), (int, float)):
+            self.queue.observe((), msg["queue_s"])
+        for key, kind in _TOKEN_KINDS:
+            if isinstance(msg.get(key), int):
+                self.tokens[backend, kind] += msg[key]
+        if isinstance(msg.get("cost_usd"), (int, float)):
+            self.cost[backend,] += msg["cost_usd"]
+        if msg.get("exit_code") is not None:
+            self.exits[str(msg["exit_code"]),] += 1
+        self.tool_calls += int(msg.get("tool_calls") or 0)
+        self.tool_seconds += float(msg.get("tool_s") or 0.0)
+        self.rate_limited += int(msg.get("rate_limited") or 0)
+        self.rate_wait += float(msg.get("rate_wait_s") or 0.0)
+
+    def _prune(self):
+        """Forget kernels that have exited (their turns are no longer in flight)."""
+        for pid in [p for p in self.kernels if not _pid_alive(p)]:
+            self.kernels.discard(pid)
+            self.in_flight.pop(pid, None)
+
+    def exposition(self, pool=None):
+        """Prometheus text format (version 0.0.4)."""
+        self._prune()
+        out = []
+
+        def family(name, kind, help_text, samples):
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(samples)
+
+        def counter(name, help_text, label_names, values):
+            family(name, "counter", help_text, [
+                f"{name}{_braced(_labels(label_names, labels))} {value:g}"
+                for labels, value in sorted(values.items())
+            ])
+
+        family("claude_turns_in_flight", "gauge", "Turns running in kernels right now.",
+               [f"claude_turns_in_flight {sum(self.in_flight.values())}"])
+        family("claude_kernels", "gauge", "Running kernels that have reported a turn.",
+               [f"claude_kernels {len(self.kernels)}"])
+        counter("claude_turns_total", "Finished turns by backend and status.",
+                ("backend", "status"), self.turns)
+        family("claude_turn_duration_seconds", "histogram", "End-to-end turn time.",
+               list(self.duration.lines("claude_turn_duration_seconds", ("backend",))))
+        family("claude_turn_ttft_seconds", "histogram", "Time to the first thinking or answer text.",
+               list(self.ttft.lines("claude_turn_ttft_seconds", ("backend",))))
+        family("claude_turn_queue_seconds", "histogram", "Wait for a pooled CLI worker.",
+               list(self.queue.lines("claude_turn_queue_seconds", ())))
+        family("claude_tool_calls_total", "counter", "Tool calls made by the CLI.",
+               [f"claude_tool_calls_total {self.tool_calls}"])
+        family("claude_tool_seconds_total", "counter", "Wall time spent in tool calls.",
+               [f"claude_tool_seconds_total {self.tool_seconds:.6g}"])
+        family("claude_rate_limited_total", "counter", "Attempts refused by an API rate or usage limit.",
+               [f"claude_rate_limited_total {self.rate_limited}"])
+        family("claude_rate_wait_seconds_total", "counter", "Time turns spent queued behind a rate limit.",
+               [f"claude_rate_wait_seconds_total {self.rate_wait:.6g}"])
+        counter("claude_tokens_total", "Tokens reported by finished turns.",
+                ("backend", "kind"), self.tokens)
+        counter("claude_cost_usd_total", "Cost reported by the CLI.", ("backend",), self.cost)
+        counter("claude_cli_exits_total", "CLI processes that died mid-turn, by exit code.",
+                ("code",), self.exits)
+        processes = _cli_processes()
+        if processes is not None:
+            family("claude_cli_processes", "gauge", "Live claude CLI processes in the pod.",
+                   [f"claude_cli_processes {processes}"])
+        family("claude_metrics_dropped_total", "counter", "Malformed datagrams ignored.",
+               [f"claude_metrics_dropped_total {self.dropped}"])
+        if pool:
+            for key in _POOL_GAUGES:
+                if key in pool:
+                    family(f"claude_pool_{key}", "gauge", f"claude_pool {key}.",
+                           [f"claude_pool_{key} {pool[key]}"])
+            for key in _POOL_COUNTERS:
+                family(f"claude_pool_{key}_total", "counter", f"claude_pool {key}.",
+                       [f"claude_pool_{key}_total {pool.get(key, 0)}"])
+        return "\n".join(out) + "\n"
+
+
+class _Receiver(asyncio.DatagramProtocol):
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def datagram_received(self, data, addr):
+        try:
+            msg = json.loads(data)
+        except ValueError:
+            self.metrics.dropped += 1
+            return
+        if isinstance(msg, dict):
+            self.metrics.record(msg)
+        else:
+            self.metrics.dropped += 1
+
+
+async def _pool_stats():
+    """claude_pool's counters, or None if the pool isn't running."""
+    if not os.path.exists(_pool_socket):
+        return None
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_unix_connection(_pool_socket), 1)
+    except (OSError, asyncio.TimeoutError):
+        return None
+    try:
+        writer.write(b'{"op": "stats"}\n')
+        line = await asyncio.wait_for(reader.readline(), 1)
+        return json.loads(line or b"null")
+    except (OSError, ValueError, asyncio.TimeoutError):
+        return None
+    finally:
+        writer.close()
+
+
+async def _handle_http(metrics, reader, writer):
+    """Minimal HTTP/1.0 responder: GET /metrics, anything else 404."""
+    try:
+        request = await asyncio.wait_for(reader.readline(), 5)
+        while (await asyncio.wait_for(reader.readline(), 5)).strip():
+            pass  # headers
+        parts = request.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] in ("GET", "HEAD") and parts[1].split("?")[0] == "/metrics":
+            body = metrics.exposition(await _pool_stats()).encode("utf-8")
+            head = "200 OK", "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            body = b"not found\n"
+            head = "404 Not Found", "text/plain"
+        writer.write(
+            f"HTTP/1.0 {head[0]}\r\nContent-Type: {head[1]}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1")
+        )
+        if parts and parts[0] != "HEAD":
+            writer.write(body)
+        await writer.drain()
+    except (ConnectionError, asyncio.TimeoutError, UnicodeDecodeError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(metrics=None, path=None, port=None, addr=None):
+    """Receive kernel datagrams and serve /metrics until cancelled."""
+    metrics = metrics or Metrics()
+    path = path or _metrics_socket
+    port = _metrics_port if port is None else port
+    if os.path.exists(path):
+        os.unlink(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(path)
+    os.chmod(path, 0o600)
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(lambda: _Receiver(metrics), sock=sock)
+    server = await asyncio.start_server(
+        lambda r, w: _handle_http(metrics, r, w), addr or _metrics_addr, port,
+    )
+    try:
+        await asyncio.Future()
+    finally:
+        server.close()
+        transport.close()
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def _jupyter_server_extension_points():
+    return [{"module": "claude_metrics"}]
+
+
+def _load_jupyter_server_extension(serverapp):
+    if os.environ.get("CLAUDE_METRICS", "1") == "0":
+        serverapp.log.info("claude_metrics: disabled (CLAUDE_METRICS=0)")
+        return
+    from tornado.ioloop import IOLoop
+
+    def _start():
+        task = serverapp._claude_metrics_task = asyncio.ensure_future(serve())
+
+        def _done(t):
+            if not t.cancelled() and t.exception() is not None:
+                serverapp.log.warning(f"claude_metrics: stopped: {t.exception()}")
+
+        task.add_done_callback(_done)
+
+    # Kernels would otherwise keep sending into a dead socket until it is reused
+    atexit.register(lambda: os.path.exists(_metrics_socket) and os.unlink(_metrics_socket))
+
+    IOLoop.current().add_callback(_start)
+    serverapp.log.info(
+        f"claude_metrics: /metrics on {_metrics_addr}:{_metrics_port}, kernels report to {_metrics_socket}"
+    )
+
+
+# jupyter_server < 2 looks for the un-prefixed name
+load_jupyter_server_extension = _load_jupyter_server_extension
+
+
+async def _main():
+    task = asyncio.ensure_future(serve())
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, task.cancel)
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -0,0 +1,512 @@
+"""
+Pod-wide Claude CLI worker pool, run as a Jupyter server extension.
+
+Without it every kernel keeps its own warm `claude` process (see
+claude_magic._ClaudeWorker), so ten open notebooks mean ten Node heaps.
+This module runs inside the Jupyter server and owns a bounded set of
+stream-json workers shared by all kernels in the pod:
+
+- at most CLAUDE_POOL_SIZE processes live at once (spares included)
+- at most CLAUDE_POOL_SIZE turns run at once; the rest wait in a queue
+- waiting turns are granted round-robin across kernels, so one notebook
+  firing many prompts cannot starve the others
+- CLAUDE_POOL_SPARES processes are pre-spawned on session IDs kernels
+  reserve for their next conversation, hiding its cold start
+- idle workers are evicted least-recently-used when a slot is needed and
+  reaped after CLAUDE_POOL_IDLE seconds
+
+Each kernel keeps its own session ID; a worker is bound to one session and
+is reused for as long as it stays warm. A kernel that switches to a fresh
+session reserves its ID up front, so a spare runs under the ID the kernel
+chose rather than one the pool made up. Throwaway turns (ask_many, pipeline
+speculation) use a fresh session ID, or fork_from to continue a copy of the
+kernel's conversation (--resume s0 --fork-session), and stop it afterwards.
+
+Kernels talk to the pool over a Unix socket (CLAUDE_POOL_SOCKET), one
+connection per request, newline-delimited JSON:
+
+    -> {"op": "turn", "kernel": k, "session": s, "resume": bool, "new": bool,
+        "env": {...}, "prompt": "...", "fork_from": s0}  (fork_from optional)
+    <- {"type": "pool_queued", "position": n}         while waiting
+    <- {"type": "pool_grant", "wait_s": .., "spawned": bool}
+    <- the CLI's stream-json events, ending with its "result" event
+
+    -> {"op": "interrupt"}                            on the turn connection: SIGINT the CLI
+
+    -> {"op": "reserve", "session": s, "env": {...}}  pre-spawn a spare on s
+    -> {"op": "stop", "session": s}                   drop that session's worker
+    -> {"op": "stats"}        <- {"type": "pool_stats", ...}
+
+Closing the connection mid-turn kills the worker running it, since a CLI
+turn cannot be abandoned halfway. An interrupt gives it CLAUDE_INTERRUPT_GRACE
+seconds to flush partial output first.
+
+Enable with:
+    jupyter server extension enable claude_pool
+or the config file shipped in the image. Set CLAUDE_POOL=0 to disable.
+Standalone (debugging): python claude_pool.py
+"""
+import asyncio
+import atexit
+import codecs
+import collections
+import json
+import os
+import re
+import signal
+import time
+
+_pool_size = int(os.environ.get("CLAUDE_POOL_SIZE", "4"))
+_pool_spares = int(os.environ.get("CLAUDE_POOL_SPARES", "1"))
+_pool_idle_s = float(os.environ.get("CLAUDE_POOL_IDLE", "900"))
+_pool_socket = os.environ.get(
+    "CLAUDE_POOL_SOCKET", f"/tmp/claude-pool-{os.getuid()}.sock"
+)
+
+# After an interrupt, how long a CLI may keep streaming before it is killed
+_INTERRUPT_GRACE_S = float(os.environ.get("CLAUDE_INTERRUPT_GRACE", "3"))
+
+# Longest single stream-json line accepted from a worker
+_LINE_LIMIT = 64 * 1024 * 1024
+_RESULT_RE = re.compile(rb'^\s*\{\s*"type"\s*:\s*"result"')
+
+# Per-worker environment; must match claude_magic._WORKER_ENV_KEYS
+_ENV_KEYS = (
+    "http_proxy", "https_proxy", "HTTP_PROXY", "HTTPS_PROXY",
+    "all_proxy", "ALL_PROXY", "CLAUDE_CONFIG_DIR",
+)
+
+
+def _env_key(env):
+    return tuple((env or {}).get(k) for k in _ENV_KEYS)
+
+
+class _Worker:
+    """One warm `claude` stream-json process bound to a session ID."""
+
+    def __init__(self, session_id, env, fork_from=None):
+        self.session_id = session_id
+        self.fork_from = fork_from  # the CLI picks the fork's real ID; session_id is the pool key
+        self.env = dict(env or {})
+        self.proc = None
+        self.stderr_buf = collections.deque(maxlen=200)
+        self.busy = False
+        self.last_used = time.monotonic()
+
+    def alive(self):
+        return self.proc is not None and self.proc.returncode is None
+
+    async def start(self, resume):
+        env = {k: v for k, v in os.environ.items() if k not in _ENV_KEYS}
+        env.update({k: v for k, v in self.env.items() if v is not None})
+        if self.fork_from:
+            session_args = ["--resume", self.fork_from, "--fork-session"]
+        else:
+            session_args = ["--resume" if resume else "--session-id", self.session_id]
+        self.proc = await asyncio.create_subprocess_exec(
+            "claude", "-p",
+            *session_args,
+            "--input-format", "stream-json",
+            "--output-format", "stream-json",
+            "--verbose",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=os.environ.get("HOME", "/home/jovyan"),
+            env=env,
+            limit=_LINE_LIMIT,
+            start_new_session=True,  # signal tool subprocesses along with the CLI
+        )
+        asyncio.ensure_future(self._drain_stderr(self.proc))
+
+    async def _drain_stderr(self, proc):
+        # By chunk, not by line: an overlong line must not end the drain and
+        # leave the CLI blocked on a full stderr pipe
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        while chunk := await proc.stderr.read(65536):
+            self.stderr_buf.append(decoder.decode(chunk))
+
+    async def turn(self, prompt, writer):
+        """Send one prompt and relay events to `writer` up to the result event."""
+        msg = {
+            "type": "user",
+            "message": {"role": "user", "content": [{"type": "text", "text": prompt}]},
+        }
+        self.stderr_buf.clear()
+        self.proc.stdin.write((json.dumps(msg) + "\n").encode("utf-8"))
+        await self.proc.stdin.drain()
+        while True:
+            line = await self.proc.stdout.readline()
+            if not line:
+                # Worker died mid-turn: report it the way the CLI reports errors
+                code = await self.proc.wait()
+                stderr_text = "".join(self.stderr_buf).strip()
+                _write(writer, {
+                    "type": "result", "is_error": True,
+                    "result": f"claude exited with {code}: {stderr_text[:500]}",
+                })
+                await writer.drain()
+                return
+            writer.write(line)
+            await writer.drain()
+            if _RESULT_RE.match(line):
+                return
+
+    def interrupt(self):
+        if self.alive():
+            _signal_group(self.proc, signal.SIGINT)
+
+    async def stop(self, kill=False):
+        proc, self.proc = self.proc, None
+        if proc is None or proc.returncode is not None:
+            return
+        if kill:
+            _signal_group(proc, signal.SIGKILL)
+        else:
+            proc.stdin.close()
+        try:
+            await asyncio.wait_for(proc.wait(), 2)
+        except asyncio.TimeoutError:
+            _signal_group(proc, signal.SIGKILL)
+            await proc.wait()
+
+
+def _signal_group(proc, sig):
+    try:
+        os.killpg(proc.pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def _write(writer, obj):
+    writer.write((json.dumps(obj) + "\n").encode("utf-8"))
+
+
+class Pool:
+    """Bounded, fairly scheduled set of warm workers shared by all kernels."""
+
+    def __init__(self, size=_pool_size, spares=_pool_spares, idle_s=_pool_idle_s):
+        self.size = max(1, size)
+        self.spares_target = max(0, min(spares, self.size - 1))
+        self.idle_s = idle_s
+        self.workers = {}  # session ID -> _Worker
+        self.spares = []   # warm workers on reserved session IDs, no turn yet
+        self.reserved = collections.OrderedDict()  # session ID -> env, not spawned yet
+        self.active = 0
+        # kernel -> deque of waiting entries; dict order is the round-robin order
+        self.waiting = collections.OrderedDict()
+        self._seq = 0
+        self.counts = collections.Counter()
+
+    def live(self):
+        return len(self.workers) + len(self.spares)
+
+    def queued(self):
+        return sum(len(q) for q in self.waiting.values())
+
+    # --- admission -------------------------------------------------------
+
+    async def acquire(self, kernel, writer, gone):
+        """Wait for a turn slot, reporting the queue position to `writer`.
+
+        `gone` completes when the client disconnects; the request then leaves
+        the queue and ConnectionResetError is raised.
+        """
+        loop = asyncio.get_running_loop()
+        self._seq += 1
+        entry = {"seq": self._seq, "fut": loop.create_future(), "writer": writer, "pos": None}
+        self.waiting.setdefault(kernel, collections.deque()).append(entry)
+        self._schedule()
+        await writer.drain()
+        await asyncio.wait({entry["fut"], gone}, return_when=asyncio.FIRST_COMPLETED)
+        if not entry["fut"].done():
+            entry["fut"].cancel()  # _schedule skips it
+            raise ConnectionResetError
+
+    def release(self):
+        self.active -= 1
+        self._schedule()
+
+    def _schedule(self):
+        """Grant free slots round-robin across kernels, then report positions."""
+        while self.waiting and self.active < self.size:
+            kernel, q = self.waiting.popitem(last=False)
+            entry = q.popleft()
+            if q:
+                self.waiting[kernel] = q  # back of the rotation
+            if entry["fut"].done():
+                continue  # client went away while queued
+            self.active += 1
+            entry["fut"].set_result(None)
+        pending = sorted(
+            (e for q in self.waiting.values() for e in q if not e["fut"].done()),
+            key=lambda e: e["seq"],
+        )
+        for pos, entry in enumerate(pending, 1):
+            if entry["pos"] != pos:
+                entry["pos"] = pos
+                try:
+                    _write(entry["writer"], {"type": "pool_queued", "position": pos})
+                except (ConnectionError, RuntimeError):
+                    pass
+
+    # --- workers ---------------------------------------------------------
+
+    async def checkout(self, session, resume, new, env, fork_from=None):
+        """Return (worker, spawned) for a granted turn."""
+        worker = self.workers.get(session)
+        if worker is not None and (not worker.alive() or _env_key(worker.env) != _env_key(env)):
+            await self._drop(session)
+            worker = None
+        self.reserved.pop(session, None)
+        spare = next((w for w in self.spares if w.session_id == session), None)
+        if spare is not None:
+            usable = spare.alive() and _env_key(spare.env) == _env_key(env)
+            if worker is None and new and not fork_from and usable:
+                self.spares.remove(spare)
+                self.workers[session] = worker = spare
+                self.counts["spare_hits"] += 1
+            else:
+                await spare.stop(kill=True)
+                if spare in self.spares:
+                    self.spares.remove(spare)
+        spawned = False
+        if worker is None:
+            await self._make_room()
+            worker = _Worker(session, env, fork_from)
+            self.workers[session] = worker
+            await worker.start(resume)
+            self.counts["spawns"] += 1
+            spawned = True
+        worker.busy = True
+        return worker, spawned
+
+    def checkin(self, worker):
+        worker.busy = False
+        worker.last_used = time.monotonic()
+
+    async def _make_room(self):
+        """Evict spares, then the least recently used idle worker, until a slot is free."""
+        while self.live() >= self.size:
+            if self.spares:
+                spare = self.spares[0]
+                await spare.stop(kill=True)
+                if spare in self.spares:
+                    self.spares.remove(spare)
+            else:
+                idle = [w for w in self.workers.values() if not w.busy]
+                if not idle:
+                    return  # cannot happen while active <= size; don't spin
+                victim = min(idle, key=lambda w: w.last_used)
+                await self._drop(victim.session_id)
+            self.counts["evictions"] += 1
+
+    async def _drop(self, session, kill=False):
+        worker = self.workers.get(session)
+        if worker is not None:
+            # Count it in live() until the process is gone, so a process
+            # still winding down doesn't let another spawn past the cap
+            await worker.stop(kill=kill)
+            if self.workers.get(session) is worker:
+                del self.workers[session]
+
+    def reserve(self, session, env):
+        """Note a kernel's next session ID; refill() pre-spawns it when there is room."""
+        if not self.spares_target or session in self.workers:
+            return
+        self.reserved[session] = env
+        self.reserved.move_to_end(session)
+        while len(self.reserved) > self.spares_target:
+            self.reserved.popitem(last=False)  # oldest reservations lose out
+
+    async def refill(self):
+        """Spawn spares for reserved sessions while there is headroom and nothing is queued."""
+        while (self.reserved and len(self.spares) < self.spares_target
+               and self.live() < self.size and not self.queued()):
+            session, env = self.reserved.popitem(last=False)
+            spare = _Worker(session, env)
+            self.spares.append(spare)
+            try:
+                await spare.start(resume=False)
+            except OSError:
+                self.spares.remove(spare)
+                return  # CLI missing; kernels will report it on their own
+            self.counts["spawns"] += 1
+
+    async def reap(self):
+        """Stop workers and unclaimed spares idle longer than idle_s."""
+        now = time.monotonic()
+        for spare in list(self.spares):
+            if now - spare.last_used > self.idle_s or not spare.alive():
+                await spare.stop(kill=True)
+                if spare in self.spares:
+                    self.spares.remove(spare)
+                self.counts["reaped"] += 1
+        for session, worker in list(self.workers.items()):
+            if not worker.busy and (now - worker.last_used > self.idle_s or not worker.alive()):
+                await self._drop(session)
+                self.counts["reaped"] += 1
+
+    async def close(self):
+        for worker in list(self.workers.values()) + self.spares:
+            await worker.stop(kill=True)
+        self.workers.clear()
+        self.spares.clear()
+
+    def stats(self):
+        return {
+            "type": "pool_stats",
+            "size": self.size,
+            "live": self.live(),
+            "spares": len(self.spares),
+            "active": self.active,
+            "queued": self.queued(),
+            "kernels_waiting": len(self.waiting),
+            **self.counts,
+        }
+
+    # --- connections -----------------------------------------------------
+
+    async def handle(self, reader, writer):
+        try:
+            line = await reader.readline()
+            req = json.loads(line or b"{}")
+            op = req.get("op")
+            if op == "turn":
+                await self._handle_turn(req, reader, writer)
+            elif op == "reserve":
+                self.reserve(str(req.get("session")), req.get("env"))
+                _write(writer, {"type": "pool_ok"})
+                asyncio.ensure_future(self.refill())
+            elif op == "stop":
+                worker = self.workers.get(req.get("session"))
+                if worker is not None and not worker.busy:
+                    await self._drop(worker.session_id)
+                _write(writer, {"type": "pool_ok"})
+            elif op == "stats":
+                _write(writer, self.stats())
+            else:
+                _write(writer, {"type": "pool_error", "error": f"unknown op {op!r}"})
+            await writer.drain()
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_turn(self, req, reader, writer):
+        t0 = time.monotonic()
+        # Anything further from the kernel is a cancel: an interrupt line, or EOF
+        gone = asyncio.ensure_future(reader.readline())
+        try:
+            await self.acquire(str(req.get("kernel", "")), writer, gone)
+        except ConnectionError:
+            gone.cancel()
+            raise
+        worker = None
+        try:
+            worker, spawned = await self.checkout(
+                req["session"], bool(req.get("resume")), bool(req.get("new")), req.get("env"),
+                req.get("fork_from"),
+            )
+            _write(writer, {
+                "type": "pool_grant", "wait_s": round(time.monotonic() - t0, 3), "spawned": spawned,
+            })
+            self.counts["turns"] += 1
+            turn = asyncio.ensure_future(worker.turn(req.get("prompt", ""), writer))
+            done, _ = await asyncio.wait({turn, gone}, return_when=asyncio.FIRST_COMPLETED)
+            if turn not in done and gone.result():
+                # {"op": "interrupt"}: SIGINT the CLI and keep relaying what it
+                # flushes while winding down; kill it if it overstays the grace
+                self.counts["interrupted"] += 1
+                worker.interrupt()
+                gone = asyncio.ensure_future(reader.read())
+                done, _ = await asyncio.wait(
+                    {turn, gone}, timeout=_INTERRUPT_GRACE_S, return_when=asyncio.FIRST_COMPLETED,
+                )
+            if turn not in done:
+                turn.cancel()
+                raise ConnectionResetError
+            turn.result()
+        except (ConnectionError, asyncio.CancelledError):
+            if worker is not None:
+                self.counts["cancelled"] += 1
+                await self._drop(worker.session_id, kill=True)
+                worker = None
+            raise ConnectionResetError
+        except ValueError as e:
+            # A stdout line past _LINE_LIMIT: the rest of the turn is still in
+            # the pipe, so the process can't serve another turn
+            if worker is not None:
+                await self._drop(worker.session_id, kill=True)
+                worker = None
+            _write(writer, {"type": "result", "is_error": True, "result": f"pool: {e}"})
+        except OSError as e:
+            _write(writer, {"type": "result", "is_error": True, "result": f"pool: {e}"})
+        finally:
+            gone.cancel()
+            if worker is not None:
+                self.checkin(worker)
+            self.release()
+            asyncio.ensure_future(self.refill())
+
+
+async def serve(pool=None, path=None):
+    """Listen on the pool socket until cancelled."""
+    pool = pool or Pool()
+    path = path or _pool_socket
+    if os.path.exists(path):
+        os.unlink(path)
+    server = await asyncio.start_unix_server(pool.handle, path, limit=_LINE_LIMIT)
+    os.chmod(path, 0o600)
+    await pool.refill()
+    try:
+        while True:
+            await asyncio.sleep(min(60.0, pool.idle_s))
+            await pool.reap()
+            await pool.refill()
+    finally:
+        server.close()
+        await pool.close()
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def _jupyter_server_extension_points():
+    return [{"module": "claude_pool"}]
+
+
+def _load_jupyter_server_extension(serverapp):
+    if os.environ.get("CLAUDE_POOL", "1") == "0":
+        serverapp.log.info("claude_pool: disabled (CLAUDE_POOL=0)")
+        return
+    from tornado.ioloop import IOLoop
+
+    def _start():
+        serverapp._claude_pool_task = asyncio.ensure_future(serve())
+
+    # Don't leave a dead socket behind for kernels to trip over
+    atexit.register(lambda: os.path.exists(_pool_socket) and os.unlink(_pool_socket))
+
+    IOLoop.current().add_callback(_start)
+    serverapp.log.info(
+        f"claude_pool: {_pool_size} workers, {_pool_spares} spare(s) on {_pool_socket}"
+    )
+
+
+# jupyter_server < 2 looks for the un-prefixed name
+load_jupyter_server_extension = _load_jupyter_server_extension
+
+
+async def _main():
+    task = asyncio.ensure_future(serve())
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, task.cancel)
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
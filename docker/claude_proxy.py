@@ -0,0 +1,478 @@
+"""
+Pod-local forwarding proxy with failover across the PROXY_URLS pool.
+
+`%proxy mullvad` points the proxy env vars at one upstream, so a stalled
+endpoint hangs every new connection until the client gives up. `%proxy
+local` (or `proxy-local` in a terminal) starts this process instead and
+points everything in the pod at http://127.0.0.1:PROXY_LOCAL_PORT:
+
+- CONNECT and absolute-URI HTTP requests are forwarded through the upstream
+  pool (http(s):// proxies via CONNECT, socks5(h):// via SOCKS5)
+- the client gets its "200 Connection established" only once an upstream
+  has opened the tunnel, so if an upstream refuses or stalls for more than
+  PROXY_CONNECT_TIMEOUT seconds, the next one is tried
+- the upstream that last worked stays primary, so the exit IP is stable
+  until it fails
+- every PROXY_HEALTH_INTERVAL seconds each upstream is probed by opening a
+  tunnel to PROXY_PROBE_TARGET; dead ones are skipped until they recover
+- PROXY_WARM connected (and, for SOCKS5, authenticated) connections are
+  kept to each of the two preferred upstreams, so a new tunnel costs one
+  round trip instead of a TCP connect plus handshake
+
+A tunnel that is already open cannot move to another upstream, since the
+TLS session inside it belongs to that connection. If its upstream dies, the
+client sees the connection drop, and its retry gets a healthy upstream.
+
+Only 127.0.0.1 is bound. `GET /status` on the proxy itself returns JSON
+with the upstream table, which `%proxy status` prints.
+
+Usage:
+    python claude_proxy.py [--port 3128]
+"""
+import argparse
+import asyncio
+import base64
+import collections
+import ipaddress
+import json
+import os
+import signal
+import time
+import urllib.parse
+
+_local_port = int(os.environ.get("PROXY_LOCAL_PORT", "3128"))
+_connect_timeout_s = float(os.environ.get("PROXY_CONNECT_TIMEOUT", "5"))
+_health_interval_s = float(os.environ.get("PROXY_HEALTH_INTERVAL", "30"))
+_warm = int(os.environ.get("PROXY_WARM", "2"))
+_probe_target = os.environ.get("PROXY_PROBE_TARGET", "api64.ipify.org:443")
+
+# Upstreams drop idle connections; replace warm ones before they would
+_WARM_TTL_S = 20.0
+_WARM_UPSTREAMS = 2
+# Upstreams tried per client connection before it gets a 502
+_MAX_TRIES = 3
+_HEAD_LIMIT = 64 * 1024
+_CHUNK = 64 * 1024
+
+
+def _split_target(target, default_port=443):
+    host, sep, port = target.rpartition(":")
+    if not sep or not port.isdigit() or "]" in port:
+        return target.strip("[]"), default_port
+    return host.strip("[]"), int(port)
+
+
+class _Refused(ConnectionError):
+    """The upstream answered but would not reach the target (not a dead upstream)."""
+
+
+async def _recv_exact(reader, n):
+    try:
+        return await reader.readexactly(n)
+    except asyncio.IncompleteReadError:
+        raise ConnectionError("proxy closed the connection") from None
+
+
+async def _socks5_hello(reader, writer, username=None, password=None):
+    methods = b"\x00\x02" if username else b"\x00"
+    writer.write(b"\x05" + bytes([len(methods)]) + methods)
+    ver, method = await _recv_exact(reader, 2)
+    if ver != 5 or method == 0xFF:
+        raise ConnectionError("SOCKS5 auth method rejected")
+    if method == 2:
+        user = urllib.parse.unquote(username or "").encode()
+        pw = urllib.parse.unquote(password or "").encode()
+        writer.write(b"\x01" + bytes([len(user)]) + user + bytes([len(pw)]) + pw)
+        if (await _recv_exact(reader, 2))[1] != 0:
+            raise ConnectionError("SOCKS5 authentication failed")
+
+
+async def _socks5_connect(reader, writer, host, port):
+    try:
+        ip = ipaddress.ip_address(host)
+        addr = (b"\x01" if ip.version == 4 else b"\x04") + ip.packed
+    except ValueError:
+        name = host.encode("idna")
+        addr = b"\x03" + bytes([len(name)]) + name
+    writer.write(b"\x05\x01\x00" + addr + port.to_bytes(2, "big"))
+    _, rep, _, atyp = await _recv_exact(reader, 4)
+    if rep != 0:
+        raise (ConnectionError if rep in (1, 2, 7, 8) else _Refused)(f"SOCKS5 connect failed (code {rep})")
+    await _recv_exact(reader, {1: 4, 4: 16}.get(atyp) or (await _recv_exact(reader, 1))[0])
+    await _recv_exact(reader, 2)
+
+
+async def _read_head(reader):
+    """Read an HTTP head up to the blank line; b"" if the peer closed first."""
+    try:
+        return await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise ConnectionError("connection closed mid-header") from None
+        return b""
+    except asyncio.LimitOverrunError:
+        raise ConnectionError("oversized HTTP header") from None
+
+
+def _close(writer):
+    try:
+        writer.close()
+    except Exception:
+        pass
+
+
+class Upstream:
+    """One PROXY_URLS endpoint: health, latency and a few warm connections."""
+
+    def __init__(self, index, url):
+        parts = urllib.parse.urlsplit(url if "://" in url else "http://" + url)
+        self.index = index
+        self.url = url
+        self.socks = parts.scheme.lower().startswith("socks")
+        self.host = parts.hostname
+        self.port = parts.port or (1080 if self.socks else 8080)
+        self.username, self.password = parts.username, parts.password
+        self.label = f"{self.host}:{self.port}"
+        self.healthy = None        # None until the first probe or tunnel
+        self.latency_s = None      # EWMA of tunnel setup time
+        self.error = None
+        self.checked = 0.0
+        self.active = 0
+        self.counts = collections.Counter()  # tunnels, failures, warm_hits
+        self.idle = collections.deque()      # (reader, writer, since)
+
+    def auth_header(self):
+        if not self.username:
+            return b""
+        token = base64.b64encode(
+            f"{urllib.parse.unquote(self.username)}:{urllib.parse.unquote(self.password or '')}".encode()
+        )
+        return b"Proxy-Authorization: Basic " + token + b"\r\n"
+
+    async def connect(self):
+        """A new connection to the upstream, past the SOCKS5 greeting."""
+        reader, writer = await asyncio.open_connection(self.host, self.port, limit=_HEAD_LIMIT)
+        try:
+            if self.socks:
+                await _socks5_hello(reader, writer, self.username, self.password)
+        except BaseException:
+            _close(writer)
+            raise
+        return reader, writer
+
+    def prune_warm(self):
+        """Close warm connections that are too old or that the upstream has closed."""
+        now = time.monotonic()
+        for entry in list(self.idle):
+            reader, writer, since = entry
+            if now - since >= _WARM_TTL_S or reader.at_eof() or writer.is_closing():
+                self.idle.remove(entry)
+                _close(writer)
+
+    def take_warm(self):
+        self.prune_warm()
+        if not self.idle:
+            return None
+        self.counts["warm_hits"] += 1
+        return self.idle.popleft()[:2]
+
+    def drop_warm(self):
+        while self.idle:
+            _close(self.idle.popleft()[1])
+
+    async def tunnel(self, host, port, warm=True, plain=False):
+        """Open a tunnel to host:port; returns (reader, writer) carrying its bytes.
+
+        With `plain`, an HTTP upstream is returned as is, for forwarding an
+        absolute-URI request (SOCKS5 upstreams still tunnel).
+        """
+        conn = self.take_warm() if warm else None
+        if conn is None:
+            conn = await self.connect()
+        reader, writer = conn
+        try:
+            if self.socks:
+                await _socks5_connect(reader, writer, host, port)
+            elif not plain:
+                authority = f"[{host}]:{port}" if ":" in host else f"{host}:{port}"
+                writer.write(f"CONNECT {authority} HTTP/1.1\r\nHost: {authority}\r\n".encode()
+                             + self.auth_header() + b"\r\n")
+                head = await _read_head(reader)
+                status = head.split(b"\r\n", 1)[0].decode("latin-1")
+                code = status.split()[1] if len(status.split()) > 1 else ""
+                if code != "200":
+                    raise (_Refused if code in ("502", "503", "504") else ConnectionError)(
+                        status or "empty CONNECT response")
+        except BaseException:
+            _close(writer)
+            raise
+        return reader, writer
+
+    def mark(self, ok, seconds=None, error=None):
+        self.checked = time.time()
+        self.healthy = ok
+        self.error = error
+        if ok and seconds is not None:
+            self.latency_s = seconds if self.latency_s is None else 0.7 * self.latency_s + 0.3 * seconds
+        if not ok:
+            self.counts["failures"] += 1
+            self.drop_warm()
+
+    def describe(self):
+        return {
+            "index": self.index, "label": self.label, "socks": self.socks,
+            "healthy": self.healthy, "latency_s": self.latency_s, "error": self.error,
+            "checked": self.checked, "active": self.active, "warm": len(self.idle),
+            **self.counts,
+        }
+
+
+class Proxy:
+    """Forwards client connections through the healthiest upstream, failing over."""
+
+    def __init__(self, urls, connect_timeout_s=_connect_timeout_s, warm=_warm,
+                 probe_target=_probe_target):
+        self.upstreams = [Upstream(i, u) for i, u in enumerate(urls)]
+        self.primary = None
+        self.connect_timeout_s = connect_timeout_s
+        self.warm = warm
+        self.probe_target = _split_target(probe_target)
+        self.counts = collections.Counter()  # clients, failovers, failed, bytes_up, bytes_down
+        self.started = time.time()
+        self._refilling = False
+
+    def ranked(self):
+        """Upstreams in the order to try: primary, healthy by latency, unknown, dead."""
+        def key(u):
+            state = {True: 0, None: 1, False: 2}[u.healthy]
+            return (u is not self.primary or u.healthy is False, state,
+                    u.latency_s if u.latency_s is not None else float("inf"),
+                    u.checked if u.healthy is False else u.index)
+        return sorted(self.upstreams, key=key)
+
+    async def open(self, host, port, plain=False):
+        """Tunnel to host:port through the first upstream that answers in time."""
+        errors = []
+        refused = 0
+        for attempt, up in enumerate(self.ranked()[:_MAX_TRIES]):
+            for warm in (True, False):
+                t0 = time.monotonic()
+                had_warm = warm and bool(up.idle)
+                try:
+                    conn = await asyncio.wait_for(up.tunnel(host, port, warm, plain),
+                                                  self.connect_timeout_s)
+                except (OSError, ValueError, asyncio.TimeoutError) as e:
+                    error = "timeout" if isinstance(e, asyncio.TimeoutError) else str(e) or type(e).__name__
+                    if isinstance(e, _Refused):
+                        refused += 1
+                    elif had_warm and not isinstance(e, asyncio.TimeoutError):
+                        continue  # a warm connection went stale; retry fresh on the same upstream
+                    else:
+                        up.mark(False, error=error)
+                    errors.append(f"{up.label}: {error}")
+                    break
+                up.mark(True, time.monotonic() - t0)
+                up.counts["tunnels"] += 1
+                if up is not self.primary:
+                    if attempt:
+                        self.counts["failovers"] += 1
+                    self.primary = up
+                self._refill_soon()
+                return up, conn
+            if refused >= 2:
+                break  # two exits could not reach it; the target is the problem
+        raise ConnectionError("; ".join(errors) or "no upstreams configured")
+
+    async def _pipe(self, reader, writer, key):
+        """Copy until EOF, then half-close; False if either side broke."""
+        try:
+            while True:
+                data = await reader.read(_CHUNK)
+                if not data:
+                    break
+                self.counts[key] += len(data)
+                writer.write(data)
+                await writer.drain()
+            if writer.can_write_eof():
+                writer.write_eof()
+            return True
+        except (OSError, RuntimeError):
+            return False
+
+    async def _relay(self, up, client, upstream):
+        (c_reader, c_writer), (u_reader, u_writer) = client, upstream
+        up.active += 1
+        pipes = {asyncio.ensure_future(self._pipe(c_reader, u_writer, "bytes_up")),
+                 asyncio.ensure_future(self._pipe(u_reader, c_writer, "bytes_down"))}
+        try:
+            done, pending = await asyncio.wait(pipes, return_when=asyncio.FIRST_COMPLETED)
+            if pending and all(t.result() for t in done):
+                await asyncio.wait(pending)
+        finally:
+            up.active -= 1
+            _close(u_writer)
+            _close(c_writer)
+            for task in pipes:
+                task.cancel()
+
+    def _reply(self, writer, status, body=b"", content_type="text/plain"):
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+
+    async def handle(self, reader, writer):
+        self.counts["clients"] += 1
+        try:
+            head = await _read_head(reader)
+            if not head:
+                return
+            request_line, _, headers = head.partition(b"\r\n")
+            parts = request_line.decode("latin-1").split()
+            if len(parts) != 3:
+                self._reply(writer, "400 Bad Request", b"malformed request line\n")
+                return
+            method, target, version = parts
+            if method == "CONNECT":
+                await self._connect(reader, writer, target)
+            elif target.startswith("http://"):
+                await self._forward(reader, writer, method, target, version, headers)
+            elif method == "GET" and target == "/status":
+                body = json.dumps(self.status()).encode()
+                self._reply(writer, "200 OK", body, "application/json")
+            else:
+                self._reply(writer, "400 Bad Request", b"only CONNECT and http:// requests are proxied\n")
+        except (OSError, ValueError):
+            pass
+        finally:
+            try:
+                await writer.drain()
+            except OSError:
+                pass
+            _close(writer)
+
+    async def _connect(self, reader, writer, target):
+        host, port = _split_target(target)
+        try:
+            up, conn = await self.open(host, port)
+        except ConnectionError as e:
+            self.counts["failed"] += 1
+            self._reply(writer, "502 Bad Gateway", f"all upstreams failed: {e}\n".encode())
+            return
+        writer.write(b"HTTP/1.1 200 Connection established\r\n\r\n")
+        await self._relay(up, (reader, writer), conn)
+
+    async def _forward(self, reader, writer, method, target, version, headers):
+        url = urllib.parse.urlsplit(target)
+        # One request per client connection: a keep-alive client could
+        # otherwise send its next request for another host down this tunnel
+        kept = [h for h in headers.split(b"\r\n") if h and not h.lower().startswith(
+            (b"connection:", b"proxy-connection:", b"keep-alive:", b"proxy-authorization:"))]
+        try:
+            up, conn = await self.open(url.hostname, url.port or 80, plain=True)
+        except ConnectionError as e:
+            self.counts["failed"] += 1
+            self._reply(writer, "502 Bad Gateway", f"all upstreams failed: {e}\n".encode())
+            return
+        if up.socks:
+            path = urllib.parse.urlunsplit(("", "", url.path or "/", url.query, ""))
+            line = f"{method} {path} {version}\r\n".encode()
+        else:
+            line = f"{method} {target} {version}\r\n".encode() + up.auth_header()
+        conn[1].write(line + b"".join(h + b"\r\n" for h in kept) + b"Connection: close\r\n\r\n")
+        await self._relay(up, (reader, writer), conn)
+
+    # --- health and warm connections --------------------------------------
+
+    async def probe(self, up):
+        t0 = time.monotonic()
+        try:
+            _, writer = await asyncio.wait_for(up.tunnel(*self.probe_target, warm=False),
+                                               self.connect_timeout_s)
+        except _Refused as e:
+            up.mark(True, error=str(e))  # up, though it can't reach the probe target
+            return
+        except (OSError, ValueError, asyncio.TimeoutError) as e:
+            up.mark(False, error="timeout" if isinstance(e, asyncio.TimeoutError) else str(e) or type(e).__name__)
+            return
+        _close(writer)
+        up.mark(True, time.monotonic() - t0)
+
+    async def check(self):
+        """Probe every upstream at once; move off the primary if it died."""
+        await asyncio.gather(*(self.probe(u) for u in self.upstreams))
+        if self.primary is None or self.primary.healthy is False:
+            healthy = [u for u in self.ranked() if u.healthy]
+            if healthy and self.primary is not None:
+                self.counts["failovers"] += 1
+            self.primary = healthy[0] if healthy else self.primary
+        await self.refill()
+
+    def _refill_soon(self):
+        if not self._refilling:
+            asyncio.ensure_future(self.refill())
+
+    async def refill(self):
+        """Top up warm connections on the preferred upstreams; drop them elsewhere."""
+        if self._refilling:
+            return
+        self._refilling = True
+        try:
+            preferred = [u for u in self.ranked() if u.healthy][:_WARM_UPSTREAMS]
+            for up in self.upstreams:
+                if up not in preferred:
+                    up.drop_warm()
+            for up in preferred:
+                up.prune_warm()
+                while len(up.idle) < self.warm:
+                    try:
+                        reader, writer = await asyncio.wait_for(up.connect(), self.connect_timeout_s)
+                    except (OSError, asyncio.TimeoutError):
+                        break
+                    up.idle.append((reader, writer, time.monotonic()))
+        finally:
+            self._refilling = False
+
+    def status(self):
+        return {
+            "pid": os.getpid(),
+            "uptime_s": time.time() - self.started,
+            "primary": self.primary.index if self.primary else None,
+            "probe_target": ":".join(map(str, self.probe_target)),
+            "connect_timeout_s": self.connect_timeout_s,
+            "upstreams": [u.describe() for u in self.upstreams],
+            **self.counts,
+        }
+
+
+async def serve(proxy, port=_local_port, health_interval_s=_health_interval_s, ready=None):
+    """Listen on 127.0.0.1:port until cancelled, re-checking upstreams periodically."""
+    server = await asyncio.start_server(proxy.handle, "127.0.0.1", port, limit=_HEAD_LIMIT)
+    if ready is not None:
+        ready(server.sockets[0].getsockname()[1])
+    try:
+        while True:
+            await proxy.check()
+            await asyncio.sleep(health_interval_s)
+    finally:
+        server.close()
+        for up in proxy.upstreams:
+            up.drop_warm()
+
+
+async def _main(port):
+    urls = [u.strip() for u in os.environ.get("PROXY_URLS", "").split(",") if u.strip()]
+    if not urls:
+        raise SystemExit("claude_proxy: PROXY_URLS is empty")
+    task = asyncio.ensure_future(serve(Proxy(urls), port))
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, task.cancel)
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    ap.add_argument("--port", type=int, default=_local_port)
+    asyncio.run(_main(ap.parse_args().port))
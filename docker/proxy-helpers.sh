@@ -1,6 +1,7 @@
 #!/usr/bin/env bash
 # proxy-helpers.sh — sourced by .bashrc
 # Shell functions to route terminal traffic through Mullvad or Tor.
+# proxy-local shares the kernels' claude_proxy.py failover proxy.
 # Mirrors the %proxy IPython magic in claude_magic.py.
 
 proxy-mullvad() {
@@ -32,6 +33,40 @@ proxy-mullvad() {
     echo
 }
 
+proxy-local() {
+    local port="${PROXY_LOCAL_PORT:-3128}"
+    local url="http://127.0.0.1:$port"
+    if [ -z "${PROXY_URLS:-}" ]; then
+        echo "No PROXY_URLS configured. Set mullvad.proxySecretName in Helm values." >&2
+        return 1
+    fi
+    if [ "${1:-}" = "stop" ]; then
+        local pid
+        pid=$(curl -s --max-time 2 --noproxy '*' "$url/status" | python3 -c "import sys,json; print(json.load(sys.stdin)['pid'])" 2>/dev/null)
+        [ -n "$pid" ] && kill "$pid" && echo "→ Local proxy stopped (pid $pid)."
+        return 0
+    fi
+    if ! curl -s --max-time 2 --noproxy '*' "$url/status" >/dev/null; then
+        if [ ! -f /opt/ai/claude_proxy.py ]; then
+            echo "/opt/ai/claude_proxy.py not found in this image." >&2
+            return 1
+        fi
+        nohup python3 /opt/ai/claude_proxy.py --port "$port" >> "/tmp/claude-proxy-$(id -u).log" 2>&1 &
+        disown
+        local i
+        for i in $(seq 50); do
+            curl -s --max-time 1 --noproxy '*' "$url/status" >/dev/null && break
+            sleep 0.1
+        done
+    fi
+    export http_proxy="$url" https_proxy="$url" HTTP_PROXY="$url" HTTPS_PROXY="$url"
+    unset all_proxy ALL_PROXY
+    echo "→ Local proxy: $url (failover across PROXY_URLS)"
+    echo -n "  Exit IP: "
+    curl -s --max-time 10 --proxy "$url" https://api64.ipify.org
+    echo
+}
+
 proxy-tor() {
     local tor="socks5h://127.0.0.1:9050"
     local check